@@ -0,0 +1,255 @@
+import asyncio
+import os
+import queue
+import socket
+import threading
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5037
+EXIT_MARK = "@@PTM_EXIT@@"
+
+
+class AdbError(RuntimeError):
+    pass
+
+
+def _encode_request(payload):
+    data = payload.encode("utf-8")
+    return f"{len(data):04x}".encode("ascii") + data
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise AdbError("adb server 連線中斷。")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _read_status(sock):
+    status = _recv_exact(sock, 4)
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        length = int(_recv_exact(sock, 4), 16)
+        msg = _recv_exact(sock, length).decode("utf-8", "replace")
+        raise AdbError(msg or "adb server 回傳 FAIL")
+    raise AdbError(f"adb server 回應格式錯誤: {status!r}")
+
+
+def _send_request(sock, payload):
+    sock.sendall(_encode_request(payload))
+    _read_status(sock)
+
+
+async def _async_send_request(reader, writer, payload):
+    writer.write(_encode_request(payload))
+    await writer.drain()
+    status = await reader.readexactly(4)
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        length = int(await reader.readexactly(4), 16)
+        msg = (await reader.readexactly(length)).decode("utf-8", "replace")
+        raise AdbError(msg or "adb server 回傳 FAIL")
+    raise AdbError(f"adb server 回應格式錯誤: {status!r}")
+
+
+def _split_exit_status(data, command):
+    text = data.decode("utf-8", "replace")
+    idx = text.rfind(EXIT_MARK)
+    if idx == -1:
+        raise AdbError(f"Command failed: {command}")
+    status = text[idx + len(EXIT_MARK):].strip()
+    out = text[:idx]
+    if status != "0":
+        raise AdbError(out.strip() or f"Command failed: {command}")
+    return out
+
+
+def parse_devices_text(text):
+    devices = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[1] == "device":
+            devices.append(parts[0])
+    return devices
+
+
+# Talks the adb host protocol to the local adb server directly. The server
+# closes a connection once a `shell:`/`exec:` service finishes, so the pool
+# keeps spare connections per serial that were already switched with
+# `host:transport:<serial>`; a query then costs one request on an open socket
+# instead of forking `adb`.
+class AdbSocketClient:
+
+    def __init__(self, host=None, port=None, pool_size=2):
+        self.host = host or DEFAULT_HOST
+        self.port = int(port or os.environ.get("ANDROID_ADB_SERVER_PORT") or DEFAULT_PORT)
+        self.pool_size = pool_size
+        self._pool = {}
+        self._lock = threading.Lock()
+        self._refill_queue = queue.Queue()
+        self._refill_thread = None
+
+    def _connect(self, timeout):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        except socket.timeout:
+            raise AdbError("連線 adb server 逾時。")
+        except OSError as e:
+            raise AdbError(
+                f"無法連線到 adb server ({self.host}:{self.port})，請先執行 adb start-server。({e})"
+            )
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _open_transport(self, serial, timeout):
+        sock = self._connect(timeout)
+        try:
+            _send_request(sock, f"host:transport:{serial}")
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _checkout(self, serial, timeout):
+        with self._lock:
+            spares = self._pool.get(serial)
+            sock = spares.pop() if spares else None
+        if sock is not None:
+            sock.settimeout(timeout)
+            return sock, True
+        return self._open_transport(serial, timeout), False
+
+    def _refill(self, serial, timeout):
+        with self._lock:
+            if len(self._pool.get(serial, ())) >= self.pool_size:
+                return
+        try:
+            sock = self._open_transport(serial, timeout)
+        except AdbError:
+            return
+        with self._lock:
+            spares = self._pool.setdefault(serial, [])
+            if len(spares) < self.pool_size:
+                spares.append(sock)
+                return
+        sock.close()
+
+    def _refill_worker(self):
+        while True:
+            item = self._refill_queue.get()
+            if item is None:
+                return
+            self._refill(*item)
+
+    def _schedule_refill(self, serial, timeout):
+        # Opening the replacement happens off the caller's path so the next
+        # query finds a connection that is already on the device transport.
+        if self._refill_thread is None or not self._refill_thread.is_alive():
+            self._refill_thread = threading.Thread(target=self._refill_worker, daemon=True)
+            self._refill_thread.start()
+        self._refill_queue.put((serial, timeout))
+
+    def _service(self, serial, service, timeout):
+        sock, pooled = self._checkout(serial, timeout)
+        try:
+            try:
+                _send_request(sock, service)
+            except (AdbError, OSError):
+                if not pooled:
+                    raise
+                # The spare went stale (device reconnected, server restarted).
+                sock.close()
+                sock = self._open_transport(serial, timeout)
+                _send_request(sock, service)
+            data = _recv_all(sock)
+        except socket.timeout:
+            raise AdbError("執行 adb 逾時，請確認裝置連線正常。")
+        finally:
+            sock.close()
+        self._schedule_refill(serial, timeout)
+        return data
+
+    def devices(self, timeout=5):
+        sock = self._connect(timeout)
+        try:
+            _send_request(sock, "host:devices")
+            length = int(_recv_exact(sock, 4), 16)
+            text = _recv_exact(sock, length).decode("utf-8", "replace")
+        except socket.timeout:
+            raise AdbError("執行 adb 逾時，請確認裝置連線正常。")
+        finally:
+            sock.close()
+        return parse_devices_text(text)
+
+    def shell(self, serial, command, timeout=5):
+        if not isinstance(command, str):
+            command = " ".join(command)
+        data = self._service(serial, f"exec:{command}; echo {EXIT_MARK}$?", timeout)
+        return _split_exit_status(data, command)
+
+    async def shell_async(self, serial, command, timeout=5):
+        if not isinstance(command, str):
+            command = " ".join(command)
+
+        async def _run():
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                raise AdbError(
+                    f"無法連線到 adb server ({self.host}:{self.port})，請先執行 adb start-server。({e})"
+                )
+            try:
+                await _async_send_request(reader, writer, f"host:transport:{serial}")
+                await _async_send_request(reader, writer, f"exec:{command}; echo {EXIT_MARK}$?")
+                return await reader.read()
+            except asyncio.IncompleteReadError:
+                raise AdbError("adb server 連線中斷。")
+            finally:
+                writer.close()
+
+        try:
+            data = await asyncio.wait_for(_run(), timeout)
+        except asyncio.TimeoutError:
+            raise AdbError("執行 adb 逾時，請確認裝置連線正常。")
+        return _split_exit_status(data, command)
+
+    def open_stream(self, serial, command, timeout=5):
+        # Long-lived `exec:` service; the caller reads the socket until the
+        # device side exits or the socket is closed.
+        sock = self._open_transport(serial, timeout)
+        try:
+            _send_request(sock, f"exec:{command}")
+        except Exception:
+            sock.close()
+            raise
+        sock.settimeout(None)
+        return sock
+
+    def close(self):
+        if self._refill_thread is not None:
+            self._refill_queue.put(None)
+            self._refill_thread = None
+        with self._lock:
+            pools, self._pool = self._pool, {}
+        for spares in pools.values():
+            for sock in spares:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
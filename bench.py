@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import fake_adb
+import phone_temp_monitor as ptm
+
+
+# Runs the sampling pipeline against fake_adb.py and reports, per mode and
+# device count: ticks/sec, p50/p99 tick latency, host subprocesses and adb
+# calls per tick, plus parser micro-benchmarks. --save/--compare turn it into a
+# regression gate.
+#
+#   python bench.py --devices 1,4,16 --seconds 5 --latency-ms 15
+#   python bench.py --save baseline.json
+#   python bench.py --compare baseline.json --tolerance 0.25
+MODES = ("legacy", "batched", "scan", "async", "stream")
+SCAN = ptm.ProcessScan(top_n=10)
+PACKAGE = "com.example.app"
+
+
+class SpawnCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        # Only host-side adb spawns count; the in-process socket server runs
+        # the device shell itself.
+        if event == "subprocess.Popen" and os.path.basename(str(args[0])) == "adb":
+            with self._lock:
+                self.count += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _legacy_tick(serial, cpu_prev):
+    ptm.get_phone_temperature(serial)
+    ptm.get_system_memory_kb(serial)
+    ptm.get_process_metrics(serial, PACKAGE, cpu_prev)
+
+
+def run_sequential(serials, seconds, tick):
+    cpu_prev = {s: {} for s in serials}
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for serial in serials:
+            t0 = time.perf_counter()
+            try:
+                tick(serial, cpu_prev[serial])
+            except RuntimeError:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+    return latencies, errors
+
+
+def run_batched(serials, seconds):
+    return run_sequential(
+        serials, seconds,
+        lambda serial, cpu_prev: ptm.collect_snapshot(serial, PACKAGE, cpu_prev),
+    )
+
+
+def run_scan(serials, seconds):
+    return run_sequential(
+        serials, seconds,
+        lambda serial, cpu_prev: ptm.collect_snapshot(serial, PACKAGE, cpu_prev, scan=SCAN),
+    )
+
+
+def run_legacy(serials, seconds):
+    return run_sequential(serials, seconds, _legacy_tick)
+
+
+def run_async(serials, seconds, interval_ms=1):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def on_result(serial, now_dt, snap, error):
+        elapsed = time.time() - now_dt.timestamp()
+        with lock:
+            latencies.append(elapsed)
+            if error is not None:
+                errors[0] += 1
+
+    monitor = ptm.MultiDeviceMonitor(serials, PACKAGE, interval_ms, on_result)
+    monitor.start()
+    time.sleep(seconds)
+    monitor.stop()
+    monitor.join(5)
+    return latencies, errors[0]
+
+
+def run_stream(serials, seconds, interval_ms=ptm.STREAM_MIN_INTERVAL_MS):
+    samplers = [ptm.StreamSampler(serial, PACKAGE, interval_ms) for serial in serials]
+    for sampler in samplers:
+        sampler.start()
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    last = {}
+    try:
+        while time.perf_counter() < deadline:
+            time.sleep(ptm.STREAM_DRAIN_MS / 1000.0)
+            for sampler in samplers:
+                try:
+                    frames = sampler.drain()
+                except RuntimeError:
+                    errors += 1
+                    continue
+                for now_dt, _ in frames:
+                    ts = now_dt.timestamp()
+                    # Frame spacing stands in for latency: the device paces itself.
+                    if sampler.serial in last:
+                        latencies.append(ts - last[sampler.serial])
+                    last[sampler.serial] = ts
+    finally:
+        for sampler in samplers:
+            sampler.stop()
+    return latencies, errors
+
+
+RUNNERS = {
+    "legacy": run_legacy,
+    "batched": run_batched,
+    "scan": run_scan,
+    "async": run_async,
+    "stream": run_stream,
+}
+
+
+def bench_pipeline(root, mode, serials, seconds, spawns):
+    ptm._device_info.clear()
+    calls_before = fake_adb.count_calls(root)
+    spawns_before = spawns.count
+    t0 = time.perf_counter()
+    latencies, errors = RUNNERS[mode](serials, seconds)
+    elapsed = time.perf_counter() - t0
+    ticks = len(latencies) + (len(serials) if mode == "stream" else 0)
+    ticks = max(ticks, 1)
+    return {
+        "mode": mode,
+        "devices": len(serials),
+        "ticks": ticks,
+        "errors": errors,
+        "ticks_per_s": ticks / elapsed,
+        "p50_ms": (percentile(latencies, 50) or 0.0) * 1000.0,
+        "p99_ms": (percentile(latencies, 99) or 0.0) * 1000.0,
+        "subprocesses_per_tick": (spawns.count - spawns_before) / ticks,
+        "adb_calls_per_tick": (fake_adb.count_calls(root) - calls_before) / ticks,
+    }
+
+
+def bench_parsers(root, serial, number):
+    device = fake_adb.FakeDevice(root, serial, fake_adb.load_config(root)["devices"][serial])
+    info = ptm.DeviceInfo(serial)
+    snapshot = ptm.adb_shell(serial, ptm.build_snapshot_script(PACKAGE, info))
+    scan_snapshot = ptm.adb_shell(serial, ptm.build_snapshot_script(PACKAGE, info, SCAN))
+    with open(os.path.join(device.dir, "proc", "meminfo"), encoding="utf-8") as f:
+        meminfo = f.read()
+    with open(os.path.join(device.dir, "dumpsys_battery"), encoding="utf-8") as f:
+        battery = f.read()
+
+    cases = {
+        "parse_meminfo": lambda: ptm.parse_meminfo(meminfo),
+        "parse_battery_temp_from_dumpsys": lambda: ptm.parse_battery_temp_from_dumpsys(battery),
+        "split_snapshot_sections": lambda: ptm.split_snapshot_sections(snapshot),
+        "parse_snapshot": lambda: ptm.parse_snapshot(snapshot, PACKAGE, {}, ptm.DeviceInfo(serial)),
+        "parse_snapshot+top10": lambda: ptm.parse_snapshot(scan_snapshot, PACKAGE, {}, info, scan=SCAN),
+    }
+    results = {}
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        results[name] = best / number * 1e6
+    return results
+
+
+def print_report(report):
+    print(f"{'mode':<8} {'devs':>4} {'ticks/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'spawn/tick':>10} {'adb/tick':>9} {'errors':>6}")
+    for r in report["pipeline"]:
+        print(f"{r['mode']:<8} {r['devices']:>4} {r['ticks_per_s']:>9.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p99_ms']:>8.1f} {r['subprocesses_per_tick']:>10.2f} {r['adb_calls_per_tick']:>9.2f} "
+              f"{r['errors']:>6}")
+    print()
+    for name, us in report["parsers"].items():
+        print(f"{name:<34} {us:>8.2f} us/call")
+
+
+def compare(report, baseline, tolerance):
+    # Higher ticks/sec is better; latency, spawns and parse time should not grow.
+    regressions = []
+    base = {(r["mode"], r["devices"]): r for r in baseline.get("pipeline", [])}
+    for r in report["pipeline"]:
+        b = base.get((r["mode"], r["devices"]))
+        if b is None:
+            continue
+        if r["ticks_per_s"] < b["ticks_per_s"] * (1.0 - tolerance):
+            regressions.append(f"{r['mode']}/{r['devices']}: ticks/s {b['ticks_per_s']:.1f} -> {r['ticks_per_s']:.1f}")
+        if r["p99_ms"] > b["p99_ms"] * (1.0 + tolerance) + 1.0:
+            regressions.append(f"{r['mode']}/{r['devices']}: p99 {b['p99_ms']:.1f} -> {r['p99_ms']:.1f} ms")
+        if r["subprocesses_per_tick"] > b["subprocesses_per_tick"] + 0.01:
+            regressions.append(
+                f"{r['mode']}/{r['devices']}: spawn/tick {b['subprocesses_per_tick']:.2f} -> "
+                f"{r['subprocesses_per_tick']:.2f}"
+            )
+    for name, us in report["parsers"].items():
+        b = baseline.get("parsers", {}).get(name)
+        if b is not None and us > b * (1.0 + tolerance):
+            regressions.append(f"{name}: {b:.2f} -> {us:.2f} us")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以模擬 adb 對取樣流程進行效能測試")
+    parser.add_argument("--devices", default="1,4", help="以逗號分隔的裝置數量，例如 1,4,16")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--seconds", type=float, default=3.0, help="每輪取樣流程的執行秒數")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="模擬每次呼叫的裝置延遲（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--transport", choices=("subprocess", "socket"), default="subprocess")
+    parser.add_argument("--parse-number", type=int, default=2000)
+    parser.add_argument("--root", help="模擬裝置目錄（預設為暫存目錄）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式輸出報告")
+    parser.add_argument("--save", help="將報告寫入此檔案")
+    parser.add_argument("--compare", help="與此基準報告比較；效能退步時以代碼 1 結束")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    counts = [int(n) for n in args.devices.split(",") if n]
+    modes = [m for m in args.modes.split(",") if m]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"未知的模式: {mode}")
+
+    root = os.path.abspath(args.root or tempfile.mkdtemp(prefix="ptm-bench-"))
+    serials = [f"fake-{i:03d}" for i in range(max(counts))]
+    wrapper = fake_adb.setup(
+        root, serials, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        fail_rate=args.fail_rate, packages=[PACKAGE],
+    )
+    os.environ["PATH"] = os.path.dirname(wrapper) + os.pathsep + os.environ.get("PATH", "")
+
+    server = None
+    if args.transport == "socket":
+        server = fake_adb.FakeAdbServer(root, port=0).start()
+        os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+    ptm.set_adb_transport(args.transport)
+
+    spawns = SpawnCounter()
+    report = {
+        "transport": args.transport,
+        "latency_ms": args.latency_ms,
+        "seconds": args.seconds,
+        "pipeline": [],
+        "parsers": {},
+    }
+    try:
+        for mode in modes:
+            for n in counts:
+                report["pipeline"].append(bench_pipeline(root, mode, serials[:n], args.seconds, spawns))
+        report["parsers"] = bench_parsers(root, serials[0], args.parse_number)
+    finally:
+        ptm.set_adb_transport("subprocess")
+        if server is not None:
+            server.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("效能退步:", line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
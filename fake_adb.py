@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+import json
+import math
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+# Stand-in for `adb` when no phone is attached. Every simulated device gets a
+# directory tree with synthetic /proc and /sys files plus shell shims for
+# dumpsys/getprop/pidof/ps; the scripts sent by phone_temp_monitor run in a
+# real `sh` with their /proc and /sys paths rewritten into that tree, so the
+# batched, streaming and future device scripts work unchanged.
+#
+#   python fake_adb.py setup --root /tmp/ptm-fake --devices 4 --latency-ms 20
+#   PATH=/tmp/ptm-fake/bin:$PATH python phone_temp_monitor.py --headless
+#   python fake_adb.py serve --root /tmp/ptm-fake --port 5038   # socket transport
+ROOT_ENV = "PTM_FAKE_ADB_ROOT"
+CALLS_LOG = "calls.log"
+PATH_RE = re.compile(r"(?<![\w.$/-])/(proc|sys)(?=[/\s;)\"']|$)")
+
+DEFAULT_DEVICE = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "fail_rate": 0.0,
+    "hang_rate": 0.0,
+    "hang_s": 10.0,
+    "ncpu": 8,
+    "mem_total_kb": 7864320,
+    "packages": ["com.example.app"],
+    "threads": 4,
+    "pid_restart_s": 0.0,
+    "background_procs": 20,
+}
+BACKGROUND_NAMES = ("system_server", "surfaceflinger", "logd", "servicemanager", "vold", "netd",
+                    "zygote64", "audioserver", "cameraserver", "com.android.systemui")
+
+
+def load_config(root):
+    with open(os.path.join(root, "config.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _shim(path, body):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#!/bin/sh\n" + body + "\n")
+    os.chmod(path, 0o755)
+
+
+class FakeDevice:
+    def __init__(self, root, serial, cfg):
+        self.serial = serial
+        self.cfg = dict(DEFAULT_DEVICE, **cfg)
+        self.dir = os.path.join(root, "devices", re.sub(r"[^A-Za-z0-9._-]", "_", serial))
+        self.boot = self.cfg.get("boot", time.time() - 3600.0)
+
+    def setup(self):
+        for sub in ("bin", "proc", "sys/class/power_supply/battery"):
+            os.makedirs(os.path.join(self.dir, sub), exist_ok=True)
+        for i in range(4):
+            zone = os.path.join(self.dir, "sys/class/thermal", f"thermal_zone{i}")
+            os.makedirs(zone, exist_ok=True)
+            _write(os.path.join(zone, "type"), ("battery", "cpu-0-0", "gpu", "skin")[i] + "\n")
+        d = self.dir
+        _shim(os.path.join(d, "bin", "dumpsys"), f'[ "$1" = battery ] && cat "{d}/dumpsys_battery"')
+        _shim(os.path.join(d, "bin", "getconf"), "echo 4096")
+        _shim(os.path.join(d, "bin", "uname"), "echo 5.10.0-fake")
+        _shim(os.path.join(d, "bin", "getprop"), 'case "$1" in ro.product.cpu.abi) echo arm64-v8a;; *) echo;; esac')
+        _shim(os.path.join(d, "bin", "pidof"), f'awk -v n="$1" \'$2 == n {{ print $1 }}\' "{d}/pids"')
+        _shim(os.path.join(d, "bin", "ps"),
+              f'echo "USER PID PPID VSZ RSS WCHAN ADDR S NAME"; '
+              f'awk \'{{ print "u0_a" NR, $1, 1, 0, 0, 0, 0, "S", $2 }}\' "{d}/pids"')
+        self.refresh()
+
+    def _pids(self, t):
+        restart = self.cfg["pid_restart_s"]
+        gen = int(t // restart) if restart > 0 else 0
+        return [(1000 + i * 100 + gen % 97, pkg, gen * restart) for i, pkg in enumerate(self.cfg["packages"])]
+
+    def _background(self):
+        count = self.cfg["background_procs"]
+        return [(200 + i, BACKGROUND_NAMES[i % len(BACKGROUND_NAMES)] + (f"-{i}" if i >= len(BACKGROUND_NAMES) else ""))
+                for i in range(count)]
+
+    def refresh(self, now=None):
+        t = (now or time.time()) - self.boot
+        cfg = self.cfg
+        d = self.dir
+        ncpu = cfg["ncpu"]
+        temp = 35.0 + 3.0 * math.sin(t / 60.0)
+
+        _write(os.path.join(d, "dumpsys_battery"),
+               "Current Battery Service state:\n  AC powered: false\n  USB powered: true\n"
+               f"  level: 80\n  scale: 100\n  voltage: 4100\n  temperature: {int(temp * 10)}\n")
+        _write(os.path.join(d, "sys/class/power_supply/battery/temp"), f"{int(temp * 10)}\n")
+        for i in range(4):
+            _write(os.path.join(d, "sys/class/thermal", f"thermal_zone{i}", "temp"),
+                   f"{int((temp + i * 2.5) * 1000)}\n")
+
+        total = cfg["mem_total_kb"]
+        avail = int(total * (0.45 + 0.1 * math.sin(t / 30.0)))
+        _write(os.path.join(d, "proc/meminfo"),
+               f"MemTotal:       {total} kB\nMemFree:        {avail // 3} kB\n"
+               f"MemAvailable:   {avail} kB\nBuffers:        {total // 100} kB\n"
+               f"Cached:         {avail // 2} kB\nSwapCached:            0 kB\n")
+
+        jiffies = int(t * 100)
+        lines = [f"cpu  {jiffies * ncpu // 4} 0 {jiffies * ncpu // 8} {jiffies * ncpu * 5 // 8} 0 0 0 0 0 0"]
+        for c in range(ncpu):
+            lines.append(f"cpu{c} {jiffies // 4} 0 {jiffies // 8} {jiffies * 5 // 8} 0 0 0 0 0 0")
+        lines.append(f"btime {int(self.boot)}")
+        _write(os.path.join(d, "proc/stat"), "\n".join(lines) + "\n")
+
+        pids = self._pids(t)
+        background = self._background()
+        _write(os.path.join(d, "pids"), "".join(f"{pid} {name}\n" for pid, name, *_ in pids + background))
+        for n, (pid, name) in enumerate(background):
+            pdir = os.path.join(d, "proc", str(pid))
+            os.makedirs(pdir, exist_ok=True)
+            ticks = int(t * 100 * 0.02 * (n % 5))
+            _write(os.path.join(pdir, "stat"), self._pid_stat(pid, name[-15:], ticks, ticks // 3, 100))
+            _write(os.path.join(pdir, "statm"), f"{200000 + n * 1000} {5000 + n * 700} 3000 10 0 20000 0\n")
+        for n, (pid, pkg, started) in enumerate(pids):
+            pdir = os.path.join(d, "proc", str(pid))
+            os.makedirs(pdir, exist_ok=True)
+            share = 0.05 + 0.1 * n
+            utime = int((t - started) * 100 * share * 0.7)
+            stime = int((t - started) * 100 * share * 0.3)
+            _write(os.path.join(pdir, "stat"), self._pid_stat(pid, pkg[-15:], utime, stime, int(started * 100)))
+            _write(os.path.join(pdir, "statm"), f"{1500000 + n} {60000 + int(t) % 5000} 20000 10 0 90000 0\n")
+            _write(os.path.join(pdir, "cmdline"), pkg + "\0")
+            for k in range(cfg["threads"]):
+                tid = pid + k
+                tdir = os.path.join(pdir, "task", str(tid))
+                os.makedirs(tdir, exist_ok=True)
+                name = "main" if k == 0 else f"worker-{k}"
+                weight = 0.5 ** (k + 1)
+                _write(os.path.join(tdir, "stat"),
+                       self._pid_stat(tid, name, int(utime * weight), int(stime * weight), int(started * 100)))
+
+    @staticmethod
+    def _pid_stat(pid, comm, utime, stime, starttime):
+        fields = ["S", "1", str(pid), "0", "0", "-1", "4194560", "0", "0", "0", "0",
+                  str(utime), str(stime), "0", "0", "20", "0", "1", "0", str(starttime)]
+        fields += ["0"] * 32
+        return f"{pid} ({comm}) " + " ".join(fields) + "\n"
+
+    def rewrite(self, script):
+        return PATH_RE.sub(lambda m: f"{self.dir}/{m.group(1)}", script)
+
+    def env(self):
+        env = dict(os.environ)
+        env["PATH"] = os.path.join(self.dir, "bin") + os.pathsep + env.get("PATH", "")
+        return env
+
+    def inject(self):
+        # Returns an error message for an injected failure; latency and hangs
+        # are applied in place.
+        cfg = self.cfg
+        delay = cfg["latency_ms"] + random.uniform(0.0, cfg["jitter_ms"])
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if cfg["hang_rate"] and random.random() < cfg["hang_rate"]:
+            time.sleep(cfg["hang_s"])
+        if cfg["fail_rate"] and random.random() < cfg["fail_rate"]:
+            return f"error: device '{self.serial}' not found"
+        return None
+
+
+def _log_call(root, serial, service):
+    fd = os.open(os.path.join(root, CALLS_LOG), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, f"{time.time():.6f} {serial} {service}\n".encode())
+    finally:
+        os.close(fd)
+
+
+def count_calls(root):
+    try:
+        with open(os.path.join(root, CALLS_LOG), "rb") as f:
+            return sum(1 for _ in f)
+    except FileNotFoundError:
+        return 0
+
+
+def _refresh_while_alive(device, pid, period=0.1):
+    while True:
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return
+        device.refresh()
+        time.sleep(period)
+
+
+def _spawn_refresher(device):
+    # Long-running exec-out loops read the synthetic files repeatedly; a forked
+    # helper keeps them moving until the shell (our own PID after exec) exits.
+    parent = os.getpid()
+    if os.fork() != 0:
+        return
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    try:
+        _refresh_while_alive(device, parent)
+    finally:
+        os._exit(0)
+
+
+# --------------------- adb command line ---------------------
+def adb_main(argv):
+    root = os.environ.get(ROOT_ENV)
+    if not root:
+        print(f"未設定 {ROOT_ENV}；請先執行 `fake_adb.py setup`。", file=sys.stderr)
+        return 1
+    config = load_config(root)
+    serials = list(config["devices"])
+
+    serial = os.environ.get("ANDROID_SERIAL")
+    while argv and argv[0].startswith("-"):
+        if argv[0] == "-s" and len(argv) > 1:
+            serial = argv[1]
+            argv = argv[2:]
+        else:
+            argv = argv[1:]
+    if not argv:
+        print("usage: adb [-s SERIAL] devices|shell|exec-out ...", file=sys.stderr)
+        return 1
+
+    command, args = argv[0], argv[1:]
+    if command in ("start-server", "kill-server"):
+        return 0
+    if command == "devices":
+        _log_call(root, "-", "devices")
+        print("List of devices attached")
+        for s in serials:
+            print(f"{s}\tdevice")
+        print()
+        return 0
+    if command not in ("shell", "exec-out"):
+        print(f"fake adb: 不支援的指令 {command}", file=sys.stderr)
+        return 1
+
+    if serial is None:
+        if len(serials) != 1:
+            print("error: more than one device/emulator", file=sys.stderr)
+            return 1
+        serial = serials[0]
+    if serial not in config["devices"]:
+        print(f"error: device '{serial}' not found", file=sys.stderr)
+        return 1
+
+    device = FakeDevice(root, serial, config["devices"][serial])
+    _log_call(root, serial, command)
+    error = device.inject()
+    if error:
+        print(error, file=sys.stderr)
+        return 1
+    device.refresh()
+    script = device.rewrite(" ".join(args))
+    if command == "exec-out":
+        _spawn_refresher(device)
+    sys.stdout.flush()
+    os.execvpe("sh", ["sh", "-c", script], device.env())
+
+
+# --------------------- adb host protocol server ---------------------
+def _send_okay(conn):
+    conn.sendall(b"OKAY")
+
+
+def _send_fail(conn, msg):
+    data = msg.encode("utf-8")
+    conn.sendall(b"FAIL" + f"{len(data):04x}".encode("ascii") + data)
+
+
+def _recv_request(conn):
+    head = b""
+    while len(head) < 4:
+        chunk = conn.recv(4 - len(head))
+        if not chunk:
+            return None
+        head += chunk
+    length = int(head, 16)
+    data = b""
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data.decode("utf-8", "replace")
+
+
+class FakeAdbServer:
+    def __init__(self, root, host="127.0.0.1", port=5037):
+        self.root = root
+        self.config = load_config(root)
+        self.devices = {s: FakeDevice(root, s, cfg) for s, cfg in self.config["devices"].items()}
+        self.host = host
+        self.port = port
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.listen(64)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except (OSError, AttributeError):
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            self._serve(conn)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _serve(self, conn):
+        device = None
+        while True:
+            req = _recv_request(conn)
+            if req is None:
+                return
+            if req == "host:devices":
+                _log_call(self.root, "-", "devices")
+                text = "".join(f"{s}\tdevice\n" for s in self.devices).encode()
+                _send_okay(conn)
+                conn.sendall(f"{len(text):04x}".encode("ascii") + text)
+                return
+            if req.startswith("host:transport:"):
+                device = self.devices.get(req[len("host:transport:"):])
+                if device is None:
+                    _send_fail(conn, "device not found")
+                    return
+                _send_okay(conn)
+                continue
+            if device is not None and req.startswith(("exec:", "shell:")):
+                self._run(conn, device, req.split(":", 1)[1], streaming=req.startswith("exec:"))
+                return
+            _send_fail(conn, f"unsupported service {req}")
+            return
+
+    def _run(self, conn, device, script, streaming):
+        _log_call(self.root, device.serial, "socket")
+        error = device.inject()
+        if error:
+            _send_fail(conn, error)
+            return
+        device.refresh()
+        _send_okay(conn)
+        proc = subprocess.Popen(
+            ["sh", "-c", device.rewrite(script)],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=device.env(),
+        )
+        stop = threading.Event()
+        if streaming:
+            def refresher():
+                while not stop.wait(0.1):
+                    device.refresh()
+            threading.Thread(target=refresher, daemon=True).start()
+        try:
+            while True:
+                chunk = proc.stdout.read1(65536)
+                if not chunk:
+                    break
+                conn.sendall(chunk)
+        except OSError:
+            pass
+        finally:
+            stop.set()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+
+# --------------------- setup ---------------------
+def setup(root, serials, **overrides):
+    os.makedirs(os.path.join(root, "bin"), exist_ok=True)
+    devices = {}
+    for serial in serials:
+        cfg = dict(DEFAULT_DEVICE, **{k: v for k, v in overrides.items() if v is not None})
+        cfg["boot"] = time.time() - 3600.0
+        devices[serial] = cfg
+        FakeDevice(root, serial, cfg).setup()
+    with open(os.path.join(root, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"devices": devices}, f, indent=2)
+    wrapper = os.path.join(root, "bin", "adb")
+    with open(wrapper, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\n{ROOT_ENV}="{root}" exec "{sys.executable}" "{os.path.abspath(__file__)}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    try:
+        os.remove(os.path.join(root, CALLS_LOG))
+    except FileNotFoundError:
+        pass
+    return wrapper
+
+
+def tool_main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="fake_adb.py", description="不需手機即可進行效能測試的模擬 adb")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_setup = sub.add_parser("setup", help="建立模擬裝置與 bin/adb 包裝腳本")
+    p_setup.add_argument("--root", required=True)
+    p_setup.add_argument("--devices", type=int, default=1)
+    p_setup.add_argument("--latency-ms", type=float)
+    p_setup.add_argument("--jitter-ms", type=float)
+    p_setup.add_argument("--fail-rate", type=float)
+    p_setup.add_argument("--hang-rate", type=float)
+    p_setup.add_argument("--hang-s", type=float)
+    p_setup.add_argument("--package", action="append", dest="packages")
+    p_setup.add_argument("--threads", type=int)
+    p_setup.add_argument("--pid-restart-s", type=float)
+    p_setup.add_argument("--background-procs", type=int)
+    p_serve = sub.add_parser("serve", help="提供 adb host 協定，供 PTM_ADB_TRANSPORT=socket 使用")
+    p_serve.add_argument("--root", required=True)
+    p_serve.add_argument("--port", type=int, default=5037)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "setup":
+        root = os.path.abspath(args.root)
+        wrapper = setup(
+            root, [f"fake-{i:03d}" for i in range(args.devices)],
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, fail_rate=args.fail_rate,
+            hang_rate=args.hang_rate, hang_s=args.hang_s, packages=args.packages,
+            threads=args.threads, pid_restart_s=args.pid_restart_s, background_procs=args.background_procs,
+        )
+        print(f"export PATH={os.path.dirname(wrapper)}:$PATH")
+        return 0
+
+    server = FakeAdbServer(os.path.abspath(args.root), port=args.port).start()
+    print(f"模擬 adb 伺服器已啟動於 127.0.0.1:{server.port}", file=sys.stderr)
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ("setup", "serve"):
+        sys.exit(tool_main(sys.argv[1:]))
+    sys.exit(adb_main(sys.argv[1:]))
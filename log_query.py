@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import csv
+import json
+import lzma
+import math
+import os
+import re
+import sys
+import time
+import zlib
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+
+import phone_temp_monitor as ptm
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Queries the rotated log tree (logs/<YYYYMMDD_HHMM>/metrics[_<serial>]_
+# YYYYMMDD_HHMM.csv|.ptmb) and the compressed archives under logs/archive/.
+# Directory, file and archive names are the time index: a half-hour directory
+# or five-minute segment outside the range is never opened, and only the
+# matching members of an archive are decompressed. Each segment is loaded
+# into typed float arrays (NumPy views when NumPy is installed) for the
+# requested columns only, and results are produced per segment and per
+# device, so memory follows one segment rather than the whole history.
+#
+#   python log_query.py logs --since 36h
+#   python log_query.py logs --since 6h -c adb_proc_cpu_percent --resample 5m --how max
+#   python log_query.py logs --start 2024-01-01T08:00 --end 2024-01-01T12:00 -s emulator-5554 --rolling 10m
+SEGMENT_FILE_RE = re.compile(r"^metrics_(?:(?P<serial>.+)_)?(?P<stamp>\d{8}_\d{4})\.(?P<ext>csv|ptmb)$")
+DIR_NAME_RE = re.compile(r"^\d{8}_\d{4}$")
+DIR_MINUTES = 30
+SIDE_KINDS = ("threads", "thermal", "alerts")
+NUMERIC_COLUMNS = [c for c in ptm.LOG_HEADER if c.startswith("adb_")] + ptm.LOG_STAGE_HEADER + ptm.LOG_INTERVAL_HEADER
+DEFAULT_COLUMNS = ("adb_sys_used_kb", "adb_proc_res_mb", "adb_proc_cpu_percent")
+SUMMARY_PERCENTILES = (50, 90, 95, 99)
+RESAMPLE_HOW = ("mean", "min", "max", "sum", "count", "last")
+ROLLING_HOW = ("mean", "min", "max", "slope")
+DURATION_UNITS = dict(ptm.ALERT_UNITS, d=86400.0)
+DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*(ms|s|m|h|d)?$")
+NAN = float("nan")
+
+
+@dataclass
+class Segment:
+    serial: str
+    start_ts: float
+    path: str
+    member: dict = None
+
+
+@dataclass
+class Chunk:
+    serial: str
+    ts: object
+    columns: dict
+
+
+def parse_duration(text):
+    m = DURATION_RE.match(text.strip())
+    if not m:
+        raise ValueError(f"無法解析時間長度: {text!r}")
+    return float(m.group(1)) * DURATION_UNITS[m.group(2) or "s"]
+
+
+def _is_side_stream(name):
+    return name in SIDE_KINDS or name.startswith(tuple(f"{kind}_" for kind in SIDE_KINDS))
+
+
+def _segment_serial(name, wanted):
+    m = SEGMENT_FILE_RE.match(name)
+    if not m:
+        return None
+    serial = m.group("serial") or ""
+    if _is_side_stream(serial) or (wanted is not None and serial not in wanted):
+        return None
+    return serial
+
+
+def _archived_segments(log_root, start_ts, end_ts, wanted):
+    archive_dir = os.path.join(log_root, ptm.ARCHIVE_DIR)
+    try:
+        names = os.listdir(archive_dir)
+    except OSError:
+        return
+    for name in names:
+        if not name.endswith(ptm.ARCHIVE_EXT):
+            continue
+        try:
+            dir_start = datetime.strptime(name[:-len(ptm.ARCHIVE_EXT)], "%Y%m%d_%H%M").timestamp()
+        except ValueError:
+            continue
+        if start_ts is not None and dir_start + DIR_MINUTES * 60 <= start_ts:
+            continue
+        if end_ts is not None and dir_start >= end_ts:
+            continue
+        path = os.path.join(archive_dir, name)
+        try:
+            with ptm.ArchiveReader(path) as reader:
+                for member in reader.iter_members(start_ts, end_ts):
+                    serial = _segment_serial(member["name"], wanted)
+                    if serial is not None:
+                        yield Segment(serial, member["start_ts"], path, member)
+        except (OSError, ValueError):
+            continue
+
+
+def find_segments(log_root, start_ts=None, end_ts=None, serials=None):
+    wanted = {ptm.safe_serial(s) for s in serials} if serials else None
+    segments = list(_archived_segments(log_root, start_ts, end_ts, wanted))
+    try:
+        dirs = os.listdir(log_root)
+    except OSError:
+        return segments
+    for dir_name in dirs:
+        if not DIR_NAME_RE.match(dir_name):
+            continue
+        dir_start = datetime.strptime(dir_name, "%Y%m%d_%H%M").timestamp()
+        if start_ts is not None and dir_start + DIR_MINUTES * 60 <= start_ts:
+            continue
+        if end_ts is not None and dir_start >= end_ts:
+            continue
+        dir_path = os.path.join(log_root, dir_name)
+        try:
+            names = os.listdir(dir_path)
+        except OSError:
+            continue
+        for name in names:
+            serial = _segment_serial(name, wanted)
+            if serial is None:
+                continue
+            seg_start = datetime.strptime(SEGMENT_FILE_RE.match(name).group("stamp"), "%Y%m%d_%H%M").timestamp()
+            if start_ts is not None and seg_start + ptm.SEGMENT_MINUTES * 60 <= start_ts:
+                continue
+            if end_ts is not None and seg_start >= end_ts:
+                continue
+            segments.append(Segment(serial, seg_start, os.path.join(dir_path, name)))
+    # Grouped by device, oldest first, so per-device results stream in order.
+    segments.sort(key=lambda seg: (seg.serial, seg.start_ts, seg.path))
+    return segments
+
+
+def _float_or_nan(raw):
+    try:
+        return float(raw) if raw else NAN
+    except ValueError:
+        return NAN
+
+
+def _column(rows, i):
+    if i < 0:
+        return array("d", [NAN]) * len(rows)
+    try:
+        return array("d", [float(r[i]) if r[i] else NAN for r in rows])
+    except (IndexError, ValueError):
+        return array("d", [_float_or_nan(r[i]) if i < len(r) else NAN for r in rows])
+
+
+def read_csv_segment(path, columns):
+    with open(path, newline="", encoding="utf-8") as f:
+        return parse_csv_segment(f.read(), columns)
+
+
+def parse_csv_segment(text, columns):
+    lines = text.splitlines()
+    # Only error messages can carry quoted commas; without a quote anywhere a
+    # plain split gives the same fields at about half the cost of csv.
+    if any('"' in line for line in lines):
+        rows = list(csv.reader(lines))
+    else:
+        rows = [line.split(",") for line in lines]
+    if not rows or "timestamp_iso8601" not in rows[0]:
+        return array("d"), [array("d") for _ in columns]
+    header = rows[0]
+    ts_idx = header.index("timestamp_iso8601")
+    rows = [r for r in rows[1:] if len(r) > ts_idx]
+    # Rows in a segment share date, hour and UTC offset, so the ISO stamp is
+    # parsed once per minute and the seconds are added.
+    minutes = {}
+    ts = array("d")
+    kept = []
+    for r in rows:
+        stamp = r[ts_idx]
+        key = stamp[:16] + stamp[19:]
+        base = minutes.get(key)
+        try:
+            if base is None:
+                base = minutes[key] = datetime.fromisoformat(stamp[:16] + ":00" + stamp[19:]).timestamp()
+            ts.append(base + int(stamp[17:19]))
+        except ValueError:
+            continue
+        kept.append(r)
+    return ts, [_column(kept, header.index(c) if c in header else -1) for c in columns]
+
+
+def read_binary_segment(path, columns, data=None):
+    ts = array("d")
+    cols = [array("d") for _ in columns]
+    names = [c[len("adb_"):] if c.startswith("adb_") else c for c in columns]
+    known = dict(ptm.BIN_COLUMNS)
+    reader = ptm.BinarySegmentReader(path, data=data)
+    try:
+        for block in reader.iter_blocks():
+            n = len(block["ts"])
+            ts.extend(block["ts"])
+            for name, col in zip(names, cols):
+                if name not in known:
+                    col.extend([NAN] * n)
+                elif name == "proc_pid":
+                    col.extend(float(v) if v >= 0 else NAN for v in block[name])
+                else:
+                    col.extend(block[name])
+    finally:
+        reader.close()
+    return ts, cols
+
+
+def _read_archived(archives, seg, columns):
+    reader = archives.get(seg.path)
+    if reader is None:
+        reader = archives[seg.path] = ptm.ArchiveReader(seg.path)
+    data = reader.read_member(seg.member)
+    if seg.member["name"].endswith(ptm.BIN_EXT):
+        return read_binary_segment(seg.member["name"], columns, data)
+    return parse_csv_segment(data.decode("utf-8", "replace"), columns)
+
+
+def iter_chunks(log_root, columns, start_ts=None, end_ts=None, serials=None):
+    archives = {}
+    try:
+        yield from _iter_chunks(log_root, columns, start_ts, end_ts, serials, archives)
+    finally:
+        for reader in archives.values():
+            reader.close()
+
+
+def _iter_chunks(log_root, columns, start_ts, end_ts, serials, archives):
+    for seg in find_segments(log_root, start_ts, end_ts, serials):
+        try:
+            if seg.member is not None:
+                ts, cols = _read_archived(archives, seg, columns)
+            elif seg.path.endswith(ptm.BIN_EXT):
+                ts, cols = read_binary_segment(seg.path, columns)
+            else:
+                ts, cols = read_csv_segment(seg.path, columns)
+        except (OSError, ValueError, EOFError, zlib.error, lzma.LZMAError):
+            continue
+        lo = bisect.bisect_left(ts, start_ts) if start_ts is not None else 0
+        hi = bisect.bisect_left(ts, end_ts) if end_ts is not None else len(ts)
+        if lo >= hi:
+            continue
+        if np is not None:
+            view = lambda arr: np.frombuffer(arr, dtype=np.float64)[lo:hi]
+        else:
+            view = lambda arr: arr[lo:hi] if lo or hi < len(arr) else arr
+        yield Chunk(seg.serial, view(ts), {name: view(col) for name, col in zip(columns, cols)})
+
+
+# --------------------- Aggregations ---------------------
+def _finite(values):
+    if np is not None:
+        return values[~np.isnan(values)]
+    return [v for v in values if v == v]
+
+
+def _percentiles(values, pcts):
+    if not len(values):
+        return [None] * len(pcts)
+    if np is not None:
+        return [float(v) for v in np.percentile(values, pcts)]
+    ordered = sorted(values)
+    out = []
+    for p in pcts:
+        k = (len(ordered) - 1) * p / 100.0
+        f = math.floor(k)
+        c = min(f + 1, len(ordered) - 1)
+        out.append(ordered[f] + (ordered[c] - ordered[f]) * (k - f))
+    return out
+
+
+def _summary_stats(parts, pcts):
+    if np is not None:
+        values = np.concatenate(parts) if parts else np.empty(0)
+    else:
+        values = [v for part in parts for v in part]
+    if not len(values):
+        return {"count": 0}
+    if np is not None:
+        lo, hi, mean = float(values.min()), float(values.max()), float(values.mean())
+    else:
+        lo, hi, mean = min(values), max(values), sum(values) / len(values)
+    stats = {"count": len(values), "min": lo, "max": hi, "mean": mean}
+    for p, v in zip(pcts, _percentiles(values, pcts)):
+        stats[f"p{p:g}"] = v
+    return stats
+
+
+def summarize(chunks, columns, pcts=SUMMARY_PERCENTILES):
+    # One result per device, emitted as soon as the next device starts. Only
+    # the finite values of the queried columns are kept (for the exact
+    # percentiles); timestamps and rows are dropped per segment.
+    serial, state = None, None
+
+    def result():
+        return {
+            "serial": serial, "start": state["start"], "end": state["end"], "rows": state["rows"],
+            "columns": {name: _summary_stats(state["parts"][name], pcts) for name in columns},
+        }
+
+    for chunk in chunks:
+        if state is not None and chunk.serial != serial:
+            yield result()
+            state = None
+        if state is None:
+            serial = chunk.serial
+            state = {"start": float(chunk.ts[0]), "end": None, "rows": 0, "parts": {name: [] for name in columns}}
+        state["end"] = float(chunk.ts[-1])
+        state["rows"] += len(chunk.ts)
+        for name in columns:
+            state["parts"][name].append(_finite(chunk.columns[name]))
+    if state is not None:
+        yield result()
+
+
+def _bucket_value(state, how):
+    count, total, lo, hi, last = state
+    if how == "mean":
+        return total / count
+    return {"min": lo, "max": hi, "sum": total, "count": count, "last": last}[how]
+
+
+def resample(chunks, column, bucket_s, how="mean"):
+    # Yields (serial, bucket_start_ts, value) as each bucket closes. Buckets
+    # are aligned to multiples of bucket_s since the epoch.
+    cur_serial = None
+    cur_bucket = None
+    state = None
+    for chunk in chunks:
+        if chunk.serial != cur_serial:
+            if state is not None:
+                yield cur_serial, cur_bucket * bucket_s, _bucket_value(state, how)
+            cur_serial, cur_bucket, state = chunk.serial, None, None
+        values = chunk.columns[column]
+        if np is not None:
+            mask = ~np.isnan(values)
+            ts, values = chunk.ts[mask], values[mask]
+            if not len(ts):
+                continue
+            buckets = np.floor(ts / bucket_s)
+            starts = np.r_[0, np.flatnonzero(np.diff(buckets)) + 1]
+            ends = np.r_[starts[1:], len(ts)]
+            groups = zip(
+                buckets[starts].tolist(), (ends - starts).tolist(),
+                np.add.reduceat(values, starts).tolist(), np.minimum.reduceat(values, starts).tolist(),
+                np.maximum.reduceat(values, starts).tolist(), values[ends - 1].tolist(),
+            )
+        else:
+            groups = []
+            for t, v in zip(chunk.ts, values):
+                if v != v:
+                    continue
+                b = math.floor(t / bucket_s)
+                if groups and groups[-1][0] == b:
+                    g = groups[-1]
+                    groups[-1] = (b, g[1] + 1, g[2] + v, min(g[3], v), max(g[4], v), v)
+                else:
+                    groups.append((b, 1, v, v, v, v))
+        for b, count, total, lo, hi, last in groups:
+            if state is not None and b == cur_bucket:
+                c0, t0, lo0, hi0, _ = state
+                state = (c0 + count, t0 + total, min(lo0, lo), max(hi0, hi), last)
+                continue
+            if state is not None:
+                yield cur_serial, cur_bucket * bucket_s, _bucket_value(state, how)
+            cur_bucket, state = b, (count, total, lo, hi, last)
+    if state is not None:
+        yield cur_serial, cur_bucket * bucket_s, _bucket_value(state, how)
+
+
+def rolling(chunks, column, window_s, how="mean"):
+    # Yields (serial, ts, value) for every sample over the trailing window,
+    # using the same O(1) sliding window as the alert rules.
+    serial, window = None, None
+    for chunk in chunks:
+        if chunk.serial != serial or window is None:
+            serial = chunk.serial
+            window = ptm.SlidingWindow(window_s)
+            window.need(how)
+        for t, v in zip(chunk.ts.tolist() if np is not None else chunk.ts,
+                        chunk.columns[column].tolist() if np is not None else chunk.columns[column]):
+            if v != v:
+                window.expire(t)
+                continue
+            window.add(t, v)
+            yield serial, t, window.value(how)
+
+
+# --------------------- CLI ---------------------
+def _parse_time(text):
+    return datetime.fromisoformat(text).timestamp()
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).astimezone().isoformat(timespec="seconds")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查詢並彙總輪替後的監控紀錄")
+    parser.add_argument("log_root", nargs="?", default=os.path.join(os.getcwd(), "logs"))
+    parser.add_argument("--since", help="查詢最近一段時間，如 36h、90m")
+    parser.add_argument("--start", help="起始時間 (ISO 8601，本地時間)")
+    parser.add_argument("--end", help="結束時間 (ISO 8601，本地時間)")
+    parser.add_argument("-s", "--serial", action="append", help="裝置序號，可重複指定；單機紀錄的序號為空字串")
+    parser.add_argument("-c", "--column", action="append", help=f"欄位，預設 {', '.join(DEFAULT_COLUMNS)}")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resample", metavar="BUCKET", help="依時間分桶，如 1m、5m、1h")
+    mode.add_argument("--rolling", metavar="WINDOW", help="每筆資料輸出往前一段時間的統計，如 10m")
+    parser.add_argument("--how", default="mean", help=f"分桶: {'/'.join(RESAMPLE_HOW)}；滑動: {'/'.join(ROLLING_HOW)}")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--timing", action="store_true", help="在 stderr 印出查詢耗時")
+    args = parser.parse_args(argv)
+
+    columns = args.column or list(DEFAULT_COLUMNS)
+    for name in columns:
+        if name not in NUMERIC_COLUMNS:
+            parser.error(f"未知的欄位 {name}，可用: {', '.join(NUMERIC_COLUMNS)}")
+    try:
+        end_ts = _parse_time(args.end) if args.end else None
+        start_ts = _parse_time(args.start) if args.start else None
+        if args.since:
+            start_ts = (end_ts or time.time()) - parse_duration(args.since)
+        bucket_s = parse_duration(args.resample) if args.resample else None
+        window_s = parse_duration(args.rolling) if args.rolling else None
+    except ValueError as e:
+        parser.error(str(e))
+    if (args.resample or args.rolling) and len(columns) != 1:
+        parser.error("--resample/--rolling 一次只能指定一個欄位")
+    if args.resample and args.how not in RESAMPLE_HOW:
+        parser.error(f"--resample 的 --how 可用: {', '.join(RESAMPLE_HOW)}")
+    if args.rolling and args.how not in ROLLING_HOW:
+        parser.error(f"--rolling 的 --how 可用: {', '.join(ROLLING_HOW)}")
+
+    t0 = time.perf_counter()
+    chunks = iter_chunks(args.log_root, columns, start_ts, end_ts, args.serial)
+    out = sys.stdout
+    writer = csv.writer(out) if args.format == "csv" else None
+    count = 0
+    try:
+        if bucket_s or window_s:
+            if bucket_s:
+                results = resample(chunks, columns[0], bucket_s, args.how)
+            else:
+                results = rolling(chunks, columns[0], window_s, args.how)
+            if writer:
+                writer.writerow(["serial", "ts", f"{columns[0]}_{args.how}"])
+            for serial, ts, value in results:
+                count += 1
+                if writer:
+                    writer.writerow([serial, _iso(ts), "" if value is None else f"{value:.4f}"])
+                else:
+                    out.write(json.dumps({"serial": serial, "ts": _iso(ts), columns[0]: value}) + "\n")
+        else:
+            stat_names = ["count", "min", "max", "mean"] + [f"p{p:g}" for p in SUMMARY_PERCENTILES]
+            if writer:
+                writer.writerow(["serial", "start", "end", "rows", "column"] + stat_names)
+            for result in summarize(chunks, columns):
+                count += 1
+                if writer:
+                    for name, stats in result["columns"].items():
+                        writer.writerow([result["serial"], _iso(result["start"]), _iso(result["end"]), result["rows"], name]
+                                        + ["" if stats.get(s) is None else f"{stats[s]:.4f}" for s in stat_names])
+                else:
+                    result["start"], result["end"] = _iso(result["start"]), _iso(result["end"])
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+    except BrokenPipeError:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, out.fileno())
+    if args.timing:
+        backend = "numpy" if np is not None else "array"
+        print(f"{count} 筆結果，耗時 {(time.perf_counter() - t0) * 1000:.0f} ms ({backend})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
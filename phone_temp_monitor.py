@@ -1,17 +1,31 @@
+import time
+
+_T0 = time.perf_counter()
+
 import os
 import sys
+import json
+import argparse
+import asyncio
 import csv
-import time
 import re
+import shlex
 import subprocess
-from datetime import datetime, timedelta
-
-try:
-    import tkinter as tk
-    from tkinter import ttk, messagebox
-except Exception as e:
-    print("Tkinter not available:", e)
-    sys.exit(1)
+import threading
+import queue
+import heapq
+import math
+import operator
+import mmap
+import struct
+import gzip
+import lzma
+import zlib
+import bisect
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 
 
 # --------------------- ADB helpers ---------------------
@@ -34,7 +48,112 @@ def run_cmd(cmd, timeout=5):
         raise RuntimeError("執行 adb 逾時，請確認裝置連線正常。")
 
 
+# "subprocess" forks the adb binary per query; "socket" talks to the adb
+# server on port 5037 directly (see adb_client.py).
+ADB_TRANSPORT = os.environ.get("PTM_ADB_TRANSPORT", "subprocess")
+_adb_client = None
+
+
+def set_adb_transport(kind):
+    global ADB_TRANSPORT, _adb_client
+    if kind not in ("subprocess", "socket"):
+        raise ValueError(f"未知的 adb 傳輸方式: {kind}")
+    if _adb_client is not None:
+        _adb_client.close()
+        _adb_client = None
+    ADB_TRANSPORT = kind
+
+
+def _get_adb_client():
+    global _adb_client
+    if _adb_client is None:
+        from adb_client import AdbSocketClient
+        _adb_client = AdbSocketClient()
+    return _adb_client
+
+
+async def run_cmd_async(cmd, timeout=5):
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise RuntimeError("找不到 adb。請先安裝 Android Platform Tools 並將 adb 加入 PATH。")
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        proc.kill()
+        try:
+            await asyncio.wait_for(proc.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise RuntimeError("執行 adb 逾時，請確認裝置連線正常。")
+    if proc.returncode != 0:
+        raise RuntimeError(err.decode("utf-8", "replace").strip() or f"Command failed: {' '.join(cmd)}")
+    return out.decode("utf-8", "replace")
+
+
+def _adb_shell(serial, args, timeout):
+    if ADB_TRANSPORT == "socket":
+        return _get_adb_client().shell(serial, args, timeout=timeout)
+    if isinstance(args, str):
+        args = [args]
+    return run_cmd(["adb", "-s", serial, "shell", *args], timeout=timeout)
+
+
+async def _adb_shell_async(serial, args, timeout):
+    if ADB_TRANSPORT == "socket":
+        return await _get_adb_client().shell_async(serial, args, timeout=timeout)
+    if isinstance(args, str):
+        args = [args]
+    return await run_cmd_async(["adb", "-s", serial, "shell", *args], timeout=timeout)
+
+
+# Set by start_capture()/start_replay() (see "Capture and replay"): every
+# shell reply is either appended to a capture file or served from one.
+_capture = None
+_replay = None
+
+
+def adb_shell(serial, args, timeout=5):
+    if _replay is not None:
+        return _replay.next(serial, args)
+    if _capture is None:
+        return _adb_shell(serial, args, timeout)
+    start = time.time()
+    try:
+        out = _adb_shell(serial, args, timeout)
+    except RuntimeError as e:
+        _capture.record(start, serial, args, str(e), error=True)
+        raise
+    _capture.record(start, serial, args, out)
+    return out
+
+
+async def adb_shell_async(serial, args, timeout=5):
+    if _replay is not None:
+        return _replay.next(serial, args)
+    if _capture is None:
+        return await _adb_shell_async(serial, args, timeout)
+    start = time.time()
+    try:
+        out = await _adb_shell_async(serial, args, timeout)
+    except RuntimeError as e:
+        _capture.record(start, serial, args, str(e), error=True)
+        raise
+    _capture.record(start, serial, args, out)
+    return out
+
+
 def list_adb_devices():
+    if _replay is not None:
+        return list(_replay.serials)
+    if ADB_TRANSPORT == "socket":
+        return _get_adb_client().devices()
     out = run_cmd(["adb", "devices"])
     lines = [l.strip() for l in out.splitlines() if l.strip()]
     devices = []
@@ -58,34 +177,130 @@ def parse_battery_temp_from_dumpsys(text):
     return None
 
 
+TEMP_FALLBACK_PATHS = [
+    "/sys/class/thermal/thermal_zone0/temp",
+    "/sys/class/thermal/thermal_zone1/temp",
+    "/sys/class/power_supply/battery/temp",
+]
+
+
+def parse_sysfs_temp(raw):
+    raw = raw.strip()
+    if not raw:
+        return None
+    val = float(raw)
+    if val > 1000:
+        return val / 1000.0
+    if val > 100:
+        return val / 10.0
+    return val
+
+
 def get_phone_temperature(serial):
-    out = run_cmd(["adb", "-s", serial, "shell", "dumpsys", "battery"])
+    out = adb_shell(serial, ["dumpsys", "battery"])
     temp_c = parse_battery_temp_from_dumpsys(out)
     if temp_c is not None:
         return temp_c
 
-    candidate_paths = [
-        "/sys/class/thermal/thermal_zone0/temp",
-        "/sys/class/thermal/thermal_zone1/temp",
-        "/sys/class/power_supply/battery/temp",
-    ]
-    for path in candidate_paths:
+    for path in TEMP_FALLBACK_PATHS:
         try:
-            out = run_cmd(["adb", "-s", serial, "shell", "cat", path])
-            raw = out.strip()
-            if not raw:
-                continue
-            val = float(raw)
-            if val > 1000:
-                return val / 1000.0
-            if val > 100:
-                return val / 10.0
-            return val
+            out = adb_shell(serial, ["cat", path])
+            val = parse_sysfs_temp(out)
+            if val is not None:
+                return val
         except Exception:
             continue
     raise RuntimeError("無法讀取手機溫度 (dumpsys/thermal 路徑皆失敗)")
 
 
+def safe_serial(serial):
+    # Network serials look like 192.168.0.5:5555; keep them filename-safe.
+    return re.sub(r"[^A-Za-z0-9._-]", "_", serial)
+
+
+# --------------------- Thermal zones ---------------------
+# Zones are discovered once per device (index, type, and the unit of their
+# `temp` node); every tick then reads the known zones with the shell `read`
+# builtin inside the batched snapshot.
+THERMAL_ZONE_DIR = "/sys/class/thermal"
+THERMAL_GROUPS = (
+    ("battery", ("battery", "batt")),
+    ("gpu", ("gpu",)),
+    ("skin", ("skin", "xo_therm", "quiet_therm", "case", "shell", "back")),
+    ("cpu", ("cpu", "cluster", "tsens", "soc", "apc", "big", "little", "mid")),
+)
+THERMAL_SERIES = ("cpu", "gpu", "skin", "battery", "other")
+
+
+@dataclass
+class ThermalZone:
+    index: int
+    name: str
+    group: str
+    divisor: float
+
+
+def thermal_group(zone_type):
+    zone_type = zone_type.lower()
+    for group, needles in THERMAL_GROUPS:
+        if any(needle in zone_type for needle in needles):
+            return group
+    return "other"
+
+
+def thermal_divisor(raw):
+    # The sysfs ABI is millidegrees; a few vendor zones report tenths or
+    # whole degrees. Decided once from the discovery reading.
+    try:
+        val = abs(float(raw))
+    except ValueError:
+        return None
+    if val > 1000 or val == 0:
+        return 1000.0
+    if val > 100:
+        return 10.0
+    return 1.0
+
+
+def parse_thermal_zones(text):
+    zones = []
+    seen = set()
+    for line in text.splitlines():
+        parts = line.split(None, 2)
+        if len(parts) < 3 or not parts[0].isdigit():
+            continue
+        divisor = thermal_divisor(parts[1])
+        if divisor is None:
+            continue
+        name = parts[2].strip()
+        if name in seen:
+            name = f"{name}_{parts[0]}"
+        seen.add(name)
+        zones.append(ThermalZone(int(parts[0]), name, thermal_group(name), divisor))
+    return zones
+
+
+def parse_thermal_temps(text, zones):
+    by_index = {zone.index: zone for zone in zones}
+    temps = {}
+    groups = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 2 or not parts[0].isdigit():
+            continue
+        zone = by_index.get(int(parts[0]))
+        if zone is None:
+            continue
+        try:
+            temp = float(parts[1]) / zone.divisor
+        except ValueError:
+            continue
+        temps[zone.name] = temp
+        if temp > groups.get(zone.group, float("-inf")):
+            groups[zone.group] = temp
+    return temps, groups
+
+
 # --------------------- Memory helpers ---------------------
 def parse_meminfo(text):
     info = {}
@@ -101,8 +316,11 @@ def parse_meminfo(text):
 
 
 def get_system_memory_kb(serial):
-    out = run_cmd(["adb", "-s", serial, "shell", "cat", "/proc/meminfo"])
-    data = parse_meminfo(out)
+    out = adb_shell(serial, ["cat", "/proc/meminfo"])
+    return sys_mem_from_meminfo(parse_meminfo(out))
+
+
+def sys_mem_from_meminfo(data):
     total = data.get("MemTotal", 0.0)
     avail = data.get("MemAvailable", 0.0)
     if avail <= 0:
@@ -112,7 +330,11 @@ def get_system_memory_kb(serial):
 
 
 def _read_proc_stat_total(serial):
-    txt = run_cmd(["adb", "-s", serial, "shell", "cat", "/proc/stat"]) 
+    txt = adb_shell(serial, ["cat", "/proc/stat"])
+    return parse_proc_stat_total(txt)
+
+
+def parse_proc_stat_total(txt):
     total = 0
     ncpu = 0
     for line in txt.splitlines():
@@ -128,7 +350,11 @@ def _read_proc_stat_total(serial):
 
 
 def _read_proc_pid_stat(serial, pid):
-    txt = run_cmd(["adb", "-s", serial, "shell", "cat", f"/proc/{pid}/stat"]) 
+    txt = adb_shell(serial, ["cat", f"/proc/{pid}/stat"])
+    return parse_proc_pid_stat(txt)
+
+
+def parse_proc_pid_stat(txt):
     rparen = txt.rfind(')')
     rest = txt[rparen+2:] if rparen != -1 else txt
     parts = rest.split()
@@ -144,7 +370,7 @@ def _read_proc_pid_stat(serial, pid):
 
 def _get_page_size_kb(serial):
     try:
-        out = run_cmd(["adb", "-s", serial, "shell", "getconf", "PAGESIZE"], timeout=3)
+        out = adb_shell(serial, ["getconf", "PAGESIZE"], timeout=3)
         v = out.strip()
         ps = float(v) / 1024.0
         if ps > 0:
@@ -156,14 +382,14 @@ def _get_page_size_kb(serial):
 
 def _get_pid_for_package(serial, package):
     try:
-        out = run_cmd(["adb", "-s", serial, "shell", "pidof", package], timeout=3)
+        out = adb_shell(serial, ["pidof", package], timeout=3)
         pids = [p for p in out.strip().split() if p.isdigit()]
         if pids:
             return pids[0]
     except Exception:
         pass
     try:
-        out = run_cmd(["adb", "-s", serial, "shell", "ps", "-A"]) 
+        out = adb_shell(serial, ["ps", "-A"])
         cand = None
         for line in out.splitlines():
             if package in line:
@@ -181,20 +407,40 @@ def _get_pid_for_package(serial, package):
 
 def _read_statm_mb(serial, pid, page_kb):
     try:
-        out = run_cmd(["adb", "-s", serial, "shell", "cat", f"/proc/{pid}/statm"]) 
-        parts = out.strip().split()
-        if len(parts) >= 3:
+        out = adb_shell(serial, ["cat", f"/proc/{pid}/statm"])
+        return parse_statm_mb(out, page_kb)
+    except Exception:
+        pass
+    return None, None, None
+
+
+def parse_statm_mb(txt, page_kb):
+    parts = txt.strip().split()
+    if len(parts) >= 3:
+        try:
             size = float(parts[0]) * page_kb / 1024.0
             resident = float(parts[1]) * page_kb / 1024.0
             shared = float(parts[2]) * page_kb / 1024.0
             return size, resident, shared
-    except Exception:
-        pass
+        except ValueError:
+            pass
     return None, None, None
 
 
-def get_process_metrics(serial, package, cpu_prev_cache):
-    result = {
+def update_cpu_percent(cpu_prev_cache, pid, total, proc_ticks, ncpu):
+    prev = cpu_prev_cache.get(pid)
+    cpu_percent = None
+    if prev and proc_ticks is not None:
+        d_proc = max(proc_ticks - prev['proc'], 0.0)
+        d_total = max(total - prev['total'], 1e-6)
+        cpu_percent = (d_proc / d_total) * 100.0 * ncpu
+    cpu_prev_cache.clear()
+    cpu_prev_cache[pid] = {'proc': proc_ticks if proc_ticks is not None else 0.0, 'total': total}
+    return cpu_percent
+
+
+def _new_proc_result():
+    return {
         'pid': None,
         'virt_mb': None,
         'res_mb': None,
@@ -203,6 +449,10 @@ def get_process_metrics(serial, package, cpu_prev_cache):
         'mem_percent': None,
         'error_message': '',
     }
+
+
+def get_process_metrics(serial, package, cpu_prev_cache):
+    result = _new_proc_result()
     try:
         pid = _get_pid_for_package(serial, package)
         if not pid:
@@ -218,15 +468,7 @@ def get_process_metrics(serial, package, cpu_prev_cache):
 
         total_1, ncpu = _read_proc_stat_total(serial)
         proc_1 = _read_proc_pid_stat(serial, pid)
-        prev = cpu_prev_cache.get(pid)
-        cpu_percent = None
-        if prev and proc_1 is not None:
-            d_proc = max(proc_1 - prev['proc'], 0.0)
-            d_total = max(total_1 - prev['total'], 1e-6)
-            cpu_percent = (d_proc / d_total) * 100.0 * ncpu
-        cpu_prev_cache.clear()
-        cpu_prev_cache[pid] = {'proc': proc_1 if proc_1 is not None else 0.0, 'total': total_1}
-        result['cpu_percent'] = cpu_percent
+        result['cpu_percent'] = update_cpu_percent(cpu_prev_cache, pid, total_1, proc_1, ncpu)
 
         meminfo = get_system_memory_kb(serial)
         if res_mb is not None and meminfo['total_kb']:
@@ -238,324 +480,3047 @@ def get_process_metrics(serial, package, cpu_prev_cache):
         return result
 
 
-# --------------------- UI app ---------------------
-class App(tk.Tk):
+# --------------------- Tick timing ---------------------
+# With the batched snapshot a device read is one adb round trip ("adb"); the
+# other device stages are host-side parsing of their sections. A PID-cache
+# miss re-runs the snapshot and that second round trip is charged to "pid".
+TICK_STAGES = ("adb", "temp", "meminfo", "pid", "cpu", "statm", "threads", "procs", "log", "retention")
+STAGE_WINDOW = 120
+
+
+class StageClock:
+    def __init__(self, timings):
+        self.timings = timings
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.timings[name] = self.timings.get(name, 0.0) + (now - self._last)
+        self._last = now
+
+
+class StageStats:
+    def __init__(self, window=STAGE_WINDOW):
+        self._samples = {name: deque(maxlen=window) for name in TICK_STAGES}
+
+    def record(self, timings):
+        for name, seconds in timings.items():
+            samples = self._samples.get(name)
+            if samples is not None:
+                samples.append(seconds)
+
+    def summary(self):
+        out = {}
+        for name, samples in self._samples.items():
+            if samples:
+                ordered = sorted(samples)
+                mean_ms = sum(ordered) / len(ordered) * 1000.0
+                p95_ms = ordered[int(0.95 * (len(ordered) - 1))] * 1000.0
+                out[name] = (mean_ms, p95_ms)
+        return out
+
+    def format(self, missed=0, limit=4):
+        slowest = sorted(self.summary().items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+        text = "耗時 平均/p95: " + ", ".join(f"{name} {mean:.0f}/{p95:.0f}ms" for name, (mean, p95) in slowest)
+        if missed:
+            text += f"；錯過 {missed} 個取樣時段"
+        return text
+
+
+# Ticks target absolute deadlines (start + k * interval), so collection time
+# does not stretch the period; an overrun skips whole slots and counts them.
+class DeadlineScheduler:
+    def __init__(self, interval_s, now=None):
+        self.interval_s = interval_s
+        self.deadline = time.monotonic() if now is None else now
+        self.missed = 0
+
+    def next_delay(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.deadline += self.interval_s
+        if self.deadline < now:
+            missed = int((now - self.deadline) / self.interval_s) + 1
+            self.missed += missed
+            self.deadline += missed * self.interval_s
+        return self.deadline - now
+
+
+# --------------------- Adaptive sampling ---------------------
+# Shrinks the tick interval while temperature, CPU or memory move quickly or
+# sit near a limit, and stretches it again after a run of quiet samples. A
+# limit breach or fast change halves the interval (down to min_ms); every
+# ADAPTIVE_STABLE_TICKS quiet samples grow it by ADAPTIVE_BACKOFF (up to max_ms).
+ADAPTIVE_MIN_MS = 500
+ADAPTIVE_MAX_MS = 10000
+ADAPTIVE_STABLE_TICKS = 3
+ADAPTIVE_BACKOFF = 1.5
+# Temperature slope is taken against the oldest sample in this window, so a
+# single 0.1 °C quantisation step at a short interval does not read as a ramp.
+ADAPTIVE_RATE_WINDOW_S = 5.0
+# Only the zones the limit is meant for: SoC zones (cpu/gpu/other) routinely
+# run well above a battery/skin limit and would pin the interval at min_ms.
+ADAPTIVE_TEMP_GROUPS = ("battery", "skin")
+
+
+@dataclass
+class AdaptivePolicy:
+    min_ms: float = ADAPTIVE_MIN_MS
+    max_ms: float = ADAPTIVE_MAX_MS
+    temp_rate_c_per_s: float = 0.05
+    cpu_delta_pct: float = 10.0
+    mem_delta_pct: float = 2.0
+    temp_limit_c: float = 45.0
+    cpu_limit_pct: float = 80.0
+    mem_limit_pct: float = 90.0
+    margin: float = 0.9
+
+
+def adaptive_signals(snap):
+    temps = [snap.temp_c, *(snap.thermal.get(group) for group in ADAPTIVE_TEMP_GROUPS)]
+    temps = [t for t in temps if t is not None]
+    sys_mem = snap.sys_mem
+    mem_pct = None
+    if sys_mem.get('total_kb'):
+        mem_pct = sys_mem['used_kb'] / sys_mem['total_kb'] * 100.0
+    cpu = snap.proc.get('cpu_percent') if snap.proc else None
+    return {"temp": max(temps) if temps else None, "cpu": cpu, "mem": mem_pct}
+
+
+class AdaptiveInterval:
+    def __init__(self, policy=None, start_ms=None):
+        self.policy = policy or AdaptivePolicy()
+        self.min_ms = self.policy.min_ms
+        self.max_ms = max(self.policy.max_ms, self.min_ms)
+        self.interval_ms = min(max(start_ms or self.min_ms, self.min_ms), self.max_ms)
+        self.reason = ""
+        self._recent = deque()
+        self._stable = 0
+
+    def _near_limit(self, sig):
+        lim = self.policy
+        for name, limit in (("temp", lim.temp_limit_c), ("cpu", lim.cpu_limit_pct), ("mem", lim.mem_limit_pct)):
+            if sig[name] is not None and sig[name] >= limit * lim.margin:
+                return name
+        return None
+
+    def _changing(self, ts, sig):
+        if not self._recent:
+            return None
+        lim = self.policy
+        first_ts, first = self._recent[0]
+        prev = self._recent[-1][1]
+        if sig["temp"] is not None and first["temp"] is not None:
+            if abs(sig["temp"] - first["temp"]) / max(ts - first_ts, 1e-3) >= lim.temp_rate_c_per_s:
+                return "temp"
+        if sig["cpu"] is not None and prev["cpu"] is not None:
+            if abs(sig["cpu"] - prev["cpu"]) >= lim.cpu_delta_pct:
+                return "cpu"
+        if sig["mem"] is not None and prev["mem"] is not None:
+            if abs(sig["mem"] - prev["mem"]) >= lim.mem_delta_pct:
+                return "mem"
+        return None
+
+    def update(self, ts, snap):
+        sig = adaptive_signals(snap)
+        limit = self._near_limit(sig)
+        change = self._changing(ts, sig)
+        if limit is not None:
+            self.interval_ms = self.min_ms
+            self.reason = f"limit:{limit}"
+            self._stable = 0
+        elif change is not None:
+            self.interval_ms = max(self.min_ms, self.interval_ms / 2.0)
+            self.reason = f"change:{change}"
+            self._stable = 0
+        else:
+            self._stable += 1
+            self.reason = "stable"
+            if self._stable >= ADAPTIVE_STABLE_TICKS:
+                self.interval_ms = min(self.max_ms, self.interval_ms * ADAPTIVE_BACKOFF)
+                self._stable = 0
+        self._recent.append((ts, sig))
+        while len(self._recent) > 1 and ts - self._recent[1][0] >= ADAPTIVE_RATE_WINDOW_S:
+            self._recent.popleft()
+        return self.interval_ms
+
+
+# --------------------- Process table ---------------------
+# Extra packages and the top-N view come from one device-side loop over the
+# target PIDs (or every /proc/[0-9]*) that uses only shell builtins, so the
+# cost grows with the number of processes, not with adb calls. CPU deltas are
+# keyed by (pid, starttime): a reused PID starts a fresh entry, and entries
+# not seen in a scan are dropped.
+TOP_SORT_KEYS = ("cpu", "rss")
+
+
+@dataclass
+class ProcessScan:
+    packages: tuple = ()
+    top_n: int = 0
+    sort_by: str = "cpu"
+    threads: int = 0
+
+
+def build_process_scan_script(scan):
+    mark = SNAPSHOT_MARK
+    parts = []
+    if scan.packages:
+        parts.append("a=")
+        for i, pkg in enumerate(scan.packages):
+            parts.append(f"echo {mark}pids{i}; x=$(pidof {shlex.quote(pkg)} 2>/dev/null); echo $x; a=\"$a $x\"")
+    loop = "d in /proc/[0-9]*" if scan.top_n else "p in $a; do d=/proc/$p;"
+    if not loop.endswith(";"):
+        loop += "; do"
+    parts.append(
+        f"echo {mark}procs; for {loop} read -r s < $d/stat && read -r m < $d/statm"
+        f" && echo \"$s|$m\"; done 2>/dev/null"
+    )
+    return "; ".join(parts)
+
+
+def parse_stat_line(stat):
+    lparen = stat.find("(")
+    rparen = stat.rfind(")")
+    if lparen == -1 or rparen < lparen:
+        return None
+    pid = stat[:lparen].strip()
+    fields = stat[rparen+2:].split()
+    if not pid.isdigit() or len(fields) < 20:
+        return None
+    try:
+        ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    except ValueError:
+        return None
+    return int(pid), stat[lparen+1:rparen], fields[19], ticks
+
+
+def parse_process_line(line):
+    stat, sep, statm = line.rpartition("|")
+    mem = statm.split()
+    if not sep or len(mem) < 3:
+        return None
+    parsed = parse_stat_line(stat)
+    if parsed is None:
+        return None
+    try:
+        return (*parsed, int(mem[0]), int(mem[1]), int(mem[2]))
+    except ValueError:
+        return None
+
+
+class ProcessTable:
+    def __init__(self):
+        self._prev = {}
+        self._prev_total = None
+
+    def update(self, lines, total, ncpu, page_kb, mem_total_kb):
+        d_total = total - self._prev_total if self._prev_total is not None else 0.0
+        prev = self._prev
+        cur = {}
+        rows = []
+        mb = page_kb / 1024.0
+        for line in lines:
+            parsed = parse_process_line(line)
+            if parsed is None:
+                continue
+            pid, comm, starttime, ticks, size, resident, shared = parsed
+            key = (pid, starttime)
+            cur[key] = ticks
+            last = prev.get(key)
+            cpu = None
+            if last is not None and d_total > 0:
+                cpu = max(ticks - last, 0) / d_total * 100.0 * ncpu
+            res_mb = resident * mb
+            rows.append({
+                'pid': pid,
+                'name': comm,
+                'virt_mb': size * mb,
+                'res_mb': res_mb,
+                'shr_mb': shared * mb,
+                'cpu_percent': cpu,
+                'mem_percent': res_mb * 1024.0 / mem_total_kb * 100.0 if mem_total_kb else None,
+                'error_message': '',
+            })
+        self._prev = cur
+        self._prev_total = total
+        return rows
+
+
+# Per-thread CPU of the tracked package. Only (tid, starttime) -> ticks of the
+# latest scan is kept, so exited threads fall out on the next tick; the rows
+# are reduced to the top N before they leave the parser.
+class ThreadTable:
     def __init__(self):
-        super().__init__()
-        self.title("手機溫度/記憶體監控 (Python)")
-        self.geometry("640x420")
-        self.minsize(560, 360)
-        self.resizable(True, True)
-        self.bind("<Configure>", self._on_resize)
-
-        self.refresh_ms = tk.IntVar(value=2000)
-        self.is_running = False
-        self.job_after_id = None
-        self.selected_device = tk.StringVar(value="")
-        self.current_temp = tk.StringVar(value="--")
-        self.mem_usage_pct = tk.StringVar(value="--")
-        self.mem_avail_mb = tk.StringVar(value="--")
-        self.mem_total_mb = tk.StringVar(value="--")
-        self.app_pss_mb = tk.StringVar(value="--")
-        self.status_text = tk.StringVar(value="待機中")
-        self.logging_enabled = tk.BooleanVar(value=True)
-        self.package_name = tk.StringVar(value="")
-
-        # logging/rotation
-        self.log_root = os.path.join(os.getcwd(), "logs")
-        self.current_log_dir = None
-        self.current_log_path = None
+        self._prev = {}
+        self._prev_total = None
+
+    def update(self, lines, total, ncpu, top_n):
+        d_total = total - self._prev_total if self._prev_total is not None else 0.0
+        prev = self._prev
+        cur = {}
+        rows = []
+        for line in lines:
+            parsed = parse_stat_line(line)
+            if parsed is None:
+                continue
+            tid, comm, starttime, ticks = parsed
+            key = (tid, starttime)
+            cur[key] = ticks
+            last = prev.get(key)
+            if last is not None and d_total > 0:
+                rows.append((max(ticks - last, 0) / d_total * 100.0 * ncpu, tid, comm))
+        self._prev = cur
+        self._prev_total = total
+        return [
+            {'tid': tid, 'name': comm, 'cpu_percent': cpu}
+            for cpu, tid, comm in heapq.nlargest(top_n, rows)
+        ]
+
+
+def package_metrics(rows_by_pid, pids):
+    rows = [rows_by_pid[pid] for pid in pids if pid in rows_by_pid]
+    if not rows:
+        result = _new_proc_result()
+        result['error_message'] = '找不到進程'
+        return result
+    result = dict(rows[0])
+    for row in rows[1:]:
+        for key in ('virt_mb', 'res_mb', 'shr_mb', 'cpu_percent', 'mem_percent'):
+            if row[key] is not None:
+                result[key] = (result[key] or 0.0) + row[key]
+    return result
+
+
+def top_processes(rows, n, sort_by="cpu"):
+    if sort_by == "rss":
+        return heapq.nlargest(n, rows, key=lambda r: r['res_mb'])
+    return heapq.nlargest(n, rows, key=lambda r: r['cpu_percent'] if r['cpu_percent'] is not None else -1.0)
+
+
+def _apply_process_scan(snap, sections, scan, info):
+    table = info.proc_table if info is not None else ProcessTable()
+    total, ncpu = parse_proc_stat_total(sections.get("stat", ""))
+    page_kb = 4096.0 / 1024.0
+    mem_total_kb = snap.sys_mem['total_kb']
+    if info is not None:
+        ncpu = info.ncpu
+        page_kb = info.page_kb
+        mem_total_kb = mem_total_kb or info.mem_total_kb
+    rows = table.update(sections.get("procs", "").splitlines(), total, ncpu, page_kb, mem_total_kb)
+    rows_by_pid = {row['pid']: row for row in rows}
+    for i, pkg in enumerate(scan.packages):
+        pids = [int(p) for p in sections.get(f"pids{i}", "").split() if p.isdigit()]
+        for pid in pids:
+            if pid in rows_by_pid:
+                rows_by_pid[pid]['name'] = pkg
+        snap.packages[pkg] = package_metrics(rows_by_pid, pids)
+    if scan.top_n:
+        snap.top = top_processes(rows, scan.top_n, scan.sort_by)
+
+
+# --------------------- Batched snapshot ---------------------
+# One `adb shell` round trip per tick: the device runs a small script that
+# prints every file we need, each section preceded by a marker line, and the
+# combined output is parsed in a single pass.
+SNAPSHOT_MARK = "@@PTM@@"
+
+
+@dataclass
+class Snapshot:
+    temp_c: float = None
+    sys_mem: dict = field(default_factory=dict)
+    proc: dict = None
+    pid_stale: bool = False
+    timings: dict = field(default_factory=dict)
+    packages: dict = field(default_factory=dict)
+    top: list = field(default_factory=list)
+    threads: list = field(default_factory=list)
+    zones: dict = field(default_factory=dict)
+    thermal: dict = field(default_factory=dict)
+    interval_ms: float = None
+
+
+# Per-serial facts that do not change while the device stays attached, plus
+# the last resolved package PID and the process-table CPU deltas. The PID is
+# revalidated every tick against the starttime and cmdline recorded when it
+# was resolved.
+class DeviceInfo:
+    def __init__(self, serial):
+        self.serial = serial
+        self.static_ready = False
+        self.page_kb = 4096.0 / 1024.0
+        self.ncpu = 1
+        self.mem_total_kb = 0.0
+        self.kernel = ""
+        self.abi = ""
+        self.zones = []
+        self.pid_package = None
+        self.pid = None
+        self.pid_starttime = None
+        self.pid_cmdline = None
+        self.proc_table = ProcessTable()
+        self.thread_table = ThreadTable()
+
+    def forget_pid(self):
+        self.pid_package = None
+        self.pid = None
+        self.pid_starttime = None
+        self.pid_cmdline = None
+
+
+_device_info = {}
+_device_info_lock = threading.Lock()
+
+
+def get_device_info(serial):
+    with _device_info_lock:
+        info = _device_info.get(serial)
+        if info is None:
+            info = _device_info[serial] = DeviceInfo(serial)
+        return info
+
+
+def device_static(serial):
+    info = _device_info.get(serial)
+    if info is None or not info.static_ready:
+        return {}
+    return {"kernel": info.kernel, "abi": info.abi, "ncpu": info.ncpu, "mem_total_kb": info.mem_total_kb}
+
+
+def build_snapshot_script(package="", info=None, scan=None):
+    mark = SNAPSHOT_MARK
+    parts = [
+        f"echo {mark}battery; dumpsys battery",
+    ]
+    for i, path in enumerate(TEMP_FALLBACK_PATHS):
+        parts.append(f"echo {mark}temp{i}; {{ read -r v < {path}; }} 2>/dev/null && echo \"$v\"")
+    parts.append(f"echo {mark}meminfo; cat /proc/meminfo")
+    if info is None or not info.static_ready:
+        parts += [
+            f"echo {mark}stat; cat /proc/stat",
+            f"echo {mark}pagesize; getconf PAGESIZE 2>/dev/null",
+            f"echo {mark}kernel; uname -r 2>/dev/null",
+            f"echo {mark}abi; getprop ro.product.cpu.abi 2>/dev/null",
+            f"echo {mark}zones; for z in {THERMAL_ZONE_DIR}/thermal_zone*; do read -r t < $z/type"
+            f" && read -r v < $z/temp && echo \"${{z##*zone}} $v $t\"; done 2>/dev/null",
+        ]
+    else:
+        # Only the aggregate "cpu" line is needed once the CPU count is known;
+        # `read` is a shell builtin, so this costs no process on the device.
+        parts.append(f"echo {mark}stat; read -r l < /proc/stat; echo \"$l\"")
+        if info.zones:
+            indices = " ".join(str(zone.index) for zone in info.zones)
+            parts.append(
+                f"echo {mark}zonetemps; for i in {indices}; do read -r v < {THERMAL_ZONE_DIR}/thermal_zone$i/temp"
+                f" && echo \"$i $v\"; done 2>/dev/null"
+            )
+    parts += _package_script_parts(package, info, scan)
+    if scan is not None and (scan.packages or scan.top_n):
+        parts.append(build_process_scan_script(scan))
+    parts.append(f"echo {mark}end")
+    return "; ".join(parts)
+
+
+def build_pid_script(package, info=None, scan=None):
+    # Follow-up after a stale cached PID: only the package lookup and its
+    # /proc reads, plus the aggregate cpu line for the CPU delta.
+    mark = SNAPSHOT_MARK
+    parts = [f"echo {mark}stat; read -r l < /proc/stat; echo \"$l\""]
+    parts += _package_script_parts(package, info, scan)
+    parts.append(f"echo {mark}end")
+    return "; ".join(parts)
+
+
+def _package_script_parts(package, info, scan):
+    mark = SNAPSHOT_MARK
+    parts = []
+    if package:
+        pkg = shlex.quote(package)
+        if info is not None and info.pid_package == package and info.pid:
+            parts.append(f"set -- {info.pid}; echo {mark}pidcached")
+        else:
+            parts += [
+                f"set -- $(pidof {pkg} 2>/dev/null)",
+                f"[ -z \"$1\" ] && set -- $(ps -A 2>/dev/null | grep -F {pkg} | awk '{{print $2}}')",
+            ]
+        parts += [
+            f"echo {mark}pid; echo $1",
+            f"if [ -n \"$1\" ]; then echo {mark}pidstat; cat /proc/$1/stat 2>/dev/null;"
+            f" echo {mark}cmdline; cat /proc/$1/cmdline 2>/dev/null; echo;"
+            f" echo {mark}statm; cat /proc/$1/statm 2>/dev/null; fi",
+        ]
+    if package and scan is not None and scan.threads:
+        parts.append(
+            f"if [ -n \"$1\" ]; then echo {mark}tasks; for t in /proc/$1/task/[0-9]*;"
+            f" do read -r s < $t/stat && echo \"$s\"; done 2>/dev/null; fi"
+        )
+    return parts
+
+
+def split_snapshot_sections(text):
+    sections = {}
+    name = None
+    buf = []
+    for line in text.splitlines():
+        if line.startswith(SNAPSHOT_MARK):
+            if name is not None:
+                sections[name] = "\n".join(buf)
+            name = line[len(SNAPSHOT_MARK):].strip()
+            buf = []
+        elif name is not None:
+            buf.append(line)
+    if name is not None:
+        sections[name] = "\n".join(buf)
+    return sections
+
+
+def parse_proc_pid_starttime(txt):
+    rparen = txt.rfind(')')
+    parts = txt[rparen+2:].split() if rparen != -1 else []
+    return parts[19] if len(parts) > 19 else None
+
+
+def _update_static_info(info, sections, sys_mem):
+    if "pagesize" in sections:
+        try:
+            page_kb = float(sections["pagesize"].strip()) / 1024.0
+            if page_kb > 0:
+                info.page_kb = page_kb
+        except ValueError:
+            pass
+        info.kernel = sections.get("kernel", "").strip()
+        info.abi = sections.get("abi", "").strip()
+        info.zones = parse_thermal_zones(sections.get("zones", ""))
+        info.ncpu = parse_proc_stat_total(sections.get("stat", ""))[1]
+        info.static_ready = True
+    if sys_mem['total_kb']:
+        info.mem_total_kb = sys_mem['total_kb']
+
+
+def parse_snapshot(text, package, cpu_prev_cache, info=None, timings=None, scan=None):
+    snap = Snapshot(timings=timings if timings is not None else {})
+    clock = StageClock(snap.timings)
+    sections = split_snapshot_sections(text)
+
+    snap.temp_c = parse_battery_temp_from_dumpsys(sections.get("battery", ""))
+    if snap.temp_c is None:
+        for i in range(len(TEMP_FALLBACK_PATHS)):
+            try:
+                snap.temp_c = parse_sysfs_temp(sections.get(f"temp{i}", ""))
+            except ValueError:
+                continue
+            if snap.temp_c is not None:
+                break
+    clock.lap("temp")
+
+    snap.sys_mem = sys_mem_from_meminfo(parse_meminfo(sections.get("meminfo", "")))
+    if info is not None:
+        _update_static_info(info, sections, snap.sys_mem)
+    clock.lap("meminfo")
+
+    if "zones" in sections:
+        zones = info.zones if info is not None else parse_thermal_zones(sections["zones"])
+        readings = "\n".join(" ".join(line.split(None, 2)[:2]) for line in sections["zones"].splitlines())
+        snap.zones, snap.thermal = parse_thermal_temps(readings, zones)
+    elif info is not None and "zonetemps" in sections:
+        snap.zones, snap.thermal = parse_thermal_temps(sections["zonetemps"], info.zones)
+    clock.lap("temp")
+
+    if package and info is not None and "pidcached" in sections:
+        # Checked before the process scan: a stale PID is followed by a
+        # second round trip, and the scan must only see this tick's delta once.
+        starttime = parse_proc_pid_starttime(sections.get("pidstat", ""))
+        cmdline = sections.get("cmdline", "").strip("\x00\n")
+        if starttime is None or starttime != info.pid_starttime or cmdline != info.pid_cmdline:
+            # The process exited or the PID was reused; rescan.
+            info.forget_pid()
+            snap.pid_stale = True
+        clock.lap("pid")
+
+    if scan is not None and "procs" in sections:
+        _apply_process_scan(snap, sections, scan, info)
+        clock.lap("procs")
+
+    if package and not snap.pid_stale:
+        _parse_package(snap, sections, package, cpu_prev_cache, info, scan, clock)
+    return snap
+
+
+def _parse_package(snap, sections, package, cpu_prev_cache, info, scan, clock):
+    proc = _new_proc_result()
+    snap.proc = proc
+    pid = sections.get("pid", "").strip()
+    pidstat = sections.get("pidstat", "")
+    cmdline = sections.get("cmdline", "").strip("\x00\n")
+    starttime = parse_proc_pid_starttime(pidstat)
+    if not pid.isdigit():
+        proc['error_message'] = '找不到進程'
+        clock.lap("pid")
+        return
+    proc['pid'] = int(pid)
+    if info is not None and "pidcached" not in sections and starttime is not None:
+        info.pid_package = package
+        info.pid = pid
+        info.pid_starttime = starttime
+        info.pid_cmdline = cmdline
+    clock.lap("pid")
+
+    if info is not None:
+        page_kb = info.page_kb
+    else:
+        try:
+            page_kb = float(sections.get("pagesize", "").strip()) / 1024.0
+        except ValueError:
+            page_kb = 0.0
+        if page_kb <= 0:
+            page_kb = 4096.0 / 1024.0
+    virt_mb, res_mb, shr_mb = parse_statm_mb(sections.get("statm", ""), page_kb)
+    proc['virt_mb'] = virt_mb
+    proc['res_mb'] = res_mb
+    proc['shr_mb'] = shr_mb
+    mem_total_kb = snap.sys_mem['total_kb'] or (info.mem_total_kb if info is not None else 0.0)
+    if res_mb is not None and mem_total_kb:
+        proc['mem_percent'] = (res_mb * 1024.0) / mem_total_kb * 100.0
+    clock.lap("statm")
+
+    total, ncpu = parse_proc_stat_total(sections.get("stat", ""))
+    if info is not None:
+        ncpu = info.ncpu
+    proc_ticks = parse_proc_pid_stat(pidstat)
+    proc['cpu_percent'] = update_cpu_percent(cpu_prev_cache, pid, total, proc_ticks, ncpu)
+    clock.lap("cpu")
+
+    if scan is not None and scan.threads and "tasks" in sections:
+        table = info.thread_table if info is not None else ThreadTable()
+        snap.threads = table.update(sections["tasks"].splitlines(), total, ncpu, scan.threads)
+        clock.lap("threads")
+
+
+def collect_snapshot(serial, package, cpu_prev_cache, info=None, scan=None):
+    info = info if info is not None else get_device_info(serial)
+    timings = {}
+    start = time.perf_counter()
+    out = adb_shell(serial, build_snapshot_script(package, info, scan))
+    timings["adb"] = time.perf_counter() - start
+    snap = _snapshot_from_output(out, package, cpu_prev_cache, info, timings, scan)
+    if snap.pid_stale:
+        start = time.perf_counter()
+        out = adb_shell(serial, build_pid_script(package, info, scan))
+        _resume_snapshot(snap, out, package, cpu_prev_cache, info, scan, time.perf_counter() - start)
+    return snap
+
+
+async def collect_snapshot_async(serial, package, cpu_prev_cache, timeout=5, info=None, scan=None):
+    info = info if info is not None else get_device_info(serial)
+    timings = {}
+    start = time.perf_counter()
+    out = await adb_shell_async(serial, build_snapshot_script(package, info, scan), timeout=timeout)
+    timings["adb"] = time.perf_counter() - start
+    snap = _snapshot_from_output(out, package, cpu_prev_cache, info, timings, scan)
+    if snap.pid_stale:
+        start = time.perf_counter()
+        out = await adb_shell_async(serial, build_pid_script(package, info, scan), timeout=timeout)
+        _resume_snapshot(snap, out, package, cpu_prev_cache, info, scan, time.perf_counter() - start)
+    return snap
+
+
+def _resume_snapshot(snap, out, package, cpu_prev_cache, info, scan, round_trip):
+    # Second pass after a stale PID: only the package sections are parsed, on
+    # their own clock, and the extra round trip is charged to "pid".
+    if SNAPSHOT_MARK + "end" not in out:
+        raise RuntimeError("裝置回傳的快照資料不完整，請確認裝置連線正常。")
+    extra = {}
+    _parse_package(snap, split_snapshot_sections(out), package, cpu_prev_cache, info, scan, StageClock(extra))
+    extra["pid"] = extra.get("pid", 0.0) + round_trip
+    for name, seconds in extra.items():
+        snap.timings[name] = snap.timings.get(name, 0.0) + seconds
+    snap.pid_stale = False
+
+
+def _snapshot_from_output(out, package, cpu_prev_cache, info=None, timings=None, scan=None):
+    if SNAPSHOT_MARK + "end" not in out:
+        raise RuntimeError("裝置回傳的快照資料不完整，請確認裝置連線正常。")
+    snap = parse_snapshot(out, package, cpu_prev_cache, info, timings, scan)
+    if snap.temp_c is None:
+        raise RuntimeError("無法讀取手機溫度 (dumpsys/thermal 路徑皆失敗)")
+    return snap
+
+
+# --------------------- Streaming sampler ---------------------
+# A shell loop on the device emits one snapshot frame per interval over a
+# single long-lived `exec-out` stream; the host parses frames as lines arrive.
+STREAM_MIN_INTERVAL_MS = 50
+STREAM_DRAIN_MS = 250
+
+
+def build_stream_script(package, interval_ms):
+    mark = SNAPSHOT_MARK
+    batt_idx = len(TEMP_FALLBACK_PATHS) - 1
+    # The battery sysfs node is a plain file read; dumpsys costs a binder call
+    # plus a process and is only used when the node is missing.
+    body = [
+        f"t=$(cat {TEMP_FALLBACK_PATHS[batt_idx]} 2>/dev/null)",
+        f"if [ -n \"$t\" ]; then echo {mark}temp{batt_idx}; echo $t;"
+        f" else echo {mark}battery; dumpsys battery; fi",
+        f"echo {mark}meminfo; cat /proc/meminfo",
+        f"echo {mark}stat; cat /proc/stat",
+    ]
+    prefix = ""
+    if package:
+        pkg = shlex.quote(package)
+        prefix = "pg=$(getconf PAGESIZE 2>/dev/null); p=; "
+        body += [
+            f"echo {mark}pagesize; echo $pg",
+            f"if [ -z \"$p\" ] || [ ! -d /proc/$p ]; then set -- $(pidof {pkg} 2>/dev/null);"
+            f" [ -z \"$1\" ] && set -- $(ps -A 2>/dev/null | grep -F {pkg} | awk '{{print $2}}'); p=$1; fi",
+            f"echo {mark}pid; echo $p",
+            f"if [ -n \"$p\" ]; then echo {mark}pidstat; cat /proc/$p/stat 2>/dev/null;"
+            f" echo {mark}statm; cat /proc/$p/statm 2>/dev/null; fi",
+        ]
+    body += [
+        f"echo {mark}end",
+        f"sleep {interval_ms / 1000.0:.3f}",
+    ]
+    return prefix + "while true; do " + "; ".join(body) + "; done"
+
+
+class StreamSampler:
+    def __init__(self, serial, package, interval_ms):
+        self.serial = serial
+        self.package = package
+        self.interval_ms = interval_ms
+        self.error = None
         self._cpu_prev = {}
+        self._queue = queue.Queue()
+        self._proc = None
+        self._sock = None
+        self._thread = None
+        self._running = False
 
-        self._build_ui()
-        self._populate_devices()
-        self._update_log_target(datetime.now())
-
-    def _build_ui(self):
-        pad = {"padx": 8, "pady": 6}
-
-        self.columnconfigure(0, weight=1)
-        self.rowconfigure(0, weight=1)
-
-        content = ttk.Frame(self, padding=(16, 16, 16, 16))
-        content.grid(row=0, column=0, sticky="nsew")
-        content.columnconfigure(0, weight=0)
-        content.columnconfigure(1, weight=1)
-        content.columnconfigure(2, weight=1)
-
-        row = 0
-        ttk.Label(content, text="裝置:").grid(row=row, column=0, sticky="e", **pad)
-        self.device_combo = ttk.Combobox(content, textvariable=self.selected_device, state="readonly")
-        self.device_combo.grid(row=row, column=1, sticky="ew", **pad)
-        ttk.Button(content, text="重新整理裝置", command=self._populate_devices).grid(row=row, column=2, sticky="ew", **pad)
-
-        row += 1
-        ttk.Label(content, text="更新頻率(ms):").grid(row=row, column=0, sticky="e", **pad)
-        self.refresh_entry = ttk.Spinbox(
-            content,
-            from_=500,
-            to=60000,
-            increment=500,
-            textvariable=self.refresh_ms,
-            width=10,
-        )
-        self.refresh_entry.grid(row=row, column=1, sticky="w", **pad)
-        ttk.Checkbutton(content, text="寫入CSV紀錄", variable=self.logging_enabled).grid(row=row, column=2, sticky="w", **pad)
-
-        row += 1
-        ttk.Label(content, text="App 套件(可選):").grid(row=row, column=0, sticky="e", **pad)
-        ttk.Entry(content, textvariable=self.package_name).grid(row=row, column=1, sticky="ew", **pad)
-        self.package_hint = ttk.Label(content, text="(紀錄 App PSS/CPU/MEM)")
-        self.package_hint.grid(row=row, column=2, sticky="w", **pad)
-
-        row += 1
-        ttk.Label(content, text="目前溫度(°C):", font=("Segoe UI", 11, "bold")).grid(row=row, column=0, sticky="e", **pad)
-        self.temp_label = ttk.Label(content, textvariable=self.current_temp, font=("Consolas", 16, "bold"))
-        self.temp_label.grid(row=row, column=1, sticky="w", **pad)
-
-        row += 1
-        ttk.Label(content, text="系統記憶體使用率:").grid(row=row, column=0, sticky="e", **pad)
-        ttk.Label(content, textvariable=self.mem_usage_pct, font=("Consolas", 12)).grid(row=row, column=1, sticky="w", **pad)
-
-        row += 1
-        ttk.Label(content, text="可用/總記憶體(MB):").grid(row=row, column=0, sticky="ne", **pad)
-        mem_frame = ttk.Frame(content)
-        mem_frame.grid(row=row, column=1, columnspan=2, sticky="ew", **pad)
-        mem_frame.columnconfigure(1, weight=1)
-        mem_frame.columnconfigure(3, weight=1)
-        ttk.Label(mem_frame, text="可用:").grid(row=0, column=0, sticky="e", padx=(0, 6))
-        ttk.Label(mem_frame, textvariable=self.mem_avail_mb, font=("Consolas", 12)).grid(row=0, column=1, sticky="w")
-        ttk.Label(mem_frame, text="總計:").grid(row=0, column=2, sticky="e", padx=(12, 6))
-        ttk.Label(mem_frame, textvariable=self.mem_total_mb, font=("Consolas", 12)).grid(row=0, column=3, sticky="w")
-
-        row += 1
-        ttk.Label(content, text="App PSS(MB):").grid(row=row, column=0, sticky="e", **pad)
-        ttk.Label(content, textvariable=self.app_pss_mb, font=("Consolas", 12)).grid(row=row, column=1, sticky="w", **pad)
-
-        row += 1
-        ttk.Label(content, text="狀態:").grid(row=row, column=0, sticky="ne", **pad)
-        self.status_label = ttk.Label(content, textvariable=self.status_text, wraplength=320, justify="left")
-        self.status_label.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
-        content.rowconfigure(row, weight=1)
-
-        row += 1
-        button_frame = ttk.Frame(content)
-        button_frame.grid(row=row, column=0, columnspan=3, sticky="ew", pady=(10, 0))
-        button_frame.columnconfigure(0, weight=1)
-        button_frame.columnconfigure(1, weight=1)
-
-        self.start_btn = ttk.Button(button_frame, text="開始", command=self.start)
-        self.start_btn.grid(row=0, column=0, sticky="ew", padx=(0, 6))
-        ttk.Button(button_frame, text="停止", command=self.stop).grid(row=0, column=1, sticky="ew", padx=(6, 0))
-
-    def _on_resize(self, event):
-        if event.widget is not self:
-            return
-        wrap_padding = 240
-        wraplength = max(event.width - wrap_padding, 220)
-        self.status_label.configure(wraplength=wraplength)
-        if hasattr(self, "package_hint"):
-            hint_padding = 360
-            self.package_hint.configure(wraplength=max(event.width - hint_padding, 160))
-
-    def _populate_devices(self):
+    def start(self):
+        script = build_stream_script(self.package, self.interval_ms)
+        if ADB_TRANSPORT == "socket":
+            self._sock = _get_adb_client().open_stream(self.serial, script)
+            stream = self._sock.makefile("r", encoding="utf-8", errors="replace", newline="")
+        else:
+            try:
+                self._proc = subprocess.Popen(
+                    ["adb", "-s", self.serial, "exec-out", script],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                    errors="replace",
+                    bufsize=1,
+                )
+            except FileNotFoundError:
+                raise RuntimeError("找不到 adb。請先安裝 Android Platform Tools 並將 adb 加入 PATH。")
+            stream = self._proc.stdout
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _read_loop(self, stream):
+        end = SNAPSHOT_MARK + "end"
+        buf = []
         try:
-            devices = list_adb_devices()
-            self.device_combo["values"] = devices
-            if devices and (self.selected_device.get() not in devices):
-                self.selected_device.set(devices[0])
-            if not devices:
-                self.selected_device.set("")
-                self.status_text.set("找不到裝置，請確認 adb 連線。")
-            else:
-                self.status_text.set(f"已找到 {len(devices)} 台裝置。")
-        except Exception as e:
-            self.device_combo["values"] = []
-            self.selected_device.set("")
-            self.status_text.set(str(e))
+            for line in stream:
+                line = line.rstrip("\r\n")
+                if line != end:
+                    buf.append(line)
+                    continue
+                now_dt = datetime.now()
+                snap = parse_snapshot("\n".join(buf), self.package, self._cpu_prev)
+                self._queue.put((now_dt, snap))
+                buf = []
+        except (OSError, ValueError) as e:
+            if self._running:
+                self.error = f"裝置端串流中斷: {e}"
+        if self._running and self.error is None:
+            self.error = "裝置端串流已結束，請確認裝置連線正常。"
+
+    def drain(self):
+        frames = []
+        while True:
+            try:
+                frames.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not frames and self.error:
+            raise RuntimeError(self.error)
+        return frames
 
-    def _ensure_log_header_for(self, path):
-        if not os.path.exists(path):
+    def stop(self):
+        self._running = False
+        if self._proc is not None:
             try:
-                with open(path, "w", newline="", encoding="utf-8") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([
-                        "timestamp_local",
-                        "timestamp_iso8601",
-                        "adb_sys_total_kb",
-                        "adb_sys_used_kb",
-                        "adb_sys_free_kb",
-                        "adb_proc_pid",
-                        "adb_proc_virt_mb",
-                        "adb_proc_res_mb",
-                        "adb_proc_shr_mb",
-                        "adb_proc_cpu_percent",
-                        "adb_proc_mem_percent",
-                        "error_message",
-                    ])
+                self._proc.terminate()
+                self._proc.wait(timeout=2)
             except Exception:
+                self._proc.kill()
+            self._proc = None
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
                 pass
+            self._sock = None
+
+
+# --------------------- Multi-device monitor ---------------------
+# Every serial gets its own asyncio task, CPU-delta state and concurrency
+# limit, so a slow or hung device only delays its own samples.
+MULTI_MAX_CONCURRENCY = 16
+MULTI_DEVICE_TIMEOUT_S = 5.0
+
+
+class DeviceState:
+    def __init__(self, serial, per_device_limit):
+        self.serial = serial
+        self.cpu_prev = {}
+        self.limit = per_device_limit
+        self.sem = None
+        self.scheduler = None
+        self.adaptive = None
+
+    @property
+    def skipped(self):
+        return self.scheduler.missed if self.scheduler is not None else 0
+
+
+class MultiDeviceMonitor:
+    def __init__(self, serials, package, interval_ms, on_result,
+                 max_concurrency=MULTI_MAX_CONCURRENCY, per_device_limit=1,
+                 timeout_s=MULTI_DEVICE_TIMEOUT_S, scan=None, adaptive=None):
+        self.package = package
+        self.scan = scan
+        self.adaptive = adaptive
+        self.interval_ms = interval_ms
+        self.on_result = on_result
+        self.max_concurrency = max_concurrency
+        self.timeout_s = timeout_s
+        self.devices = {serial: DeviceState(serial, per_device_limit) for serial in serials}
+        self._loop = None
+        self._thread = None
+        self._stop_event = None
 
-    def _update_log_target(self, now_dt):
-        half_min = 30 if now_dt.minute >= 30 else 0
-        dir_name = f"{now_dt.strftime('%Y%m%d')}_{now_dt.strftime('%H')}{half_min:02d}"
-        log_dir = os.path.join(self.log_root, dir_name)
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-        five_min = (now_dt.minute // 5) * 5
-        file_name = f"metrics_{now_dt.strftime('%Y%m%d')}_{now_dt.strftime('%H')}{five_min:02d}.csv"
-        log_path = os.path.join(log_dir, file_name)
+    def stop(self):
+        loop = self._loop
+        if loop is not None and self._stop_event is not None:
+            try:
+                loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass
 
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        global_sem = asyncio.Semaphore(self.max_concurrency)
+        tasks = []
+        for state in self.devices.values():
+            state.sem = asyncio.Semaphore(state.limit)
+            tasks.append(asyncio.create_task(self._device_loop(state, global_sem)))
+        await self._stop_event.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _device_loop(self, state, global_sem):
+        loop = asyncio.get_running_loop()
+        state.scheduler = DeadlineScheduler(self.interval_ms / 1000.0, loop.time())
+        if self.adaptive is not None:
+            state.adaptive = AdaptiveInterval(self.adaptive, start_ms=self.interval_ms)
+            state.scheduler.interval_s = state.adaptive.interval_ms / 1000.0
+        while True:
+            now_dt = datetime.now()
+            try:
+                async with state.sem, global_sem:
+                    snap = await collect_snapshot_async(
+                        state.serial, self.package, state.cpu_prev, timeout=self.timeout_s, scan=self.scan
+                    )
+                snap.interval_ms = state.scheduler.interval_s * 1000.0
+                if state.adaptive is not None:
+                    state.scheduler.interval_s = state.adaptive.update(now_dt.timestamp(), snap) / 1000.0
+                self.on_result(state.serial, now_dt, snap, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.on_result(state.serial, now_dt, None, str(e))
+            await asyncio.sleep(state.scheduler.next_delay(loop.time()))
+
+
+# --------------------- CSV logging ---------------------
+# The current segment stays open; rows are formatted once and flushed after
+# LOG_FLUSH_ROWS rows or LOG_FLUSH_INTERVAL_S seconds, whichever comes first
+# (LogFlushPolicy, --flush-rows/--flush-interval/--fsync). The interval is
+# also checked by MetricsLogger.flush_due() from the caller's loop, so rows
+# do not sit in the buffer while sampling keeps failing.
+LOG_HEADER = [
+    "timestamp_local",
+    "timestamp_iso8601",
+    "adb_sys_total_kb",
+    "adb_sys_used_kb",
+    "adb_sys_free_kb",
+    "adb_proc_pid",
+    "adb_proc_virt_mb",
+    "adb_proc_res_mb",
+    "adb_proc_shr_mb",
+    "adb_proc_cpu_percent",
+    "adb_proc_mem_percent",
+    "error_message",
+]
+# Optional per-stage timing columns; "log" and "retention" hold the previous
+# write's cost because a row cannot time its own write.
+LOG_STAGE_HEADER = [f"stage_{name}_ms" for name in TICK_STAGES] + ["missed_slots"]
+LOG_INTERVAL_HEADER = ["interval_ms"]
+THREAD_LOG_HEADER = ["timestamp_iso8601", "pid", "tid", "thread_name", "rank", "cpu_percent"]
+THERMAL_LOG_HEADER = ["timestamp_iso8601"] + [f"{series}_c" for series in THERMAL_SERIES]
+LOG_FLUSH_ROWS = 20
+LOG_FLUSH_INTERVAL_S = 5.0
+LOG_FSYNC_ON_ROTATE = False
+
+
+@dataclass
+class LogFlushPolicy:
+    rows: int = LOG_FLUSH_ROWS
+    interval_s: float = LOG_FLUSH_INTERVAL_S
+    fsync_on_rotate: bool = LOG_FSYNC_ON_ROTATE
+
+    def sink_args(self):
+        return {"flush_rows": self.rows, "flush_interval_s": self.interval_s, "fsync_on_rotate": self.fsync_on_rotate}
+
+
+def format_log_row(now_dt, sys_mem, proc):
+    return [
+        now_dt.strftime('%Y-%m-%d %H:%M:%S'),
+        (now_dt if now_dt.tzinfo else now_dt.astimezone()).isoformat(timespec='seconds'),
+        f"{int(sys_mem['total_kb'])}",
+        f"{int(sys_mem['used_kb'])}",
+        f"{int(sys_mem['free_kb'])}",
+        str(proc['pid']) if proc and proc.get('pid') is not None else "",
+        f"{proc['virt_mb']:.1f}" if proc and proc.get('virt_mb') is not None else "",
+        f"{proc['res_mb']:.1f}" if proc and proc.get('res_mb') is not None else "",
+        f"{proc['shr_mb']:.1f}" if proc and proc.get('shr_mb') is not None else "",
+        f"{proc['cpu_percent']:.1f}" if proc and proc.get('cpu_percent') is not None else "",
+        f"{proc['mem_percent']:.1f}" if proc and proc.get('mem_percent') is not None else "",
+        proc.get('error_message', '') if proc else "",
+    ]
+
+
+def format_stage_columns(timings, missed):
+    return [f"{timings[name] * 1000.0:.2f}" if name in timings else "" for name in TICK_STAGES] + [str(missed)]
+
+
+def format_interval_column(snap):
+    return [f"{snap.interval_ms:.0f}" if snap.interval_ms is not None else ""]
+
+
+class CsvLogSink:
+    def __init__(self, flush_rows=LOG_FLUSH_ROWS, flush_interval_s=LOG_FLUSH_INTERVAL_S,
+                 fsync_on_rotate=LOG_FSYNC_ON_ROTATE, header=None):
+        self.header = header or LOG_HEADER
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self.fsync_on_rotate = fsync_on_rotate
+        self.path = None
+        self._file = None
+        self._writer = None
+        self._pending = 0
+        self._last_flush = 0.0
+        self._width = len(self.header)
+
+    def open(self, path):
+        if path == self.path and self._file is not None:
+            return
+        self.close(fsync=self.fsync_on_rotate)
+        if not os.path.exists(path):
+            # Header goes into a temp file that is renamed into place, so a
+            # reader never sees a segment without its header.
+            tmp = path + ".tmp"
+            with open(tmp, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(self.header)
+            os.replace(tmp, path)
+            self._width = len(self.header)
+        else:
+            # Re-opening a segment written with or without the optional
+            # columns keeps its rows as wide as its header.
+            with open(path, newline="", encoding="utf-8") as f:
+                self._width = len(next(csv.reader(f), self.header))
+        self._file = open(path, "a", newline="", encoding="utf-8", buffering=1 << 16)
+        self._writer = csv.writer(self._file)
+        self.path = path
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def write_sample(self, now_dt, sys_mem, proc, row=None):
+        self.write_row(row if row is not None else format_log_row(now_dt, sys_mem, proc))
+
+    def write_row(self, row):
+        if self._file is None:
+            if self.path is None:
+                return
+            self.open(self.path)
+        if len(row) != self._width:
+            row = (list(row) + [""] * self._width)[:self._width]
+        self._writer.writerow(row)
+        self._pending += 1
+        if self._pending >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def flush_if_due(self, now=None):
+        if self._pending and (now or time.monotonic()) - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def close(self, fsync=False):
+        if self._file is None:
+            return
         try:
-            os.makedirs(log_dir, exist_ok=True)
-        except Exception:
-            pass
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            self._file = None
+            self._writer = None
+            self._pending = 0
+
+
+# --------------------- Binary log ---------------------
+# Alternative backend: each flush appends one column-major block to the
+# segment, so a reader can mmap the file and view every column as a typed
+# array without parsing text. Error strings are interned per segment in
+# small string blocks. Same rotation scheme as CSV, with a .ptmb suffix.
+BIN_EXT = ".ptmb"
+BIN_VERSION = 1
+BIN_BLOCK_MAGIC = b"PTMB"
+BIN_STRING_MAGIC = b"PTMS"
+BIN_BLOCK_HEADER = struct.Struct("<4sHHIdd")
+BIN_STRING_HEADER = struct.Struct("<4sHH")
+BIN_COLUMNS = [
+    ("ts", "d"),
+    ("utc_offset_min", "h"),
+    ("sys_total_kb", "I"),
+    ("sys_used_kb", "I"),
+    ("sys_free_kb", "I"),
+    ("proc_pid", "i"),
+    ("proc_virt_mb", "f"),
+    ("proc_res_mb", "f"),
+    ("proc_shr_mb", "f"),
+    ("proc_cpu_percent", "f"),
+    ("proc_mem_percent", "f"),
+    ("error_id", "H"),
+]
+BIN_ROW_BYTES = sum(array(code).itemsize for _, code in BIN_COLUMNS)
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _opt_float(value):
+    return float("nan") if value is None else float(value)
+
+
+class BinaryLogSink:
+    def __init__(self, flush_rows=LOG_FLUSH_ROWS, flush_interval_s=LOG_FLUSH_INTERVAL_S,
+                 fsync_on_rotate=LOG_FSYNC_ON_ROTATE):
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self.fsync_on_rotate = fsync_on_rotate
+        self.path = None
+        self._file = None
+        self._strings = {}
+        self._cols = [array(code) for _, code in BIN_COLUMNS]
+        self._last_flush = 0.0
+
+    def open(self, path):
+        if path == self.path and self._file is not None:
+            return
+        self.close(fsync=self.fsync_on_rotate)
+        self._strings = {}
+        if os.path.exists(path):
+            # Re-opening a segment continues its string table.
+            reader = BinarySegmentReader(path)
+            try:
+                self._strings = {text: idx for idx, text in reader.strings.items()}
+            finally:
+                reader.close()
+        self._file = open(path, "ab")
+        self.path = path
+        self._last_flush = time.monotonic()
+
+    def _error_id(self, text):
+        if not text:
+            return 0
+        idx = self._strings.get(text)
+        if idx is None:
+            idx = len(self._strings) + 1
+            self._strings[text] = idx
+            data = text.encode("utf-8")[:0xFFFF]
+            self._file.write(BIN_STRING_HEADER.pack(BIN_STRING_MAGIC, idx, len(data)) + data)
+        return idx
+
+    def write_sample(self, now_dt, sys_mem, proc, row=None):
+        if self._file is None:
+            if self.path is None:
+                return
+            self.open(self.path)
+        offset = now_dt.astimezone().utcoffset() or timedelta(0)
+        proc = proc or {}
+        values = (
+            now_dt.timestamp(),
+            int(offset.total_seconds() // 60),
+            int(sys_mem['total_kb']),
+            int(sys_mem['used_kb']),
+            int(sys_mem['free_kb']),
+            proc.get('pid') if proc.get('pid') is not None else -1,
+            _opt_float(proc.get('virt_mb')),
+            _opt_float(proc.get('res_mb')),
+            _opt_float(proc.get('shr_mb')),
+            _opt_float(proc.get('cpu_percent')),
+            _opt_float(proc.get('mem_percent')),
+            self._error_id(proc.get('error_message', '')),
+        )
+        for col, value in zip(self._cols, values):
+            col.append(value)
+        if len(self._cols[0]) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def _flush_block(self):
+        n = len(self._cols[0])
+        if not n:
+            return
+        ts = self._cols[0]
+        parts = [BIN_BLOCK_HEADER.pack(BIN_BLOCK_MAGIC, BIN_VERSION, len(BIN_COLUMNS), n, ts[0], ts[-1])]
+        for col in self._cols:
+            if _BIG_ENDIAN:
+                col.byteswap()
+            parts.append(col.tobytes())
+        self._file.write(b"".join(parts))
+        self._cols = [array(code) for _, code in BIN_COLUMNS]
+
+    def flush(self):
+        if self._file is None:
+            return
+        self._flush_block()
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def flush_if_due(self, now=None):
+        if len(self._cols[0]) and (now or time.monotonic()) - self._last_flush >= self.flush_interval_s:
+            self.flush()
 
-        if log_path != self.current_log_path:
-            self.current_log_dir = log_dir
-            self.current_log_path = log_path
-            self._ensure_log_header_for(self.current_log_path)
+    def close(self, fsync=False):
+        if self._file is None:
+            return
+        try:
+            self._flush_block()
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class BinarySegmentReader:
+    def __init__(self, path, data=None):
+        self.path = path
+        self.strings = {}
+        self._blocks = []
+        # Views handed out by iter_blocks; released on close so the mmap can
+        # be unmapped even while a caller still holds a block.
+        self._exports = []
+        self._file = None
+        self._mm = None
+        if data is not None:
+            # An archive member already decompressed into memory.
+            self._view = memoryview(data)
+        else:
+            self._file = open(path, "rb")
+            size = os.fstat(self._file.fileno()).st_size
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            self._view = memoryview(self._mm) if self._mm is not None else memoryview(b"")
+        self._index()
+
+    def _index(self):
+        view = self._view
+        pos = 0
+        end = len(view)
+        while pos + BIN_STRING_HEADER.size <= end:
+            magic = bytes(view[pos:pos + 4])
+            if magic == BIN_STRING_MAGIC:
+                _, idx, length = BIN_STRING_HEADER.unpack_from(view, pos)
+                pos += BIN_STRING_HEADER.size
+                if pos + length > end:
+                    break
+                self.strings[idx] = bytes(view[pos:pos + length]).decode("utf-8", "replace")
+                pos += length
+            elif magic == BIN_BLOCK_MAGIC and pos + BIN_BLOCK_HEADER.size <= end:
+                _, _, _, n, ts_min, ts_max = BIN_BLOCK_HEADER.unpack_from(view, pos)
+                body = pos + BIN_BLOCK_HEADER.size
+                if body + n * BIN_ROW_BYTES > end:
+                    break  # torn trailing block
+                self._blocks.append((ts_min, ts_max, n, body))
+                pos = body + n * BIN_ROW_BYTES
+            else:
+                break
+
+    def _block_columns(self, n, body):
+        cols = {}
+        pos = body
+        for name, code in BIN_COLUMNS:
+            nbytes = n * array(code).itemsize
+            raw = self._view[pos:pos + nbytes]
+            if _BIG_ENDIAN:
+                arr = array(code, raw.tobytes())
+                arr.byteswap()
+                cols[name] = arr
+            else:
+                cols[name] = raw.cast(code)
+                self._exports += (raw, cols[name])
+            pos += nbytes
+        return cols
+
+    def iter_blocks(self, start_ts=None, end_ts=None):
+        # Yields {column: typed view} restricted to [start_ts, end_ts).
+        for ts_min, ts_max, n, body in self._blocks:
+            if start_ts is not None and ts_max < start_ts:
+                continue
+            if end_ts is not None and ts_min >= end_ts:
+                continue
+            cols = self._block_columns(n, body)
+            ts = cols["ts"]
+            lo = bisect.bisect_left(ts, start_ts) if start_ts is not None else 0
+            hi = bisect.bisect_left(ts, end_ts) if end_ts is not None else n
+            if lo == 0 and hi == n:
+                yield cols
+            elif lo < hi:
+                part = {name: col[lo:hi] for name, col in cols.items()}
+                if not _BIG_ENDIAN:
+                    self._exports += part.values()
+                yield part
+
+    def column(self, name, start_ts=None, end_ts=None):
+        code = dict(BIN_COLUMNS)[name]
+        out = array(code)
+        for cols in self.iter_blocks(start_ts, end_ts):
+            out.extend(cols[name])
+        return out
+
+    def iter_rows(self, start_ts=None, end_ts=None):
+        names = [name for name, _ in BIN_COLUMNS]
+        for cols in self.iter_blocks(start_ts, end_ts):
+            yield from zip(*(cols[name] for name in names))
+
+    def close(self):
+        for view in reversed(self._exports):
+            view.release()
+        self._exports = []
+        self._view.release()
+        if self._mm is not None:
+            self._mm.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def _binary_row_to_sample(row, strings):
+    ts, offset_min, total, used, free, pid, virt, res, shr, cpu, mem, err = row
+    tz = timezone(timedelta(minutes=offset_min))
+    now_dt = datetime.fromtimestamp(ts, tz)
+    sys_mem = {"total_kb": total, "used_kb": used, "free_kb": free}
+    proc = None
+    if pid >= 0 or err or not all(math.isnan(v) for v in (virt, res, shr, cpu, mem)):
+        proc = _new_proc_result()
+        proc['pid'] = pid if pid >= 0 else None
+        for key, value in (("virt_mb", virt), ("res_mb", res), ("shr_mb", shr),
+                           ("cpu_percent", cpu), ("mem_percent", mem)):
+            proc[key] = None if math.isnan(value) else value
+        proc['error_message'] = strings.get(err, '') if err else ''
+    return now_dt, sys_mem, proc
+
+
+def binary_log_to_csv(src_path, dst_path, start_ts=None, end_ts=None):
+    reader = BinarySegmentReader(src_path)
+    try:
+        with open(dst_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(LOG_HEADER)
+            count = 0
+            for row in reader.iter_rows(start_ts, end_ts):
+                now_dt, sys_mem, proc = _binary_row_to_sample(row, reader.strings)
+                # timestamp_local is written in the recorded offset, not the
+                # offset of the machine doing the export.
+                writer.writerow(format_log_row(now_dt, sys_mem, proc))
+                count += 1
+    finally:
+        reader.close()
+    return count
+
+
+# --------------------- Log retention ---------------------
+# Segments are indexed once at startup by the timestamp in their names; after
+# that, eviction only runs when a new segment is opened, so retention costs
+# nothing on ticks that stay inside the current 5-minute file.
+LOG_RETENTION_HOURS = 36
+SEGMENT_MINUTES = 5
+SEGMENT_NAME_RE = re.compile(r"^metrics_(?:.+_)?(\d{8})_(\d{4})\.(?:csv|ptmb)$")
+
+
+def segment_start_from_name(file_name):
+    m = SEGMENT_NAME_RE.match(file_name)
+    if not m:
+        return None
+    try:
+        return datetime.strptime(m.group(1) + m.group(2), "%Y%m%d%H%M")
+    except ValueError:
+        return None
 
-        self._cleanup_old_logs(hours=36)
 
-    def _cleanup_old_logs(self, hours=36):
-        threshold = time.time() - hours * 3600
-        root = self.log_root
-        if not os.path.exists(root):
+class RetentionManager:
+    # With an archiver, whole half-hour directories are the unit: once a
+    # directory falls out of the hot window it is handed to the archiver's
+    # worker thread instead of being deleted here.
+    def __init__(self, root, hours=LOG_RETENTION_HOURS, archiver=None):
+        self.root = root
+        self.hours = hours
+        self.archiver = archiver
+        self._heap = []
+        self._known = set()
+        self._build_index()
+
+    def _build_index(self):
+        if not os.path.exists(self.root):
             return
-        for dirpath, dirnames, filenames in os.walk(root):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and ARCHIVE_DIR in dirnames:
+                dirnames.remove(ARCHIVE_DIR)
             for fn in filenames:
                 fp = os.path.join(dirpath, fn)
-                try:
-                    if os.path.getmtime(fp) < threshold:
-                        os.remove(fp)
-                except Exception:
+                start = segment_start_from_name(fn)
+                if start is not None and self.archiver is not None and dirpath != self.root:
+                    self._push(half_hour_start(start).timestamp() + ARCHIVE_DIR_MINUTES * 60, dirpath)
                     continue
-        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
-            try:
-                if not dirnames and not filenames:
+                if start is not None:
+                    end_ts = start.timestamp() + SEGMENT_MINUTES * 60
+                else:
+                    try:
+                        end_ts = os.path.getmtime(fp)
+                    except OSError:
+                        continue
+                self._push(end_ts, fp)
+            if not dirnames and not filenames and dirpath != self.root:
+                try:
                     os.rmdir(dirpath)
-            except Exception:
-                pass
+                except OSError:
+                    pass
 
-    def start(self):
-        if self.is_running:
-            return
-        if not self.selected_device.get():
-            messagebox.showwarning("提示", "請先選擇一台裝置。")
+    def _push(self, end_ts, path):
+        if path in self._known:
             return
+        self._known.add(path)
+        heapq.heappush(self._heap, (end_ts, path))
+
+    def add_segment(self, path, start_dt):
+        if self.archiver is not None:
+            self._push(half_hour_start(start_dt).timestamp() + ARCHIVE_DIR_MINUTES * 60, os.path.dirname(path))
+        else:
+            self._push(start_dt.timestamp() + SEGMENT_MINUTES * 60, path)
+
+    def evict(self, now_ts=None, busy=()):
+        threshold = (now_ts if now_ts is not None else time.time()) - self.hours * 3600
+        removed = 0
+        retry = []
+        while self._heap and self._heap[0][0] < threshold:
+            end_ts, path = heapq.heappop(self._heap)
+            self._known.discard(path)
+            if self.archiver is not None and os.path.isdir(path):
+                if any(os.path.dirname(p) == path for p in busy):
+                    # A sink still writes here (an idle device never rotated).
+                    retry.append((end_ts + SEGMENT_MINUTES * 60, path))
+                else:
+                    self.archiver.submit(path)
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            parent = os.path.dirname(path)
+            if parent != self.root:
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    pass
+        for end_ts, path in retry:
+            self._push(end_ts, path)
+        return removed
+
+
+def log_segment_path(log_root, now_dt, serial=None, ext=".csv"):
+    half_min = 30 if now_dt.minute >= 30 else 0
+    dir_name = f"{now_dt.strftime('%Y%m%d')}_{now_dt.strftime('%H')}{half_min:02d}"
+    five_min = (now_dt.minute // SEGMENT_MINUTES) * SEGMENT_MINUTES
+    prefix = "metrics_" if serial is None else f"metrics_{safe_serial(serial)}_"
+    file_name = f"{prefix}{now_dt.strftime('%Y%m%d')}_{now_dt.strftime('%H')}{five_min:02d}{ext}"
+    return os.path.join(log_root, dir_name, file_name)
+
+
+# Owns the rotating sinks (one shared stream, or one per serial in
+# multi-device mode) plus the retention index, so the GUI and the headless
+# runner rotate and prune logs the same way.
+class MetricsLogger:
+    def __init__(self, log_root, log_format="csv", stage_columns=False, interval_column=False,
+                 archiver=None, hours=LOG_RETENTION_HOURS, flush=None):
+        self.log_root = log_root
+        self.log_format = log_format
+        self.flush_policy = flush or LogFlushPolicy()
+        self.stage_columns = stage_columns
+        self.interval_column = interval_column
+        self.archiver = archiver
+        self.retention = RetentionManager(log_root, hours, archiver)
+        self.sinks = {}
+        self.side_sinks = {}
+        self.timings = {}
+
+    def _new_sink(self):
+        if self.log_format == "binary":
+            return BinaryLogSink(**self.flush_policy.sink_args())
+        header = LOG_HEADER
+        if self.stage_columns:
+            header = header + LOG_STAGE_HEADER
+        if self.interval_column:
+            header = header + LOG_INTERVAL_HEADER
+        return CsvLogSink(header=header, **self.flush_policy.sink_args())
+
+    def update_target(self, now_dt, serial=None):
+        ext = BIN_EXT if self.log_format == "binary" else ".csv"
+        log_path = log_segment_path(self.log_root, now_dt, serial, ext)
+        sink = self.sinks.get(serial)
+        if sink is None:
+            sink = self.sinks[serial] = self._new_sink()
+        return self._rotate(sink, log_path, now_dt)
+
+    def _rotate(self, sink, log_path, now_dt):
+        if log_path == sink.path:
+            self.timings["retention"] = 0.0
+            return sink
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        sink.open(log_path)
+        start = time.perf_counter()
+        five_min = (now_dt.minute // SEGMENT_MINUTES) * SEGMENT_MINUTES
+        self.retention.add_segment(log_path, now_dt.replace(minute=five_min, second=0, microsecond=0))
+        # Age is measured on the sample clock so a replayed capture keeps its
+        # own recorded hours instead of being expired against wall time.
+        self.retention.evict(now_dt.timestamp(), busy=self._open_paths())
+        self.timings["retention"] = time.perf_counter() - start
+        return sink
+
+    def _open_paths(self):
+        return [sink.path for sink in [*self.sinks.values(), *self.side_sinks.values()] if sink.path]
+
+    def write(self, now_dt, sys_mem, proc, row=None, serial=None):
+        start = time.perf_counter()
+        sink = self.sinks.get(serial)
+        if sink is None or sink.path is None:
+            sink = self.update_target(now_dt, serial)
+        sink.write_sample(now_dt, sys_mem, proc, row)
+        self.timings["log"] = time.perf_counter() - start
+
+    def _side_sink(self, kind, header, now_dt, serial):
+        # Side streams go to their own segments (metrics_<kind>[_<serial>]_...)
+        # so the main CSV keeps a fixed width.
+        name = kind if serial is None else f"{kind}_{safe_serial(serial)}"
+        sink = self.side_sinks.get((kind, serial))
+        if sink is None:
+            sink = self.side_sinks[(kind, serial)] = CsvLogSink(header=header, **self.flush_policy.sink_args())
+        return self._rotate(sink, log_segment_path(self.log_root, now_dt, name), now_dt)
+
+    def write_threads(self, now_dt, pid, threads, serial=None):
+        sink = self._side_sink("threads", THREAD_LOG_HEADER, now_dt, serial)
+        iso = (now_dt if now_dt.tzinfo else now_dt.astimezone()).isoformat(timespec='seconds')
+        for rank, thread in enumerate(threads, 1):
+            sink.write_row([iso, str(pid), str(thread['tid']), thread['name'], str(rank), f"{thread['cpu_percent']:.1f}"])
+
+    def write_thermal(self, now_dt, thermal, serial=None):
+        sink = self._side_sink("thermal", THERMAL_LOG_HEADER, now_dt, serial)
+        iso = (now_dt if now_dt.tzinfo else now_dt.astimezone()).isoformat(timespec='seconds')
+        sink.write_row([iso] + [f"{thermal[series]:.1f}" if series in thermal else "" for series in THERMAL_SERIES])
+
+    def write_alert(self, event):
+        now_dt = datetime.fromtimestamp(event.ts)
+        sink = self._side_sink("alerts", ALERT_LOG_HEADER, now_dt, None)
+        sink.write_row([
+            now_dt.astimezone().isoformat(timespec='seconds'),
+            event.serial or "",
+            event.rule.name,
+            event.state,
+            f"{event.value:.2f}" if event.value is not None else "",
+            f"{event.rule.threshold:g}",
+        ])
+
+    def flush_due(self):
+        now = time.monotonic()
+        for sink in [*self.sinks.values(), *self.side_sinks.values()]:
+            sink.flush_if_due(now)
+
+    def reset(self, log_format=None, stage_columns=None, interval_column=None):
+        self.close()
+        if log_format is not None:
+            self.log_format = log_format
+        if stage_columns is not None:
+            self.stage_columns = stage_columns
+        if interval_column is not None:
+            self.interval_column = interval_column
+        self.sinks = {}
+        self.side_sinks = {}
+
+    def close(self):
+        for sink in [*self.sinks.values(), *self.side_sinks.values()]:
+            try:
+                sink.close(fsync=sink.fsync_on_rotate)
+            except OSError:
+                pass
+
+
+# --------------------- Log archive ---------------------
+# Half-hour directories are packed as soon as their last segment closes (or,
+# with --hot-hours, once they leave that raw window) into one
+# archive each (archive/<YYYYMMDD_HHMM>.ptma): every segment becomes an
+# independently compressed member, followed by a JSON index of member time
+# ranges and offsets and a fixed footer pointing at the index. Readers seek
+# straight to the members that overlap a query and decompress them as a
+# stream. Packing and pruning run on the archiver's own thread; the sampling
+# thread only queues directory paths. A directory that fails to pack stays
+# on disk and is retried with exponential backoff; failures are kept for the
+# caller to report (take_errors).
+ARCHIVE_DIR = "archive"
+ARCHIVE_EXT = ".ptma"
+ARCHIVE_VERSION = 1
+ARCHIVE_MAGIC = b"PTMA"
+ARCHIVE_FOOTER = struct.Struct("<Q4s")
+ARCHIVE_DIR_MINUTES = 30
+ARCHIVE_CODECS = ("gzip", "lzma")
+ARCHIVE_RETENTION_DAYS = 30
+ARCHIVE_HOT_HOURS = 0.0
+ARCHIVE_BUDGET_MB = 2048
+ARCHIVE_READ_CHUNK = 64 * 1024
+ARCHIVE_CLOSE_TIMEOUT_S = 10.0
+ARCHIVE_RETRY_S = 60.0
+ARCHIVE_RETRY_MAX_S = 3600.0
+ARCHIVE_ERROR_KEEP = 20
+ARCHIVE_DIR_RE = re.compile(r"^(\d{8}_\d{4})$")
+
+
+def half_hour_start(dt):
+    return dt.replace(minute=30 if dt.minute >= 30 else 0, second=0, microsecond=0)
+
+
+def _compress(data, codec):
+    if codec == "lzma":
+        return lzma.compress(data, format=lzma.FORMAT_XZ)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _decompressor(codec):
+    if codec == "lzma":
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    return zlib.decompressobj(wbits=31)
+
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
         try:
-            ms = int(self.refresh_ms.get())
-            if ms < 200:
-                raise ValueError
-        except Exception:
-            messagebox.showwarning("提示", "請輸入有效的更新頻率 (>=200 毫秒)。")
+            self._file.seek(-ARCHIVE_FOOTER.size, os.SEEK_END)
+            index_offset, magic = ARCHIVE_FOOTER.unpack(self._file.read(ARCHIVE_FOOTER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"不是有效的封存檔: {path}")
+            index_end = self._file.tell() - ARCHIVE_FOOTER.size
+            self._file.seek(index_offset)
+            self.index = json.loads(self._file.read(index_end - index_offset).decode("utf-8"))
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        self.members = self.index["members"]
+
+    def iter_members(self, start_ts=None, end_ts=None):
+        for member in self.members:
+            if start_ts is not None and member["end_ts"] <= start_ts:
+                continue
+            if end_ts is not None and member["start_ts"] >= end_ts:
+                continue
+            yield member
+
+    def iter_chunks(self, member):
+        decomp = _decompressor(member.get("codec", self.index["codec"]))
+        self._file.seek(member["offset"])
+        remaining = member["length"]
+        while remaining > 0:
+            raw = self._file.read(min(ARCHIVE_READ_CHUNK, remaining))
+            if not raw:
+                break
+            remaining -= len(raw)
+            data = decomp.decompress(raw)
+            if data:
+                yield data
+
+    def read_member(self, member):
+        return b"".join(self.iter_chunks(member))
+
+    def raw_member(self, member):
+        self._file.seek(member["offset"])
+        return self._file.read(member["length"])
+
+    def iter_lines(self, member):
+        tail = b""
+        for data in self.iter_chunks(member):
+            lines = (tail + data).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r").decode("utf-8", "replace")
+        if tail:
+            yield tail.decode("utf-8", "replace")
+
+    def iter_rows(self, start_ts=None, end_ts=None):
+        # Streams (member name, row dict) from the CSV members; binary members
+        # are converted through BinarySegmentReader.
+        for member in self.iter_members(start_ts, end_ts):
+            if member["name"].endswith(BIN_EXT):
+                reader = BinarySegmentReader(member["name"], data=self.read_member(member))
+                try:
+                    for row in reader.iter_rows(start_ts, end_ts):
+                        now_dt, sys_mem, proc = _binary_row_to_sample(row, reader.strings)
+                        yield member["name"], dict(zip(LOG_HEADER, format_log_row(now_dt, sys_mem, proc)))
+                finally:
+                    reader.close()
+                continue
+            ranged = start_ts is not None or end_ts is not None
+            for row in csv.DictReader(self.iter_lines(member)):
+                if ranged:
+                    try:
+                        ts = datetime.fromisoformat(row.get("timestamp_iso8601") or "").timestamp()
+                    except ValueError:
+                        continue
+                    if (start_ts is not None and ts < start_ts) or (end_ts is not None and ts >= end_ts):
+                        continue
+                yield member["name"], row
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def archive_path_for(log_root, dir_name):
+    return os.path.join(log_root, ARCHIVE_DIR, dir_name + ARCHIVE_EXT)
+
+
+def pack_log_dir(dir_path, archive_path, codec="gzip"):
+    members = []
+    carried = []
+    if os.path.exists(archive_path):
+        # A crash between replace and delete, or late files for an already
+        # packed directory: keep the existing members and add the rest.
+        with ArchiveReader(archive_path) as old:
+            carried = [(m, old.raw_member(m)) for m in old.members]
+    known = {m["name"] for m, _ in carried}
+    names = sorted(fn for fn in os.listdir(dir_path) if fn not in known)
+    tmp_path = archive_path + ".tmp"
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        for member, blob in carried:
+            member = dict(member, offset=f.tell())
+            f.write(blob)
+            members.append(member)
+        for name in names:
+            src = os.path.join(dir_path, name)
+            with open(src, "rb") as sf:
+                data = sf.read()
+            start = segment_start_from_name(name)
+            start_ts = start.timestamp() if start is not None else os.path.getmtime(src)
+            blob = _compress(data, codec)
+            members.append({
+                "name": name,
+                "start_ts": start_ts,
+                "end_ts": start_ts + SEGMENT_MINUTES * 60,
+                "offset": f.tell(),
+                "length": len(blob),
+                "size": len(data),
+                "codec": codec,
+            })
+            f.write(blob)
+        index_offset = f.tell()
+        index = {
+            "version": ARCHIVE_VERSION,
+            "codec": codec,
+            "dir": os.path.basename(dir_path),
+            "start_ts": min((m["start_ts"] for m in members), default=None),
+            "end_ts": max((m["end_ts"] for m in members), default=None),
+            "members": members,
+        }
+        f.write(json.dumps(index, ensure_ascii=False).encode("utf-8"))
+        f.write(ARCHIVE_FOOTER.pack(index_offset, ARCHIVE_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, archive_path)
+    for name in names:
+        try:
+            os.remove(os.path.join(dir_path, name))
+        except OSError:
+            pass
+    try:
+        os.rmdir(dir_path)
+    except OSError:
+        pass
+    return archive_path
+
+
+class LogArchiver:
+    def __init__(self, log_root, codec="gzip", days=ARCHIVE_RETENTION_DAYS, budget_mb=ARCHIVE_BUDGET_MB):
+        self.log_root = log_root
+        self.codec = codec
+        self.days = days
+        self.budget_mb = budget_mb
+        self.packed = 0
+        self.pruned = 0
+        self.failures = 0
+        self.errors = deque(maxlen=ARCHIVE_ERROR_KEEP)
+        self._new_errors = []
+        self._retry = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, dir_path):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="log-archiver", daemon=True)
+                self._thread.start()
+        self._queue.put(dir_path)
+
+    def _worker(self):
+        while True:
+            timeout = None
+            if self._retry:
+                timeout = max(0.0, min(due for _, due in self._retry.values()) - time.monotonic())
+            try:
+                dir_path = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                dir_path = ""
+            if dir_path is None:
+                return
+            now = time.monotonic()
+            paths = [dir_path] if dir_path else []
+            paths += [path for path, (_, due) in self._retry.items() if due <= now and path != dir_path]
+            for path in paths:
+                self._pack(path)
+
+    def _pack(self, dir_path):
+        try:
+            dir_name = os.path.basename(dir_path)
+            if ARCHIVE_DIR_RE.match(dir_name) and os.path.isdir(dir_path):
+                pack_log_dir(dir_path, archive_path_for(self.log_root, dir_name), self.codec)
+                self.packed += 1
+            self._retry.pop(dir_path, None)
+            self.prune()
+        except (OSError, ValueError) as e:
+            attempt = self._retry.get(dir_path, (0, 0.0))[0] + 1
+            delay = min(ARCHIVE_RETRY_S * 2 ** (attempt - 1), ARCHIVE_RETRY_MAX_S)
+            self._retry[dir_path] = (attempt, time.monotonic() + delay)
+            message = f"{dir_path}: {e}"
+            with self._lock:
+                self.failures += 1
+                self.errors.append(message)
+                self._new_errors.append(message)
+
+    def pending_retries(self):
+        return len(self._retry)
+
+    def take_errors(self):
+        with self._lock:
+            errors, self._new_errors = self._new_errors, []
+        return errors
+
+    def prune(self, now_ts=None):
+        # Archives go oldest first once past the horizon or over the budget.
+        archive_dir = os.path.join(self.log_root, ARCHIVE_DIR)
+        try:
+            entries = [e for e in os.scandir(archive_dir) if e.name.endswith(ARCHIVE_EXT)]
+        except OSError:
+            return 0
+        entries.sort(key=lambda e: e.name)
+        threshold = (now_ts if now_ts is not None else time.time()) - self.days * 86400
+        total = sum(e.stat().st_size for e in entries)
+        budget = self.budget_mb * 1024 * 1024 if self.budget_mb else None
+        removed = 0
+        for entry in entries:
+            try:
+                start = datetime.strptime(entry.name[:-len(ARCHIVE_EXT)], "%Y%m%d_%H%M")
+            except ValueError:
+                continue
+            expired = start.timestamp() + ARCHIVE_DIR_MINUTES * 60 < threshold
+            if not expired and (budget is None or total <= budget):
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.pruned += removed
+        return removed
+
+    def close(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+
+# --------------------- History ---------------------
+# Each metric keeps a pyramid of fixed-capacity rings: level 0 holds raw
+# samples and every level above stores min/max of HISTORY_FANOUT entries of
+# the level below. Memory is bounded by capacity * levels, and a chart picks
+# the lowest level with about one entry per pixel, so redraw cost follows the
+# canvas width rather than how long the session has run. Rings grow as they
+# fill, so an idle or short-lived device costs a few empty arrays.
+HISTORY_CAPACITY = 4096
+HISTORY_LEVELS = 8
+HISTORY_FANOUT = 4
+HISTORY_METRICS = ("temp_c", "mem_pct", "app_cpu", "app_rss_mb", "cpu_temp_c", "gpu_temp_c", "skin_temp_c")
+
+
+class RingBuffer:
+    def __init__(self, capacity, typecode="d"):
+        self.capacity = capacity
+        self._data = array(typecode)
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        return self._data[(self._start + i) % self.capacity]
+
+    def append(self, value):
+        if self._len < self.capacity:
+            self._data.append(value)
+            self._len += 1
+        else:
+            self._data[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+
+    def is_full(self):
+        return self._len == self.capacity
+
+
+class MetricSeries:
+    def __init__(self, capacity=HISTORY_CAPACITY, levels=HISTORY_LEVELS):
+        self.levels = [
+            (RingBuffer(capacity), RingBuffer(capacity), RingBuffer(capacity))
+            for _ in range(levels)
+        ]
+        self._pending = [None] * levels
+
+    def append(self, ts, value):
+        self._push(0, ts, value, value)
+
+    def _push(self, k, ts, lo, hi):
+        ts_r, lo_r, hi_r = self.levels[k]
+        ts_r.append(ts)
+        lo_r.append(lo)
+        hi_r.append(hi)
+        if k + 1 >= len(self.levels):
             return
+        p = self._pending[k]
+        if p is None:
+            p = self._pending[k] = [ts, lo, hi, 0]
+        else:
+            p[1] = min(p[1], lo)
+            p[2] = max(p[2], hi)
+        p[3] += 1
+        if p[3] == HISTORY_FANOUT:
+            self._pending[k] = None
+            self._push(k + 1, p[0], p[1], p[2])
+
+    def first_ts(self):
+        for ts_r, _, _ in reversed(self.levels):
+            if len(ts_r):
+                return ts_r[0]
+        return None
 
-        self.is_running = True
-        self.status_text.set("監控中…")
-        self.start_btn.configure(state="disabled")
-        self._schedule_next()
+    def window(self, start_ts, end_ts, max_points):
+        # Returns [(ts, lo, hi)] with at most max_points buckets.
+        if max_points <= 0 or end_ts <= start_ts:
+            return []
+        chosen = None
+        for ts_r, lo_r, hi_r in self.levels:
+            if not len(ts_r):
+                break
+            i0 = bisect.bisect_left(ts_r, start_ts)
+            i1 = bisect.bisect_right(ts_r, end_ts)
+            chosen = (ts_r, lo_r, hi_r, i0, i1)
+            covers = not ts_r.is_full() or ts_r[0] <= start_ts
+            if covers and i1 - i0 <= 2 * max_points:
+                break
+        if chosen is None:
+            return []
+        ts_r, lo_r, hi_r, i0, i1 = chosen
+        scale = max_points / (end_ts - start_ts)
+        buckets = []
+        last_b = -1
+        for i in range(i0, i1):
+            b = int((ts_r[i] - start_ts) * scale)
+            if b != last_b:
+                buckets.append([ts_r[i], lo_r[i], hi_r[i]])
+                last_b = b
+            else:
+                cur = buckets[-1]
+                if lo_r[i] < cur[1]:
+                    cur[1] = lo_r[i]
+                if hi_r[i] > cur[2]:
+                    cur[2] = hi_r[i]
+        return buckets
 
-    def stop(self):
-        self.is_running = False
-        if self.job_after_id is not None:
-            try:
-                self.after_cancel(self.job_after_id)
-            except Exception:
+
+class DeviceHistory:
+    def __init__(self):
+        self.series = {name: MetricSeries() for name in HISTORY_METRICS}
+        self.generation = 0
+
+    def record(self, ts, values):
+        for name, value in values.items():
+            if value is not None:
+                self.series[name].append(ts, value)
+        self.generation += 1
+
+
+def sample_metrics(snap):
+    sys_mem = snap.sys_mem
+    proc = snap.proc
+    return {
+        "temp_c": snap.temp_c,
+        "mem_pct": sys_mem['used_kb'] / sys_mem['total_kb'] * 100.0 if sys_mem.get('total_kb') else None,
+        "app_cpu": proc.get('cpu_percent') if proc else None,
+        "app_rss_mb": proc.get('res_mb') if proc else None,
+        "cpu_temp_c": snap.thermal.get("cpu"),
+        "gpu_temp_c": snap.thermal.get("gpu"),
+        "skin_temp_c": snap.thermal.get("skin"),
+    }
+
+
+# --------------------- Alerts ---------------------
+# Rules are evaluated on every sample against per-device sliding windows. A
+# window is shared by all rules on the same (metric, length) and keeps only
+# incremental aggregates: monotonic deques for min/max, running sums for mean
+# and least-squares slope, and a fixed-bin histogram for percentiles. Adding a
+# sample and reading any aggregate costs the same whatever the window length.
+#
+#   battery_temp_c > 42 for 30s         every sample in the last 30 s
+#   app_rss_mb slope > 5 over 10m       MB per minute
+#   app_cpu p95 > 80 over 1m
+#   leak: app_rss_mb slope > 5 over 10m named rule
+ALERT_AGGREGATES = ("last", "mean", "min", "max", "slope", "p50", "p90", "p95", "p99")
+ALERT_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+ALERT_METRIC_ALIASES = {"battery_temp_c": "temp_c"}
+ALERT_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+ALERT_RULE_RE = re.compile(
+    r"^\s*(?:(?P<name>[^:]+?)\s*:\s*)?(?P<metric>\w+)\s+(?:(?P<agg>[a-z]\w*)\s+)?"
+    r"(?P<op>>=|<=|>|<)\s*(?P<threshold>-?\d+(?:\.\d+)?)\s+(?P<mode>for|over)\s+"
+    r"(?P<window>\d+(?:\.\d+)?)\s*(?P<unit>ms|s|m|h)?\s*$"
+)
+ALERT_HIST_BINS = 512
+ALERT_HIST_RANGES = {"app_cpu": (0.0, 1600.0), "mem_pct": (0.0, 100.0), "app_rss_mb": (0.0, 16384.0)}
+ALERT_HIST_DEFAULT_RANGE = (-40.0, 130.0)
+ALERT_LOG_HEADER = ["timestamp_iso8601", "serial", "rule", "state", "value", "threshold"]
+
+
+@dataclass(frozen=True)
+class AlertRule:
+    name: str
+    metric: str
+    agg: str
+    op: str
+    threshold: float
+    window_s: float
+
+    def test(self, value):
+        return ALERT_OPS[self.op](value, self.threshold)
+
+
+def parse_alert_rule(text):
+    m = ALERT_RULE_RE.match(text)
+    if not m:
+        raise ValueError(f"無法解析警示規則: {text!r}")
+    metric = ALERT_METRIC_ALIASES.get(m.group("metric"), m.group("metric"))
+    if metric not in HISTORY_METRICS:
+        raise ValueError(f"未知的指標 {m.group('metric')!r}，可用: {', '.join(HISTORY_METRICS)}")
+    op = m.group("op")
+    agg = m.group("agg")
+    if agg is None:
+        # "for" means every sample in the window satisfies the comparison.
+        if m.group("mode") == "for":
+            agg = "min" if op in (">", ">=") else "max"
+        else:
+            agg = "mean"
+    if agg not in ALERT_AGGREGATES:
+        raise ValueError(f"未知的彙總方式 {agg!r}，可用: {', '.join(ALERT_AGGREGATES)}")
+    window_s = float(m.group("window")) * ALERT_UNITS[m.group("unit") or "s"]
+    if window_s <= 0:
+        raise ValueError(f"警示規則的時間窗必須大於 0: {text!r}")
+    name = m.group("name") or text[m.start("metric"):].strip()
+    return AlertRule(name, metric, agg, op, float(m.group("threshold")), window_s)
+
+
+def load_alert_rules(path):
+    rules = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                rules.append(parse_alert_rule(line))
+    return rules
+
+
+class SlidingWindow:
+    def __init__(self, window_s, value_range=ALERT_HIST_DEFAULT_RANGE):
+        self.window_s = window_s
+        self.samples = deque()
+        self.first_ts = None
+        self._t0 = None
+        self._min = None
+        self._max = None
+        self._sums = None
+        self._removed = 0
+        self._hist = None
+        self._lo, hi = value_range
+        self._bin_w = (hi - self._lo) / ALERT_HIST_BINS
+
+    def need(self, agg):
+        if agg == "min" and self._min is None:
+            self._min = deque()
+        elif agg == "max" and self._max is None:
+            self._max = deque()
+        elif agg in ("mean", "slope") and self._sums is None:
+            self._sums = [0.0] * 4
+        elif agg.startswith("p") and self._hist is None:
+            self._hist = array("l", [0]) * ALERT_HIST_BINS
+
+    def _bin(self, value):
+        return min(ALERT_HIST_BINS - 1, max(0, int((value - self._lo) / self._bin_w)))
+
+    def _account(self, t, value, sign):
+        sums = self._sums
+        t -= self._t0
+        sums[0] += sign * t
+        sums[1] += sign * value
+        sums[2] += sign * t * t
+        sums[3] += sign * t * value
+
+    def add(self, ts, value):
+        self.expire(ts)
+        if not self.samples:
+            # Nothing left from before (first sample, or a gap longer than
+            # the window): coverage starts over, so "for 30s" needs 30s again.
+            self.first_ts = self._t0 = ts
+            if self._sums is not None:
+                self._sums = [0.0] * 4
+                self._removed = 0
+        self.samples.append((ts, value))
+        if self._min is not None:
+            while self._min and self._min[-1][1] >= value:
+                self._min.pop()
+            self._min.append((ts, value))
+        if self._max is not None:
+            while self._max and self._max[-1][1] <= value:
+                self._max.pop()
+            self._max.append((ts, value))
+        if self._sums is not None:
+            self._account(ts, value, 1.0)
+        if self._hist is not None:
+            self._hist[self._bin(value)] += 1
+
+    def expire(self, now):
+        cutoff = now - self.window_s
+        samples = self.samples
+        while samples and samples[0][0] <= cutoff:
+            ts, value = samples.popleft()
+            if self._min and self._min[0][0] <= cutoff:
+                self._min.popleft()
+            if self._max and self._max[0][0] <= cutoff:
+                self._max.popleft()
+            if self._sums is not None:
+                self._account(ts, value, -1.0)
+                self._removed += 1
+            if self._hist is not None:
+                self._hist[self._bin(value)] -= 1
+        if self._sums is not None and self._removed > max(len(samples), 64):
+            # Subtracting old terms drifts; a rebuild every window's worth of
+            # removals, rebased on the oldest sample, keeps the running sums
+            # exact at amortised O(1).
+            self._sums = [0.0] * 4
+            self._t0 = samples[0][0] if samples else now
+            for ts, value in samples:
+                self._account(ts, value, 1.0)
+            self._removed = 0
+
+    def full(self, now):
+        return self.first_ts is not None and now - self.first_ts >= self.window_s and bool(self.samples)
+
+    def value(self, agg):
+        n = len(self.samples)
+        if not n:
+            return None
+        if agg == "last":
+            return self.samples[-1][1]
+        if agg == "min":
+            return self._min[0][1]
+        if agg == "max":
+            return self._max[0][1]
+        if agg.startswith("p"):
+            rank = math.ceil(int(agg[1:]) / 100.0 * n)
+            seen = 0
+            for i, count in enumerate(self._hist):
+                seen += count
+                if seen >= rank:
+                    return self._lo + (i + 0.5) * self._bin_w
+            return None
+        st, sv, stt, stv = self._sums
+        if agg == "mean":
+            return sv / n
+        denom = n * stt - st * st
+        if n < 2 or denom <= 1e-9:
+            return None
+        return (n * stv - st * sv) / denom * 60.0
+
+
+@dataclass
+class AlertEvent:
+    ts: float
+    serial: str
+    rule: AlertRule
+    state: str
+    value: float = None
+
+
+class AlertEngine:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._devices = {}
+
+    def _device(self, serial):
+        device = self._devices.get(serial)
+        if device is None:
+            windows = {}
+            for rule in self.rules:
+                key = (rule.metric, rule.window_s)
+                window = windows.get(key)
+                if window is None:
+                    value_range = ALERT_HIST_RANGES.get(rule.metric, ALERT_HIST_DEFAULT_RANGE)
+                    window = windows[key] = SlidingWindow(rule.window_s, value_range)
+                window.need(rule.agg)
+            device = self._devices[serial] = (windows, {})
+        return device
+
+    def evaluate(self, serial, ts, metrics):
+        windows, firing = self._device(serial)
+        for (metric, _), window in windows.items():
+            value = metrics.get(metric)
+            if value is not None:
+                window.add(ts, value)
+            else:
+                window.expire(ts)
+        events = []
+        for rule in self.rules:
+            window = windows[(rule.metric, rule.window_s)]
+            value = window.value(rule.agg) if window.full(ts) else None
+            active = value is not None and rule.test(value)
+            if active and rule not in firing:
+                firing[rule] = value
+                events.append(AlertEvent(ts, serial, rule, "firing", value))
+            elif active:
+                firing[rule] = value
+            elif rule in firing:
+                del firing[rule]
+                events.append(AlertEvent(ts, serial, rule, "resolved", value))
+        return events
+
+    def active(self, serial=None):
+        out = []
+        for key, (_, firing) in self._devices.items():
+            if serial is None or key == serial:
+                out.extend((key, rule.name, value) for rule, value in firing.items())
+        return out
+
+    def reset(self):
+        self._devices = {}
+
+
+def alert_to_dict(event):
+    return {
+        "ts": datetime.fromtimestamp(event.ts).astimezone().isoformat(),
+        "serial": event.serial,
+        "alert": event.rule.name,
+        "state": event.state,
+        "value": event.value,
+        "threshold": event.rule.threshold,
+    }
+
+
+# --------------------- Metrics exporter ---------------------
+# Serves the latest sample per device over HTTP for local dashboards:
+# /metrics in Prometheus text format, /metrics.json as JSON. Samplers only
+# swap in the newest snapshot; a body is rendered on the first scrape after a
+# new sample and reused until the next one, so scrapes never reach adb.
+EXPORTER_HOST = "127.0.0.1"
+PROM_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROM_METRICS = (
+    ("ptm_temp_celsius", "Battery temperature"),
+    ("ptm_thermal_celsius", "Hottest thermal zone per group"),
+    ("ptm_sys_total_kb", "System memory total"),
+    ("ptm_sys_used_kb", "System memory used"),
+    ("ptm_sys_free_kb", "System memory available"),
+    ("ptm_proc_pid", "Process id of the monitored package"),
+    ("ptm_proc_rss_mb", "Resident set size of the package"),
+    ("ptm_proc_cpu_percent", "CPU usage of the package"),
+    ("ptm_proc_mem_percent", "Share of system memory used by the package"),
+    ("ptm_sample_timestamp_seconds", "Unix time of the latest sample"),
+    ("ptm_sample_interval_ms", "Sampling interval in effect"),
+    ("ptm_device_cpus", "CPU count of the device"),
+    ("ptm_device_info", "Kernel release and ABI of the device (value is always 1)"),
+)
+
+
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_labels(labels):
+    return "{" + ",".join(f'{key}="{_prom_label(value)}"' for key, value in labels) + "}"
+
+
+class MetricsExporter:
+    def __init__(self, host=EXPORTER_HOST, port=0):
+        self.host = host
+        self.port = port
+        self.generation = 0
+        self._latest = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def update(self, serial, now_dt, snap, package=""):
+        with self._lock:
+            self._latest[serial or ""] = (now_dt.timestamp(), snap, package, device_static(serial))
+            self.generation += 1
+
+    def _packages(self, snap, package):
+        out = []
+        if package and snap.proc:
+            out.append((package, snap.proc))
+        out.extend(snap.packages.items())
+        return out
+
+    def render_prometheus(self, latest):
+        values = {name: [] for name, _ in PROM_METRICS}
+        for serial, (ts, snap, package, static) in sorted(latest.items()):
+            dev = (("serial", serial),)
+            values["ptm_sample_timestamp_seconds"].append((dev, ts))
+            if static:
+                values["ptm_device_cpus"].append((dev, static["ncpu"]))
+                values["ptm_device_info"].append((dev + (("kernel", static["kernel"]), ("abi", static["abi"])), 1))
+            if snap.interval_ms is not None:
+                values["ptm_sample_interval_ms"].append((dev, snap.interval_ms))
+            if snap.temp_c is not None:
+                values["ptm_temp_celsius"].append((dev, snap.temp_c))
+            for group, temp in snap.thermal.items():
+                values["ptm_thermal_celsius"].append((dev + (("group", group),), temp))
+            for key, name in (("total_kb", "ptm_sys_total_kb"), ("used_kb", "ptm_sys_used_kb"), ("free_kb", "ptm_sys_free_kb")):
+                if snap.sys_mem.get(key) is not None:
+                    values[name].append((dev, snap.sys_mem[key]))
+            for name, proc in self._packages(snap, package):
+                labels = dev + (("package", name),)
+                for key, metric in (("pid", "ptm_proc_pid"), ("res_mb", "ptm_proc_rss_mb"),
+                                    ("cpu_percent", "ptm_proc_cpu_percent"), ("mem_percent", "ptm_proc_mem_percent")):
+                    if proc.get(key) is not None:
+                        values[metric].append((labels, proc[key]))
+        lines = []
+        for name, help_text in PROM_METRICS:
+            if not values[name]:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{_prom_labels(labels)} {float(value)!r}" for labels, value in values[name])
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def render_json(self, latest, generation):
+        devices = {}
+        for serial, (ts, snap, package, static) in latest.items():
+            devices[serial] = {
+                "ts": datetime.fromtimestamp(ts).astimezone().isoformat(),
+                "device": static,
+                "temp_c": snap.temp_c,
+                "thermal": snap.thermal,
+                "sys_mem": snap.sys_mem,
+                "interval_ms": snap.interval_ms,
+                "packages": dict(self._packages(snap, package)),
+            }
+        return json.dumps({"generation": generation, "devices": devices}, ensure_ascii=False).encode("utf-8")
+
+    def body(self, fmt):
+        with self._lock:
+            cached = self._cache.get(fmt)
+            if cached is not None and cached[0] == self.generation:
+                return cached[1]
+            generation = self.generation
+            latest = dict(self._latest)
+        body = self.render_json(latest, generation) if fmt == "json" else self.render_prometheus(latest)
+        with self._lock:
+            self._cache[fmt] = (generation, body)
+        return body
+
+    def start(self):
+        # Imported here: http.server costs ~30 ms at startup and most runs
+        # never open the endpoint.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                if path == "/metrics.json" or (path == "/metrics" and "format=json" in query):
+                    body, ctype = exporter.body("json"), "application/json; charset=utf-8"
+                elif path == "/metrics":
+                    body, ctype = exporter.body("prometheus"), PROM_CONTENT_TYPE
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
                 pass
-            self.job_after_id = None
-        self.start_btn.configure(state="normal")
-        self.status_text.set("已停止")
 
-    def _schedule_next(self):
-        if not self.is_running:
-            return
-        delay = int(self.refresh_ms.get())
-        self.job_after_id = self.after(delay, self._tick)
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
 
-    def _tick(self):
-        serial = self.selected_device.get()
-        if not serial:
-            self.status_text.set("沒有選擇裝置。")
-            self.stop()
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# --------------------- Capture and replay ---------------------
+# A capture file (.ptmc) is append-only: a header, then tagged records. "K"
+# defines a shell command once (id, text); "R" is one reply with the wall
+# time the call started, device serial, command id and zlib-compressed output (or the error
+# text when the call failed). A torn tail from a crash is ignored on read
+# and cut off before appending. Replay serves the replies back per device in
+# order through adb_shell, so collect_snapshot, the parsers, the CPU deltas
+# and the loggers run unchanged, either at recorded pace or back to back.
+CAPTURE_EXT = ".ptmc"
+CAPTURE_MAGIC = b"PTMC"
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct("<4sH")
+CAPTURE_CMD_TAG = b"K"
+CAPTURE_CMD = struct.Struct("<II")
+CAPTURE_REC_TAG = b"R"
+CAPTURE_REC = struct.Struct("<dIBHI")
+CAPTURE_FLAG_ERROR = 1
+CAPTURE_ZLIB_LEVEL = 6
+REPLAY_QUEUE_SIZE = 1024
+# At recorded pace, an idle stretch longer than this many sampling intervals
+# (e.g. two appended sessions) is replayed as a single interval.
+REPLAY_GAP_FACTOR = 10
+REPLAY_DEFAULT_INTERVAL_S = 1.0
+
+
+@dataclass
+class CaptureRecord:
+    ts: float
+    serial: str
+    command: str
+    payload: bytes
+    error: bool = False
+
+    def text(self):
+        return zlib.decompress(self.payload).decode("utf-8", "replace")
+
+
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.commands = {}
+        self.end = 0
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            head = f.read(CAPTURE_HEADER.size)
+            if len(head) < CAPTURE_HEADER.size or CAPTURE_HEADER.unpack(head)[0] != CAPTURE_MAGIC:
+                raise ValueError(f"不是擷取檔: {self.path}")
+            self.end = f.tell()
+            while True:
+                tag = f.read(1)
+                if tag == CAPTURE_CMD_TAG:
+                    raw = f.read(CAPTURE_CMD.size)
+                    if len(raw) < CAPTURE_CMD.size:
+                        return
+                    cmd_id, length = CAPTURE_CMD.unpack(raw)
+                    data = f.read(length)
+                    if len(data) < length:
+                        return
+                    self.commands[cmd_id] = data.decode("utf-8", "replace")
+                    self.end = f.tell()
+                elif tag == CAPTURE_REC_TAG:
+                    raw = f.read(CAPTURE_REC.size)
+                    if len(raw) < CAPTURE_REC.size:
+                        return
+                    ts, cmd_id, flags, serial_len, payload_len = CAPTURE_REC.unpack(raw)
+                    body = f.read(serial_len + payload_len)
+                    if len(body) < serial_len + payload_len:
+                        return
+                    self.end = f.tell()
+                    yield CaptureRecord(
+                        ts, body[:serial_len].decode("utf-8", "replace"), self.commands.get(cmd_id, ""),
+                        body[serial_len:], bool(flags & CAPTURE_FLAG_ERROR),
+                    )
+                else:
+                    return
+
+
+class CaptureWriter:
+    def __init__(self, path, append=False):
+        self.path = path
+        self.records = 0
+        self._commands = {}
+        self._lock = threading.Lock()
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = CaptureReader(path)
+            for _ in reader:
+                self.records += 1
+            self._commands = {command: cmd_id for cmd_id, command in reader.commands.items()}
+            self._file = open(path, "r+b")
+            self._file.truncate(reader.end)
+            self._file.seek(reader.end)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+            self._file.flush()
+
+    def record(self, ts, serial, command, text, error=False):
+        if not isinstance(command, str):
+            command = " ".join(command)
+        payload = zlib.compress(text.encode("utf-8"), CAPTURE_ZLIB_LEVEL)
+        serial_b = serial.encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                return
+            cmd_id = self._commands.get(command)
+            if cmd_id is None:
+                cmd_id = self._commands[command] = len(self._commands)
+                data = command.encode("utf-8")
+                self._file.write(CAPTURE_CMD_TAG + CAPTURE_CMD.pack(cmd_id, len(data)) + data)
+            flags = CAPTURE_FLAG_ERROR if error else 0
+            self._file.write(
+                CAPTURE_REC_TAG + CAPTURE_REC.pack(ts, cmd_id, flags, len(serial_b), len(payload))
+                + serial_b + payload
+            )
+            self._file.flush()
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ReplaySource:
+    def __init__(self, path, serials=None):
+        self.path = path
+        self.total = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+        for record in CaptureReader(path):
+            if serials and record.serial not in serials:
+                continue
+            self._queues.setdefault(record.serial, deque()).append(record)
+            self.total += 1
+        self.serials = list(self._queues)
+
+    def peek(self, serial):
+        pending = self._queues.get(serial)
+        return pending[0] if pending else None
+
+    def next(self, serial, command=None):
+        with self._lock:
+            pending = self._queues.get(serial)
+            if not pending:
+                raise RuntimeError(f"重播資料已用完: {serial}")
+            record = pending.popleft()
+        if record.error:
+            raise RuntimeError(record.text())
+        return record.text()
+
+
+def start_capture(path, append=False):
+    global _capture
+    stop_capture()
+    _capture = CaptureWriter(path, append)
+    return _capture
+
+
+def stop_capture():
+    global _capture
+    if _capture is not None:
+        _capture.close()
+        _capture = None
+
+
+def start_replay(path, serials=None):
+    global _replay
+    _replay = ReplaySource(path, serials)
+    return _replay
+
+
+def stop_replay():
+    global _replay
+    _replay = None
+
+
+def replay_samples(source, package, speed=1.0, scan=None, stop=None):
+    # Ticks follow the first recorded reply of each round; speed 0 replays
+    # back to back. The recorded gap becomes the sample's interval_ms; idle
+    # stretches beyond REPLAY_GAP_FACTOR intervals are skipped when pacing.
+    cpu_prev = {serial: {} for serial in source.serials}
+    last_ts = {}
+    intervals = {}
+    prev_ts = None
+    skipped = 0.0
+    heap = [(source.peek(serial).ts, serial) for serial in source.serials if source.peek(serial)]
+    heapq.heapify(heap)
+    first_ts = heap[0][0] if heap else 0.0
+    wall0 = time.monotonic()
+    while heap:
+        ts, serial = heapq.heappop(heap)
+        interval = intervals.get(serial, REPLAY_DEFAULT_INTERVAL_S)
+        if prev_ts is not None and ts - prev_ts > REPLAY_GAP_FACTOR * interval:
+            skipped += ts - prev_ts - interval
+        elif serial in last_ts:
+            intervals[serial] = max(ts - last_ts[serial], 1e-3)
+        prev_ts = ts
+        if speed > 0:
+            delay = (ts - first_ts - skipped) / speed - (time.monotonic() - wall0)
+            if delay > 0:
+                if stop is None:
+                    time.sleep(delay)
+                elif stop.wait(delay):
+                    return
+        if stop is not None and stop.is_set():
             return
+        now_dt = datetime.fromtimestamp(ts)
         try:
-            now_dt = datetime.now()
-            self._update_log_target(now_dt)
-
-            temp_c = get_phone_temperature(serial)
-            self.current_temp.set(f"{temp_c:.1f}")
+            snap = collect_snapshot(serial, package, cpu_prev[serial], scan=scan)
+        except RuntimeError as e:
+            yield serial, now_dt, None, str(e)
+        else:
+            if serial in last_ts:
+                snap.interval_ms = round((ts - last_ts[serial]) * 1000)
+            yield serial, now_dt, snap, None
+        last_ts[serial] = ts
+        record = source.peek(serial)
+        if record is not None:
+            heapq.heappush(heap, (record.ts, serial))
+
+
+# --------------------- Headless CLI ---------------------
+# Runs without Tk for CI rigs and long soak tests: samples go to the rotating
+# logs and, optionally, to stdout as one JSON object (or CSV row) per line.
+DEFAULT_INTERVAL_MS = 2000
+MIN_INTERVAL_MS = 200
+
+
+def sample_to_dict(serial, now_dt, snap, error=None):
+    if error is not None:
+        return {"ts": now_dt.astimezone().isoformat(), "serial": serial, "error": error}
+    return {
+        "ts": now_dt.astimezone().isoformat(),
+        "serial": serial,
+        "temp_c": snap.temp_c,
+        "sys_mem": snap.sys_mem,
+        "proc": snap.proc,
+        "timings_ms": {name: round(seconds * 1000.0, 3) for name, seconds in snap.timings.items()},
+        "packages": snap.packages,
+        "top": snap.top,
+        "threads": snap.threads,
+        "thermal": snap.thermal,
+        "zones": snap.zones,
+        "interval_ms": snap.interval_ms,
+    }
 
-            sys_mem = get_system_memory_kb(serial)
-            self.mem_total_mb.set(f"{sys_mem['total_kb']/1024:.0f}")
-            self.mem_avail_mb.set(f"{sys_mem['free_kb']/1024:.0f}")
-            used_pct = (sys_mem['used_kb'] / sys_mem['total_kb'] * 100.0) if sys_mem['total_kb'] else 0.0
-            self.mem_usage_pct.set(f"{used_pct:.1f}%")
 
-            pkg = self.package_name.get().strip()
-            proc = get_process_metrics(serial, pkg, self._cpu_prev) if pkg else None
-            if proc and proc.get('res_mb') is not None:
-                self.app_pss_mb.set(f"{proc['res_mb']:.1f}")
+class HeadlessRunner:
+    def __init__(self, serials, package, interval_ms, logger=None, stdout_format="jsonl",
+                 stream=False, timeout_s=MULTI_DEVICE_TIMEOUT_S, out=None, scan=None, thread_log=False,
+                 thermal_log=False, adaptive=None, alerts=None, exporter=None, replay=None, replay_speed=1.0):
+        self.serials = serials
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.exporter = exporter
+        self.adaptive = adaptive
+        self.alerts = alerts
+        self.package = package
+        self.scan = scan
+        self.thread_log = thread_log
+        self.thermal_log = thermal_log
+        self.interval_ms = interval_ms
+        self.logger = logger
+        self.stdout_format = stdout_format
+        self.stream = stream
+        self.timeout_s = timeout_s
+        self.out = out or sys.stdout
+        self.samples = 0
+        self.errors = 0
+        self.alert_count = 0
+        self.stats = StageStats()
+        self.missed_total = 0
+        self._results = queue.Queue()
+        self._monitor = None
+        self._samplers = []
+        self._replay_thread = None
+        self._replay_stop = threading.Event()
+
+    def _emit(self, serial, now_dt, snap, error):
+        if error is not None:
+            self.errors += 1
+            if self.stdout_format == "jsonl":
+                self.out.write(json.dumps(sample_to_dict(serial, now_dt, None, error), ensure_ascii=False) + "\n")
             else:
-                self.app_pss_mb.set("--")
-
-            ts_local = now_dt.strftime('%Y-%m-%d %H:%M:%S')
-            ts_iso = now_dt.astimezone().isoformat(timespec='seconds')
-            line = [
-                ts_local,
-                ts_iso,
-                f"{int(sys_mem['total_kb'])}",
-                f"{int(sys_mem['used_kb'])}",
-                f"{int(sys_mem['free_kb'])}",
-                str(proc['pid']) if proc and proc.get('pid') is not None else "",
-                f"{proc['virt_mb']:.1f}" if proc and proc.get('virt_mb') is not None else "",
-                f"{proc['res_mb']:.1f}" if proc and proc.get('res_mb') is not None else "",
-                f"{proc['shr_mb']:.1f}" if proc and proc.get('shr_mb') is not None else "",
-                f"{proc['cpu_percent']:.1f}" if proc and proc.get('cpu_percent') is not None else "",
-                f"{proc['mem_percent']:.1f}" if proc and proc.get('mem_percent') is not None else "",
-                proc.get('error_message', '') if proc else "",
-            ]
-            print(','.join(line))
+                print(f"[{serial}] {error}", file=sys.stderr)
+            return
+        self.samples += 1
+        if self.exporter is not None:
+            self.exporter.update(serial, now_dt, snap, self.package)
+        serial_key = serial if len(self.serials) > 1 else None
+        if self.logger is not None:
+            try:
+                self.logger.update_target(now_dt, serial_key)
+            except OSError as e:
+                print(f"寫入紀錄失敗: {e}", file=sys.stderr)
+            snap.timings.update(self.logger.timings)
+        row = format_log_row(now_dt, snap.sys_mem, snap.proc)
+        if self.logger is not None and self.logger.stage_columns:
+            row += format_stage_columns(snap.timings, self.missed())
+        if self.logger is not None and self.logger.interval_column:
+            row += format_interval_column(snap)
+        if self.stdout_format == "jsonl":
+            self.out.write(json.dumps(sample_to_dict(serial, now_dt, snap), ensure_ascii=False) + "\n")
+        elif self.stdout_format == "csv":
+            self.out.write(serial + "," + ",".join(row) + "\n")
+        self.out.flush()
+        if self.logger is not None:
+            try:
+                self.logger.write(now_dt, snap.sys_mem, snap.proc, row, serial_key)
+                if self.thread_log and snap.threads:
+                    self.logger.write_threads(now_dt, snap.proc['pid'], snap.threads, serial_key)
+                if self.thermal_log and snap.thermal:
+                    self.logger.write_thermal(now_dt, snap.thermal, serial_key)
+            except OSError as e:
+                print(f"寫入紀錄失敗: {e}", file=sys.stderr)
+        if self.alerts is not None:
+            for event in self.alerts.evaluate(serial, now_dt.timestamp(), sample_metrics(snap)):
+                self._emit_alert(event)
+        self.stats.record(snap.timings)
+
+    def _emit_alert(self, event):
+        if event.state == "firing":
+            self.alert_count += 1
+        if self.stdout_format == "jsonl":
+            self.out.write(json.dumps(alert_to_dict(event), ensure_ascii=False) + "\n")
+            self.out.flush()
+        else:
+            value = f"{event.value:.2f}" if event.value is not None else "--"
+            label = "警示" if event.state == "firing" else "解除"
+            print(f"[{event.serial}] {label}: {event.rule.name} ({value})", file=sys.stderr)
+        if self.logger is not None:
+            try:
+                self.logger.write_alert(event)
+            except OSError as e:
+                print(f"寫入紀錄失敗: {e}", file=sys.stderr)
 
-            self._maybe_log(sys_mem, proc, now_dt)
-            self.status_text.set(f"最後更新: {now_dt.strftime('%H:%M:%S')}")
-        except Exception as e:
-            self.status_text.set(str(e))
-        finally:
-            self._schedule_next()
+    def missed(self):
+        if self._monitor is None:
+            return 0
+        return sum(state.skipped for state in self._monitor.devices.values())
+
+    def start(self):
+        if self.replay is not None:
+            # Bounded so a back-to-back replay cannot outrun the logger.
+            self._results = queue.Queue(REPLAY_QUEUE_SIZE)
+            self._replay_thread = threading.Thread(target=self._replay_loop, daemon=True)
+            self._replay_thread.start()
+        elif self.stream:
+            for serial in self.serials:
+                sampler = StreamSampler(serial, self.package, self.interval_ms)
+                sampler.start()
+                self._samplers.append(sampler)
+        else:
+            self._monitor = MultiDeviceMonitor(
+                self.serials, self.package, self.interval_ms,
+                lambda serial, now_dt, snap, error: self._results.put((serial, now_dt, snap, error)),
+                timeout_s=self.timeout_s, scan=self.scan, adaptive=self.adaptive,
+            )
+            self._monitor.start()
+
+    def _replay_loop(self):
+        for item in replay_samples(self.replay, self.package, self.replay_speed, self.scan, self._replay_stop):
+            while not self._replay_stop.is_set():
+                try:
+                    self._results.put(item, timeout=0.25)
+                    break
+                except queue.Full:
+                    continue
+
+    def done(self):
+        return (self._replay_thread is not None and not self._replay_thread.is_alive()
+                and self._results.empty())
 
-    def _maybe_log(self, sys_mem, proc, now_dt):
-        if not self.logging_enabled.get():
+    def _drain(self, wait_s):
+        if self.stream:
+            time.sleep(wait_s)
+            for sampler in self._samplers:
+                try:
+                    frames = sampler.drain()
+                except RuntimeError as e:
+                    self._emit(sampler.serial, datetime.now(), None, str(e))
+                    continue
+                for now_dt, snap in frames:
+                    self._emit(sampler.serial, now_dt, snap, None)
             return
         try:
-            if not self.current_log_path:
-                self._update_log_target(now_dt)
-            with open(self.current_log_path, "a", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                ts_local = now_dt.strftime('%Y-%m-%d %H:%M:%S')
-                ts_iso = now_dt.astimezone().isoformat(timespec='seconds')
-                writer.writerow([
-                    ts_local,
-                    ts_iso,
-                    int(sys_mem['total_kb']),
-                    int(sys_mem['used_kb']),
-                    int(sys_mem['free_kb']),
-                    (proc.get('pid') if proc else ''),
-                    (f"{proc['virt_mb']:.1f}" if proc and proc.get('virt_mb') is not None else ''),
-                    (f"{proc['res_mb']:.1f}" if proc and proc.get('res_mb') is not None else ''),
-                    (f"{proc['shr_mb']:.1f}" if proc and proc.get('shr_mb') is not None else ''),
-                    (f"{proc['cpu_percent']:.1f}" if proc and proc.get('cpu_percent') is not None else ''),
-                    (f"{proc['mem_percent']:.1f}" if proc and proc.get('mem_percent') is not None else ''),
-                    (proc.get('error_message', '') if proc else ''),
-                ])
-        except Exception as e:
-            self.status_text.set(f"寫入紀錄失敗: {e}")
-
-
-def main():
-    app = App()
-    app.mainloop()
+            item = self._results.get(timeout=wait_s)
+        except queue.Empty:
+            return
+        while True:
+            self._emit(*item)
+            try:
+                item = self._results.get_nowait()
+            except queue.Empty:
+                return
+
+    def run(self, duration_s=None, on_first_sample=None):
+        self.start()
+        deadline = time.monotonic() + duration_s if duration_s else None
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                wait_s = STREAM_DRAIN_MS / 1000.0 if self.stream else 0.25
+                if deadline is not None:
+                    wait_s = max(0.0, min(wait_s, deadline - time.monotonic()))
+                first = self.samples + self.errors == 0
+                self._drain(wait_s)
+                if first and on_first_sample and self.samples + self.errors:
+                    on_first_sample()
+                if self.logger is not None:
+                    try:
+                        self.logger.flush_due()
+                    except OSError as e:
+                        print(f"寫入紀錄失敗: {e}", file=sys.stderr)
+                    if self.logger.archiver is not None:
+                        for message in self.logger.archiver.take_errors():
+                            print(f"封存失敗，稍後重試: {message}", file=sys.stderr)
+                if self.done():
+                    break
+        except KeyboardInterrupt:
+            pass
+        except BrokenPipeError:
+            # stdout consumer went away (e.g. `| head`); stop quietly.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.out.fileno())
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._replay_thread is not None:
+            self._replay_stop.set()
+            self._replay_thread.join(2)
+            self._replay_thread = None
+        if self._monitor is not None:
+            self._monitor.stop()
+            self._monitor.join(2)
+            self.missed_total = self.missed()
+            self._monitor = None
+        for sampler in self._samplers:
+            sampler.stop()
+        self._samplers = []
+        if self.logger is not None:
+            self.logger.close()
+
+
+def run_headless(args):
+    if args.transport:
+        set_adb_transport(args.transport)
+    try:
+        replay = start_sources(args)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        return _run_headless(args, replay)
+    finally:
+        if _capture is not None:
+            print(f"已擷取 {_capture.records} 筆 adb 回應: {_capture.path}", file=sys.stderr)
+        stop_capture()
+        stop_replay()
+
+
+def _run_headless(args, replay):
+    serials = args.serial
+    if not serials:
+        try:
+            serials = list_adb_devices()
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 1
+    if not serials:
+        print("找不到已連線的裝置。", file=sys.stderr)
+        return 1
+
+    logger = None
+    archiver = build_archiver(args)
+    if args.log_format != "none":
+        logger = MetricsLogger(
+            args.output_dir, args.log_format, stage_columns=args.stage_columns, interval_column=args.adaptive,
+            archiver=archiver, hours=resolve_hot_hours(args), flush=build_flush_policy(args),
+        )
+    scan = None
+    if args.extra_package or args.top or args.threads:
+        scan = ProcessScan(tuple(args.extra_package or ()), args.top, args.top_by, args.threads)
+    adaptive = None
+    if args.adaptive:
+        adaptive = AdaptivePolicy(
+            args.min_interval_ms, args.max_interval_ms,
+            temp_limit_c=args.temp_limit, cpu_limit_pct=args.cpu_limit, mem_limit_pct=args.mem_limit,
+        )
+    alerts = None
+    try:
+        rules = [parse_alert_rule(text) for text in args.alert or ()]
+        if args.alert_rules:
+            rules += load_alert_rules(args.alert_rules)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    if rules:
+        alerts = AlertEngine(rules)
+    exporter = None
+    if args.metrics_port is not None:
+        try:
+            exporter = MetricsExporter(args.metrics_host, args.metrics_port).start()
+        except OSError as e:
+            print(f"無法啟動指標端點: {e}", file=sys.stderr)
+            return 1
+        print(f"指標端點: http://{exporter.host}:{exporter.port}/metrics", file=sys.stderr)
+    runner = HeadlessRunner(
+        serials, args.package or "", args.interval_ms, logger=logger,
+        stdout_format=args.stdout, stream=args.stream, timeout_s=args.timeout, scan=scan,
+        thread_log=args.thread_log, thermal_log=args.thermal_log, adaptive=adaptive,
+        alerts=alerts, exporter=exporter, replay=replay, replay_speed=args.replay_speed,
+    )
+
+    def on_first_sample():
+        print(f"啟動至第一筆資料: {(time.perf_counter() - _T0) * 1000:.0f} ms", file=sys.stderr)
+
+    start = time.perf_counter()
+    try:
+        runner.run(args.duration, on_first_sample)
+    finally:
+        elapsed = time.perf_counter() - start
+        if exporter is not None:
+            exporter.stop()
+        if archiver is not None:
+            archiver.close(ARCHIVE_CLOSE_TIMEOUT_S)
+    print(f"共 {runner.samples} 筆資料，{runner.errors} 筆錯誤。", file=sys.stderr)
+    if archiver is not None and archiver.failures:
+        print(f"封存失敗 {archiver.failures} 次，{archiver.pending_retries()} 個資料夾待重試"
+              f" (最後一次: {archiver.errors[-1]})。", file=sys.stderr)
+    if replay is not None:
+        total = runner.samples + runner.errors
+        print(f"重播耗時 {elapsed:.2f} 秒，{total / max(elapsed, 1e-9):.0f} 筆/秒。", file=sys.stderr)
+    if alerts is not None:
+        print(f"觸發 {runner.alert_count} 次警示，目前仍有 {len(alerts.active())} 項。", file=sys.stderr)
+    print(runner.stats.format(runner.missed_total), file=sys.stderr)
+    return 0
+
+
+def start_sources(args):
+    if args.capture:
+        start_capture(args.capture, args.capture_append)
+    if args.replay:
+        return start_replay(args.replay, args.serial)
+    return None
+
+
+def build_flush_policy(args):
+    return LogFlushPolicy(args.flush_rows, args.flush_interval, args.fsync)
+
+
+def resolve_hot_hours(args):
+    if args.hot_hours is not None:
+        return args.hot_hours
+    return LOG_RETENTION_HOURS if args.no_archive else ARCHIVE_HOT_HOURS
+
+
+def build_archiver(args):
+    if args.no_archive:
+        return None
+    return LogArchiver(args.output_dir, args.archive_codec, args.archive_days, args.archive_budget_mb)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="手機溫度/記憶體監控工具")
+    parser.add_argument("--headless", action="store_true", help="不開啟介面，直接在終端機輪詢並寫入紀錄")
+    parser.add_argument("-s", "--serial", action="append", help="裝置序號，可重複指定；預設為所有已連線裝置")
+    parser.add_argument("-p", "--package", default="", help="欲監控的 App 套件名稱")
+    parser.add_argument("-P", "--extra-package", action="append", help="同時監控的其他套件或服務，可重複指定")
+    parser.add_argument("--top", type=int, default=0, help="列出 CPU/RSS 前 N 名的行程")
+    parser.add_argument("--top-by", choices=TOP_SORT_KEYS, default="cpu")
+    parser.add_argument("--threads", type=int, default=0, help="列出 -p 套件 CPU 前 N 名的執行緒")
+    parser.add_argument("--thread-log", action="store_true", help="將前 N 名執行緒另外寫入 metrics_threads_*.csv")
+    parser.add_argument("--thermal-log", action="store_true", help="將 CPU/GPU/表面/電池分區溫度寫入 metrics_thermal_*.csv")
+    parser.add_argument("--alert", action="append", metavar="RULE",
+                        help="警示規則，如 \"battery_temp_c > 42 for 30s\"、\"app_cpu p95 > 80 over 1m\"，可重複指定")
+    parser.add_argument("--alert-rules", metavar="FILE", help="警示規則檔，每行一條，# 開頭為註解")
+    parser.add_argument("-i", "--interval-ms", type=int, default=DEFAULT_INTERVAL_MS, help="更新頻率 (ms)")
+    parser.add_argument("--adaptive", action="store_true", help="依溫度/CPU/記憶體變化自動調整更新頻率")
+    parser.add_argument("--min-interval-ms", type=int, default=ADAPTIVE_MIN_MS, help="自適應模式的最短間隔 (ms)")
+    parser.add_argument("--max-interval-ms", type=int, default=ADAPTIVE_MAX_MS, help="自適應模式的最長間隔 (ms)")
+    parser.add_argument("--temp-limit", type=float, default=AdaptivePolicy.temp_limit_c, help="接近此溫度 (°C) 時加快取樣")
+    parser.add_argument("--cpu-limit", type=float, default=AdaptivePolicy.cpu_limit_pct, help="接近此 App CPU%% 時加快取樣")
+    parser.add_argument("--mem-limit", type=float, default=AdaptivePolicy.mem_limit_pct, help="接近此系統記憶體%% 時加快取樣")
+    parser.add_argument("-d", "--duration", type=float, help="執行秒數，預設持續到 Ctrl+C")
+    parser.add_argument("-o", "--output-dir", default=os.path.join(os.getcwd(), "logs"), help="紀錄目錄")
+    parser.add_argument("--log-format", choices=("csv", "binary", "none"), default="csv")
+    parser.add_argument("--flush-rows", type=int, default=LOG_FLUSH_ROWS, help="累積幾筆後寫入磁碟")
+    parser.add_argument("--flush-interval", type=float, default=LOG_FLUSH_INTERVAL_S,
+                        help="最久幾秒寫入磁碟一次 (取樣失敗時也會照時間寫入)")
+    parser.add_argument("--fsync", action="store_true", help="每次輪替或關閉紀錄檔時 fsync，斷電時較不易遺失資料")
+    parser.add_argument("--hot-hours", type=float,
+                        help="未壓縮紀錄保留的小時數；預設封存時為 0 (半小時資料夾結束即壓縮)，--no-archive 時為 36")
+    parser.add_argument("--no-archive", action="store_true", help="超過保留時間直接刪除，不壓縮封存")
+    parser.add_argument("--archive-codec", choices=ARCHIVE_CODECS, default="gzip")
+    parser.add_argument("--archive-days", type=float, default=ARCHIVE_RETENTION_DAYS, help="封存檔保留天數")
+    parser.add_argument("--archive-budget-mb", type=float, default=ARCHIVE_BUDGET_MB,
+                        help="封存檔總容量上限 (MB)，超過時由最舊的開始刪除；0 = 不限制")
+    parser.add_argument("--stdout", choices=("jsonl", "csv", "none"), default="jsonl", help="標準輸出格式")
+    parser.add_argument("--transport", choices=("subprocess", "socket"), help="adb 傳輸方式")
+    parser.add_argument("--stream", action="store_true", help="使用裝置端串流取樣")
+    parser.add_argument("--stage-columns", action="store_true", help="CSV 紀錄加入各階段耗時欄位")
+    parser.add_argument("--metrics-port", type=int, help="在此埠提供 Prometheus /metrics 與 /metrics.json (0 = 自動選擇)")
+    parser.add_argument("--metrics-host", default=EXPORTER_HOST, help="指標端點綁定的位址")
+    parser.add_argument("--timeout", type=float, default=MULTI_DEVICE_TIMEOUT_S, help="每次取樣逾時秒數")
+    parser.add_argument("--capture", metavar="FILE", help="將每次 adb 回應的原始內容寫入此擷取檔 (.ptmc)，既有檔案會被覆寫")
+    parser.add_argument("--capture-append", action="store_true", help="接續寫入既有的擷取檔，而不是覆寫")
+    parser.add_argument("--replay", metavar="FILE", help="以擷取檔取代 adb 重播，經過相同的解析與紀錄流程")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="重播速度倍率；0 = 不等待、全速重播 (可作為吞吐量基準)")
+    parser.add_argument("--export-csv", nargs=2, metavar=("SRC", "DST"), help="將 .ptmb 紀錄轉成 CSV 後結束")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+
+    if args.export_csv:
+        src, dst = args.export_csv
+        binary_log_to_csv(src, dst)
+        return 0
+
+    if args.capture_append and not args.capture:
+        parser.error("--capture-append 需搭配 --capture")
+    if args.capture and args.replay:
+        parser.error("--capture 不可與 --replay 同時使用")
+    if (args.capture or args.replay) and args.stream:
+        parser.error("--stream 不支援 --capture/--replay")
+    if args.replay_speed < 0:
+        parser.error("--replay-speed 不可為負數")
+    if args.flush_rows < 1 or args.flush_interval < 0:
+        parser.error("--flush-rows 最小為 1，--flush-interval 不可為負數")
+
+    if args.headless:
+        min_ms = STREAM_MIN_INTERVAL_MS if args.stream else MIN_INTERVAL_MS
+        if args.interval_ms < min_ms:
+            parser.error(f"--interval-ms 最小為 {min_ms}")
+        if args.adaptive:
+            if args.stream:
+                parser.error("--adaptive 不支援 --stream")
+            if args.replay:
+                parser.error("--adaptive 不支援 --replay (重播沿用擷取時的間隔)")
+            if args.min_interval_ms < MIN_INTERVAL_MS:
+                parser.error(f"--min-interval-ms 最小為 {MIN_INTERVAL_MS}")
+            if args.max_interval_ms < args.min_interval_ms:
+                parser.error("--max-interval-ms 不可小於 --min-interval-ms")
+        return run_headless(args)
+
+    # Running as a script: make `import phone_temp_monitor` in the GUI module
+    # resolve to this module instead of importing a second copy.
+    sys.modules.setdefault("phone_temp_monitor", sys.modules[__name__])
+    try:
+        from phone_temp_monitor_gui import run_gui
+    except ImportError as e:
+        print("Tkinter not available:", e)
+        print("可改用 --headless 在無介面環境執行。")
+        return 1
+    try:
+        start_sources(args)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        run_gui(
+            args.output_dir, args.metrics_host, args.metrics_port, build_archiver(args), resolve_hot_hours(args),
+            build_flush_policy(args),
+        )
+    finally:
+        stop_capture()
+        stop_replay()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,830 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+from phone_temp_monitor import (
+    ADAPTIVE_MAX_MS,
+    ADAPTIVE_MIN_MS,
+    ARCHIVE_CLOSE_TIMEOUT_S,
+    EXPORTER_HOST,
+    LOG_RETENTION_HOURS,
+    STREAM_DRAIN_MS,
+    STREAM_MIN_INTERVAL_MS,
+    THERMAL_SERIES,
+    TOP_SORT_KEYS,
+    AdaptiveInterval,
+    AdaptivePolicy,
+    AlertEngine,
+    DeadlineScheduler,
+    DeviceHistory,
+    MetricsExporter,
+    MetricsLogger,
+    MultiDeviceMonitor,
+    ProcessScan,
+    StageStats,
+    StreamSampler,
+    collect_snapshot,
+    format_interval_column,
+    format_log_row,
+    format_stage_columns,
+    list_adb_devices,
+    parse_alert_rule,
+    sample_metrics,
+)
+
+
+UI_DRAIN_MS = 100
+STALE_MIN_MS = 1000
+CHART_REDRAW_MS = 1000
+THERMAL_LABELS = {"battery": "電池", "cpu": "CPU", "gpu": "GPU", "skin": "表面", "other": "其他"}
+DEFAULT_ALERT_RULES = "battery_temp_c > 42 for 30s; app_rss_mb slope > 5 over 10m; app_cpu p95 > 80 over 1m"
+CHART_WINDOWS = {"5 分鐘": 300, "1 小時": 3600, "6 小時": 21600, "24 小時": 86400, "全部": 0}
+
+
+class HistoryChart(tk.Canvas):
+    PANELS = (
+        ("temp_c", "溫度(°C)", "#d9480f"),
+        ("mem_pct", "系統記憶體%", "#1c7ed6"),
+        ("app_cpu", "App CPU%", "#2b8a3e"),
+        ("app_rss_mb", "App RSS(MB)", "#862e9c"),
+    )
+    LEFT = 56
+    RIGHT = 8
+
+    def __init__(self, master, **kwargs):
+        super().__init__(master, background="white", highlightthickness=0, **kwargs)
+
+    def draw(self, history, window_s):
+        self.delete("all")
+        width = self.winfo_width()
+        height = self.winfo_height()
+        plot_w = width - self.LEFT - self.RIGHT
+        if plot_w < 20 or height < 40:
+            return
+        end_ts = time.time()
+        start_ts = end_ts - window_s if window_s else None
+        if start_ts is None and history is not None:
+            firsts = [ts for ts in (s.first_ts() for s in history.series.values()) if ts is not None]
+            start_ts = min(firsts) if firsts else end_ts - 60
+        if start_ts is None or start_ts >= end_ts:
+            start_ts = end_ts - 60
+        panel_h = height / len(self.PANELS)
+        for i, (key, title, color) in enumerate(self.PANELS):
+            top = i * panel_h + 14
+            bottom = (i + 1) * panel_h - 4
+            self.create_text(4, i * panel_h + 2, text=title, anchor="nw", fill=color, font=("Segoe UI", 9))
+            self.create_rectangle(self.LEFT, top, self.LEFT + plot_w, bottom, outline="#dee2e6")
+            if history is None:
+                continue
+            buckets = history.series[key].window(start_ts, end_ts, plot_w)
+            if not buckets:
+                continue
+            lo = min(b[1] for b in buckets)
+            hi = max(b[2] for b in buckets)
+            if hi - lo < 1e-9:
+                lo -= 1.0
+                hi += 1.0
+            y_scale = (bottom - top) / (hi - lo)
+            x_scale = plot_w / (end_ts - start_ts)
+            coords = []
+            for ts, b_lo, b_hi in buckets:
+                x = self.LEFT + (ts - start_ts) * x_scale
+                coords += [x, bottom - (b_hi - lo) * y_scale, x, bottom - (b_lo - lo) * y_scale]
+            if len(coords) >= 4:
+                self.create_line(*coords, fill=color)
+            self.create_text(self.LEFT - 4, top, text=f"{hi:.1f}", anchor="ne", fill="#495057", font=("Consolas", 8))
+            self.create_text(self.LEFT - 4, bottom, text=f"{lo:.1f}", anchor="se", fill="#495057", font=("Consolas", 8))
+
+
+class App(tk.Tk):
+    def __init__(self, log_root=None, exporter=None, archiver=None, hours=LOG_RETENTION_HOURS, flush=None):
+        super().__init__()
+        self.title("手機溫度/記憶體監控 (Python)")
+        self.geometry("720x960")
+        self.minsize(600, 680)
+        self.resizable(True, True)
+        self.bind("<Configure>", self._on_resize)
+
+        self.refresh_ms = tk.IntVar(value=2000)
+        self.is_running = False
+        self.job_after_id = None
+        self.selected_device = tk.StringVar(value="")
+        self.current_temp = tk.StringVar(value="--")
+        self.mem_usage_pct = tk.StringVar(value="--")
+        self.mem_avail_mb = tk.StringVar(value="--")
+        self.mem_total_mb = tk.StringVar(value="--")
+        self.app_pss_mb = tk.StringVar(value="--")
+        self.status_text = tk.StringVar(value="待機中")
+        self.stage_text = tk.StringVar(value="--")
+        self.logging_enabled = tk.BooleanVar(value=True)
+        self.log_format = tk.StringVar(value="csv")
+        self.stage_columns = tk.BooleanVar(value=False)
+        self.stream_mode = tk.BooleanVar(value=False)
+        self.multi_mode = tk.BooleanVar(value=False)
+        self.adaptive_mode = tk.BooleanVar(value=False)
+        self.adaptive_min_ms = tk.IntVar(value=ADAPTIVE_MIN_MS)
+        self.adaptive_max_ms = tk.IntVar(value=ADAPTIVE_MAX_MS)
+        self.package_name = tk.StringVar(value="")
+        self.extra_packages = tk.StringVar(value="")
+        self.top_n = tk.IntVar(value=0)
+        self.top_by = tk.StringVar(value="cpu")
+        self.thread_top = tk.IntVar(value=0)
+        self.thread_log = tk.BooleanVar(value=False)
+        self.thermal_log = tk.BooleanVar(value=False)
+        self.thermal_text = tk.StringVar(value="--")
+        self.alert_rules = tk.StringVar(value=DEFAULT_ALERT_RULES)
+        self.alert_text = tk.StringVar(value="--")
+        self._alerts = None
+        self._scan = None
+        self._stream = None
+
+        # logging/rotation
+        self.log_root = log_root or os.path.join(os.getcwd(), "logs")
+        self.logger = MetricsLogger(self.log_root, archiver=archiver, hours=hours, flush=flush)
+        self.exporter = exporter
+        self._cpu_prev = {}
+        self._multi = None
+        self._histories = {}
+        self.chart_window = tk.StringVar(value="5 分鐘")
+        self._chart_state = None
+        self.chart_after_id = None
+
+        # adb calls run on the executor; results come back through the queue
+        # and are applied on the Tk thread by _drain_results.
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sampler")
+        self._results = queue.Queue()
+        self._inflight = None
+        self._session = 0
+        self._skipped = 0
+        self._dropped = 0
+        self._scheduler = None
+        self._adaptive = None
+        self._stats = StageStats()
+        self.drain_after_id = None
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        self._build_ui()
+        self._populate_devices()
+        self._update_log_target(datetime.now())
+        self._drain_results()
+        self._redraw_chart()
+
+    def _build_ui(self):
+        pad = {"padx": 8, "pady": 6}
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        content = ttk.Frame(self, padding=(16, 16, 16, 16))
+        content.grid(row=0, column=0, sticky="nsew")
+        content.columnconfigure(0, weight=0)
+        content.columnconfigure(1, weight=1)
+        content.columnconfigure(2, weight=1)
+
+        row = 0
+        ttk.Label(content, text="裝置:").grid(row=row, column=0, sticky="e", **pad)
+        self.device_combo = ttk.Combobox(content, textvariable=self.selected_device, state="readonly")
+        self.device_combo.grid(row=row, column=1, sticky="ew", **pad)
+        ttk.Button(content, text="重新整理裝置", command=self._populate_devices).grid(row=row, column=2, sticky="ew", **pad)
+
+        row += 1
+        ttk.Label(content, text="更新頻率(ms):").grid(row=row, column=0, sticky="e", **pad)
+        self.refresh_entry = ttk.Spinbox(
+            content,
+            from_=500,
+            to=60000,
+            increment=500,
+            textvariable=self.refresh_ms,
+            width=10,
+        )
+        self.refresh_entry.grid(row=row, column=1, sticky="w", **pad)
+        log_frame = ttk.Frame(content)
+        log_frame.grid(row=row, column=2, sticky="w", **pad)
+        ttk.Checkbutton(log_frame, text="寫入紀錄", variable=self.logging_enabled).grid(row=0, column=0, sticky="w")
+        ttk.Combobox(
+            log_frame, textvariable=self.log_format, values=("csv", "binary"), state="readonly", width=7,
+        ).grid(row=0, column=1, sticky="w", padx=(6, 0))
+        ttk.Checkbutton(log_frame, text="階段耗時欄位", variable=self.stage_columns).grid(row=1, column=0, columnspan=2, sticky="w")
+
+        row += 1
+        ttk.Label(content, text="取樣模式:").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Checkbutton(
+            content,
+            text=f"裝置端串流 (可低於 200ms，最低 {STREAM_MIN_INTERVAL_MS}ms)",
+            variable=self.stream_mode,
+        ).grid(row=row, column=1, sticky="w", **pad)
+        ttk.Checkbutton(content, text="同時監控所有裝置", variable=self.multi_mode).grid(row=row, column=2, sticky="w", **pad)
+
+        row += 1
+        ttk.Label(content, text="自適應頻率:").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Checkbutton(
+            content, text="依溫度/CPU/記憶體變化調整", variable=self.adaptive_mode,
+        ).grid(row=row, column=1, sticky="w", **pad)
+        adaptive_frame = ttk.Frame(content)
+        adaptive_frame.grid(row=row, column=2, sticky="w", **pad)
+        ttk.Label(adaptive_frame, text="最短:").grid(row=0, column=0, sticky="w")
+        ttk.Spinbox(
+            adaptive_frame, from_=200, to=60000, increment=100, textvariable=self.adaptive_min_ms, width=6,
+        ).grid(row=0, column=1, sticky="w", padx=(4, 0))
+        ttk.Label(adaptive_frame, text="最長:").grid(row=0, column=2, sticky="w", padx=(6, 0))
+        ttk.Spinbox(
+            adaptive_frame, from_=200, to=600000, increment=1000, textvariable=self.adaptive_max_ms, width=7,
+        ).grid(row=0, column=3, sticky="w", padx=(4, 0))
+
+        row += 1
+        ttk.Label(content, text="App 套件(可選):").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Entry(content, textvariable=self.package_name).grid(row=row, column=1, sticky="ew", **pad)
+        self.package_hint = ttk.Label(content, text="(紀錄 App PSS/CPU/MEM)")
+        self.package_hint.grid(row=row, column=2, sticky="w", **pad)
+
+        row += 1
+        ttk.Label(content, text="警示規則(; 分隔):").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Entry(content, textvariable=self.alert_rules).grid(row=row, column=1, columnspan=2, sticky="ew", **pad)
+
+        row += 1
+        ttk.Label(content, text="其他套件/服務:").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Entry(content, textvariable=self.extra_packages).grid(row=row, column=1, sticky="ew", **pad)
+        top_frame = ttk.Frame(content)
+        top_frame.grid(row=row, column=2, sticky="w", **pad)
+        ttk.Label(top_frame, text="前 N 名:").grid(row=0, column=0, sticky="w")
+        ttk.Spinbox(top_frame, from_=0, to=50, textvariable=self.top_n, width=4).grid(row=0, column=1, sticky="w", padx=(4, 0))
+        ttk.Combobox(
+            top_frame, textvariable=self.top_by, values=TOP_SORT_KEYS, state="readonly", width=4,
+        ).grid(row=0, column=2, sticky="w", padx=(4, 0))
+        ttk.Label(top_frame, text="執行緒前 N 名:").grid(row=1, column=0, sticky="w", pady=(4, 0))
+        ttk.Spinbox(top_frame, from_=0, to=50, textvariable=self.thread_top, width=4).grid(row=1, column=1, sticky="w", padx=(4, 0), pady=(4, 0))
+        ttk.Checkbutton(top_frame, text="紀錄", variable=self.thread_log).grid(row=1, column=2, sticky="w", padx=(4, 0), pady=(4, 0))
+
+        row += 1
+        ttk.Label(content, text="目前溫度(°C):", font=("Segoe UI", 11, "bold")).grid(row=row, column=0, sticky="e", **pad)
+        self.temp_label = ttk.Label(content, textvariable=self.current_temp, font=("Consolas", 16, "bold"))
+        self.temp_label.grid(row=row, column=1, sticky="w", **pad)
+
+        row += 1
+        ttk.Label(content, text="分區溫度(°C):").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Label(content, textvariable=self.thermal_text, font=("Consolas", 11)).grid(row=row, column=1, sticky="w", **pad)
+        ttk.Checkbutton(content, text="分區溫度紀錄", variable=self.thermal_log).grid(row=row, column=2, sticky="w", **pad)
+
+        row += 1
+        ttk.Label(content, text="系統記憶體使用率:").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Label(content, textvariable=self.mem_usage_pct, font=("Consolas", 12)).grid(row=row, column=1, sticky="w", **pad)
+
+        row += 1
+        ttk.Label(content, text="可用/總記憶體(MB):").grid(row=row, column=0, sticky="ne", **pad)
+        mem_frame = ttk.Frame(content)
+        mem_frame.grid(row=row, column=1, columnspan=2, sticky="ew", **pad)
+        mem_frame.columnconfigure(1, weight=1)
+        mem_frame.columnconfigure(3, weight=1)
+        ttk.Label(mem_frame, text="可用:").grid(row=0, column=0, sticky="e", padx=(0, 6))
+        ttk.Label(mem_frame, textvariable=self.mem_avail_mb, font=("Consolas", 12)).grid(row=0, column=1, sticky="w")
+        ttk.Label(mem_frame, text="總計:").grid(row=0, column=2, sticky="e", padx=(12, 6))
+        ttk.Label(mem_frame, textvariable=self.mem_total_mb, font=("Consolas", 12)).grid(row=0, column=3, sticky="w")
+
+        row += 1
+        ttk.Label(content, text="App PSS(MB):").grid(row=row, column=0, sticky="e", **pad)
+        ttk.Label(content, textvariable=self.app_pss_mb, font=("Consolas", 12)).grid(row=row, column=1, sticky="w", **pad)
+
+        row += 1
+        ttk.Label(content, text="各裝置:").grid(row=row, column=0, sticky="ne", **pad)
+        columns = ("serial", "temp", "mem", "res", "cpu", "updated")
+        self.device_tree = ttk.Treeview(content, columns=columns, show="headings", height=5)
+        for col, title, width in (
+            ("serial", "裝置", 150),
+            ("temp", "溫度(°C)", 70),
+            ("mem", "記憶體%", 70),
+            ("res", "App RSS(MB)", 90),
+            ("cpu", "App CPU%", 70),
+            ("updated", "最後更新/錯誤", 140),
+        ):
+            self.device_tree.heading(col, text=title)
+            self.device_tree.column(col, width=width, stretch=(col == "updated"))
+        self.device_tree.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+
+        row += 1
+        ttk.Label(content, text="行程:").grid(row=row, column=0, sticky="ne", **pad)
+        columns = ("name", "pid", "cpu", "res", "mem")
+        self.proc_tree = ttk.Treeview(content, columns=columns, show="headings", height=5)
+        for col, title, width in (
+            ("name", "套件/行程", 200),
+            ("pid", "PID", 60),
+            ("cpu", "CPU%", 70),
+            ("res", "RSS(MB)", 80),
+            ("mem", "MEM%", 70),
+        ):
+            self.proc_tree.heading(col, text=title)
+            self.proc_tree.column(col, width=width, stretch=(col == "name"))
+        self.proc_tree.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+
+        row += 1
+        ttk.Label(content, text="執行緒:").grid(row=row, column=0, sticky="ne", **pad)
+        columns = ("tid", "name", "cpu")
+        self.thread_tree = ttk.Treeview(content, columns=columns, show="headings", height=4)
+        for col, title, width in (
+            ("tid", "TID", 70),
+            ("name", "執行緒", 200),
+            ("cpu", "CPU%", 70),
+        ):
+            self.thread_tree.heading(col, text=title)
+            self.thread_tree.column(col, width=width, stretch=(col == "name"))
+        self.thread_tree.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+
+        row += 1
+        chart_head = ttk.Frame(content)
+        chart_head.grid(row=row, column=0, sticky="ne", **pad)
+        ttk.Label(chart_head, text="歷史:").grid(row=0, column=0, sticky="e")
+        ttk.Combobox(
+            chart_head, textvariable=self.chart_window, values=list(CHART_WINDOWS), state="readonly", width=7,
+        ).grid(row=1, column=0, sticky="e", pady=(4, 0))
+        self.chart = HistoryChart(content, height=240)
+        self.chart.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+        content.rowconfigure(row, weight=1)
+
+        row += 1
+        ttk.Label(content, text="狀態:").grid(row=row, column=0, sticky="ne", **pad)
+        self.status_label = ttk.Label(content, textvariable=self.status_text, wraplength=320, justify="left")
+        self.status_label.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+
+        row += 1
+        ttk.Label(content, text="耗時:").grid(row=row, column=0, sticky="ne", **pad)
+        self.stage_label = ttk.Label(content, textvariable=self.stage_text, wraplength=320, justify="left")
+        self.stage_label.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+
+        row += 1
+        ttk.Label(content, text="警示:").grid(row=row, column=0, sticky="ne", **pad)
+        self.alert_label = ttk.Label(
+            content, textvariable=self.alert_text, wraplength=320, justify="left", foreground="#c92a2a",
+        )
+        self.alert_label.grid(row=row, column=1, columnspan=2, sticky="nsew", **pad)
+
+        row += 1
+        button_frame = ttk.Frame(content)
+        button_frame.grid(row=row, column=0, columnspan=3, sticky="ew", pady=(10, 0))
+        button_frame.columnconfigure(0, weight=1)
+        button_frame.columnconfigure(1, weight=1)
+
+        self.start_btn = ttk.Button(button_frame, text="開始", command=self.start)
+        self.start_btn.grid(row=0, column=0, sticky="ew", padx=(0, 6))
+        ttk.Button(button_frame, text="停止", command=self.stop).grid(row=0, column=1, sticky="ew", padx=(6, 0))
+
+    def _on_resize(self, event):
+        if event.widget is not self:
+            return
+        wrap_padding = 240
+        wraplength = max(event.width - wrap_padding, 220)
+        self.status_label.configure(wraplength=wraplength)
+        self.stage_label.configure(wraplength=wraplength)
+        self.alert_label.configure(wraplength=wraplength)
+        if hasattr(self, "package_hint"):
+            hint_padding = 360
+            self.package_hint.configure(wraplength=max(event.width - hint_padding, 160))
+
+    def _populate_devices(self):
+        self.status_text.set("正在搜尋裝置…")
+        self._executor.submit(self._devices_job)
+
+    def _devices_job(self):
+        try:
+            self._results.put(("devices", (list_adb_devices(), None)))
+        except Exception as e:
+            self._results.put(("devices", (None, str(e))))
+
+    def _apply_devices(self, devices, error):
+        if error is not None:
+            self.device_combo["values"] = []
+            self.selected_device.set("")
+            self.status_text.set(error)
+            return
+        self.device_combo["values"] = devices
+        if devices and (self.selected_device.get() not in devices):
+            self.selected_device.set(devices[0])
+        if not devices:
+            self.selected_device.set("")
+            self.status_text.set("找不到裝置，請確認 adb 連線。")
+        else:
+            self.status_text.set(f"已找到 {len(devices)} 台裝置。")
+
+    def _update_log_target(self, now_dt, serial=None):
+        try:
+            self.logger.update_target(now_dt, serial)
+        except OSError as e:
+            self.status_text.set(f"寫入紀錄失敗: {e}")
+
+    def start(self):
+        if self.is_running:
+            return
+        if not self.selected_device.get():
+            messagebox.showwarning("提示", "請先選擇一台裝置。")
+            return
+        min_ms = STREAM_MIN_INTERVAL_MS if self.stream_mode.get() else 200
+        try:
+            ms = int(self.refresh_ms.get())
+            if ms < min_ms:
+                raise ValueError
+        except Exception:
+            messagebox.showwarning("提示", f"請輸入有效的更新頻率 (>={min_ms} 毫秒)。")
+            return
+
+        adaptive = None
+        if self.adaptive_mode.get() and not self.stream_mode.get():
+            try:
+                adaptive = AdaptivePolicy(int(self.adaptive_min_ms.get()), int(self.adaptive_max_ms.get()))
+                if adaptive.min_ms < 200 or adaptive.max_ms < adaptive.min_ms:
+                    raise ValueError
+            except Exception:
+                messagebox.showwarning("提示", "自適應頻率的最短間隔需 >=200 毫秒且不大於最長間隔。")
+                return
+
+        try:
+            rules = [parse_alert_rule(text) for text in self.alert_rules.get().split(";") if text.strip()]
+        except ValueError as e:
+            messagebox.showwarning("提示", str(e))
+            return
+        self._alerts = AlertEngine(rules) if rules else None
+        self.alert_text.set("無" if rules else "--")
+
+        self._scan = self._build_scan()
+        self.proc_tree.delete(*self.proc_tree.get_children())
+        self.thread_tree.delete(*self.thread_tree.get_children())
+        if self.multi_mode.get():
+            serials = list(self.device_combo["values"])
+            if not serials:
+                messagebox.showwarning("提示", "找不到可監控的裝置。")
+                return
+            self._start_multi(serials, ms, adaptive)
+            return
+
+        if self.stream_mode.get():
+            try:
+                self._stream = StreamSampler(self.selected_device.get(), self.package_name.get().strip(), ms)
+                self._stream.start()
+            except Exception as e:
+                self._stream = None
+                self.status_text.set(str(e))
+                return
+
+        self._reset_sinks()
+        self.is_running = True
+        self._session += 1
+        self._inflight = None
+        self._skipped = 0
+        self._dropped = 0
+        self._stats = StageStats()
+        self._scheduler = DeadlineScheduler(ms / 1000.0)
+        self._adaptive = AdaptiveInterval(adaptive, start_ms=ms) if adaptive is not None else None
+        if self._adaptive is not None:
+            self._scheduler.interval_s = self._adaptive.interval_ms / 1000.0
+        self.status_text.set("監控中…")
+        self.start_btn.configure(state="disabled")
+        self._schedule_next()
+
+    def _build_scan(self):
+        packages = tuple(p.strip() for p in self.extra_packages.get().split(",") if p.strip())
+        try:
+            top_n = max(int(self.top_n.get()), 0)
+            thread_top = max(int(self.thread_top.get()), 0)
+        except (ValueError, tk.TclError):
+            top_n = thread_top = 0
+        if not packages and not top_n and not thread_top:
+            return None
+        return ProcessScan(packages, top_n, self.top_by.get(), thread_top)
+
+    def _start_multi(self, serials, ms, adaptive=None):
+        self._adaptive = None
+        self._reset_sinks()
+        self._stats = StageStats()
+        self.is_running = True
+        self._session += 1
+        self._inflight = None
+        session = self._session
+        self.device_tree.delete(*self.device_tree.get_children())
+        for serial in serials:
+            self.device_tree.insert("", "end", iid=serial, values=(serial, "--", "--", "--", "--", ""))
+
+        def on_result(serial, now_dt, snap, error):
+            self._results.put(("multi", (session, serial, now_dt, snap, error)))
+
+        self._multi = MultiDeviceMonitor(
+            serials, self.package_name.get().strip(), ms, on_result, scan=self._scan, adaptive=adaptive,
+        )
+        self._multi.start()
+        self.status_text.set(f"同時監控 {len(serials)} 台裝置…")
+        self.start_btn.configure(state="disabled")
+
+    def stop(self):
+        self.is_running = False
+        # Anything still in flight belongs to the old session and is dropped.
+        self._session += 1
+        self._inflight = None
+        if self._multi is not None:
+            self._multi.stop()
+            self._multi = None
+        if self.job_after_id is not None:
+            try:
+                self.after_cancel(self.job_after_id)
+            except Exception:
+                pass
+            self.job_after_id = None
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream = None
+        self._close_sinks()
+        self.start_btn.configure(state="normal")
+        self.status_text.set("已停止")
+
+    def _schedule_next(self):
+        if not self.is_running:
+            return
+        if self._stream is not None:
+            self.job_after_id = self.after(min(int(self.refresh_ms.get()), STREAM_DRAIN_MS), self._tick)
+            return
+        if self._adaptive is None:
+            try:
+                self._scheduler.interval_s = int(self.refresh_ms.get()) / 1000.0
+            except (ValueError, tk.TclError):
+                pass
+        delay = self._scheduler.next_delay()
+        self.job_after_id = self.after(max(0, int(delay * 1000.0)), self._tick)
+
+    def _tick(self):
+        serial = self.selected_device.get()
+        if not serial:
+            self.status_text.set("沒有選擇裝置。")
+            self.stop()
+            return
+        try:
+            if self._stream is not None:
+                for now_dt, snap in self._stream.drain():
+                    self._update_log_target(now_dt)
+                    self._apply_sample(now_dt, snap)
+                return
+
+            if self._inflight is not None and not self._inflight.done():
+                self._skipped += 1
+                self.status_text.set(f"上一筆取樣尚未完成，已略過 {self._skipped} 次。")
+                return
+
+            now_dt = datetime.now()
+            pkg = self.package_name.get().strip()
+            self._inflight = self._executor.submit(self._collect_job, self._session, serial, pkg, now_dt, self._scan)
+        except Exception as e:
+            self.status_text.set(str(e))
+        finally:
+            self._schedule_next()
+
+    def _collect_job(self, session, serial, pkg, now_dt, scan=None):
+        try:
+            snap = collect_snapshot(serial, pkg, self._cpu_prev, scan=scan)
+            self._results.put(("sample", (session, now_dt, snap, None)))
+        except Exception as e:
+            self._results.put(("sample", (session, now_dt, None, str(e))))
+
+    def _drain_results(self):
+        while True:
+            try:
+                kind, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "devices":
+                self._apply_devices(*payload)
+            elif kind == "sample":
+                self._handle_sample(*payload)
+            elif kind == "multi":
+                self._handle_multi_sample(*payload)
+        try:
+            self.logger.flush_due()
+        except OSError as e:
+            self.status_text.set(f"寫入紀錄失敗: {e}")
+        if self.logger.archiver is not None:
+            errors = self.logger.archiver.take_errors()
+            if errors:
+                self.status_text.set(f"封存失敗，稍後重試: {errors[-1]}")
+        self.drain_after_id = self.after(UI_DRAIN_MS, self._drain_results)
+
+    def _handle_sample(self, session, now_dt, snap, error):
+        if session != self._session or not self.is_running:
+            return
+        try:
+            stale_ms = max(2 * int(self.refresh_ms.get()), STALE_MIN_MS)
+        except Exception:
+            stale_ms = STALE_MIN_MS
+        age_ms = (datetime.now() - now_dt).total_seconds() * 1000.0
+        if age_ms > stale_ms:
+            self._dropped += 1
+            self.status_text.set(f"取樣耗時 {age_ms:.0f}ms 已過期，捨棄 {self._dropped} 筆。")
+            return
+        if error is not None:
+            self.status_text.set(error)
+            return
+        snap.interval_ms = self._scheduler.interval_s * 1000.0
+        if self._adaptive is not None:
+            self._scheduler.interval_s = self._adaptive.update(now_dt.timestamp(), snap) / 1000.0
+        try:
+            self._update_log_target(now_dt)
+            self._apply_sample(now_dt, snap)
+        except Exception as e:
+            self.status_text.set(str(e))
+
+    def _handle_multi_sample(self, session, serial, now_dt, snap, error):
+        if session != self._session or not self.is_running:
+            return
+        if error is not None:
+            if self.device_tree.exists(serial):
+                self.device_tree.set(serial, "updated", error)
+            return
+        try:
+            self._update_log_target(now_dt, serial)
+            self._apply_sample(now_dt, snap, serial)
+        except Exception as e:
+            self.status_text.set(str(e))
+
+    def _redraw_chart(self):
+        # Only redraws when new samples arrived, the window changed or the
+        # canvas was resized.
+        serial = self.selected_device.get()
+        history = self._histories.get(serial)
+        window_s = CHART_WINDOWS.get(self.chart_window.get(), 300)
+        state = (
+            serial,
+            history.generation if history else -1,
+            window_s,
+            self.chart.winfo_width(),
+            self.chart.winfo_height(),
+        )
+        if state != self._chart_state:
+            self._chart_state = state
+            self.chart.draw(history, window_s)
+        self.chart_after_id = self.after(CHART_REDRAW_MS, self._redraw_chart)
+
+    def _on_close(self):
+        self.stop()
+        for after_id in (self.drain_after_id, self.chart_after_id):
+            if after_id is None:
+                continue
+            try:
+                self.after_cancel(after_id)
+            except Exception:
+                pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+    def _apply_sample(self, now_dt, snap, serial=None):
+        sys_mem = snap.sys_mem
+        proc = snap.proc
+        used_pct = (sys_mem['used_kb'] / sys_mem['total_kb'] * 100.0) if sys_mem['total_kb'] else 0.0
+
+        key = serial if serial is not None else self.selected_device.get()
+        if self.exporter is not None:
+            self.exporter.update(key, now_dt, snap, self.package_name.get().strip())
+        history = self._histories.get(key)
+        if history is None:
+            history = self._histories[key] = DeviceHistory()
+        metrics = sample_metrics(snap)
+        history.record(now_dt.timestamp(), metrics)
+
+        if serial is not None and self.device_tree.exists(serial):
+            self.device_tree.item(serial, values=(
+                serial,
+                f"{snap.temp_c:.1f}" if snap.temp_c is not None else "--",
+                f"{used_pct:.1f}",
+                f"{proc['res_mb']:.1f}" if proc and proc.get('res_mb') is not None else "--",
+                f"{proc['cpu_percent']:.1f}" if proc and proc.get('cpu_percent') is not None else "--",
+                now_dt.strftime('%H:%M:%S'),
+            ))
+
+        if serial is None or serial == self.selected_device.get():
+            self.current_temp.set(f"{snap.temp_c:.1f}" if snap.temp_c is not None else "--")
+            self.mem_total_mb.set(f"{sys_mem['total_kb']/1024:.0f}")
+            self.mem_avail_mb.set(f"{sys_mem['free_kb']/1024:.0f}")
+            self.mem_usage_pct.set(f"{used_pct:.1f}%")
+            if proc and proc.get('res_mb') is not None:
+                self.app_pss_mb.set(f"{proc['res_mb']:.1f}")
+            else:
+                self.app_pss_mb.set("--")
+
+        if serial is None or serial == self.selected_device.get():
+            if snap.thermal:
+                self.thermal_text.set(" / ".join(
+                    f"{THERMAL_LABELS[series]} {snap.thermal[series]:.1f}"
+                    for series in THERMAL_SERIES if series in snap.thermal
+                ))
+            if snap.packages or snap.top:
+                self._show_processes(snap)
+            if snap.threads:
+                self.thread_tree.delete(*self.thread_tree.get_children())
+                for thread in snap.threads:
+                    self.thread_tree.insert("", "end", values=(
+                        thread['tid'], thread['name'], f"{thread['cpu_percent']:.1f}",
+                    ))
+
+        snap.timings.update(self.logger.timings)
+        row = format_log_row(now_dt, sys_mem, proc)
+        if self.logger.stage_columns:
+            row += format_stage_columns(snap.timings, self._missed_slots())
+        if self.logger.interval_column:
+            row += format_interval_column(snap)
+        if serial is not None:
+            print(serial + ',' + ','.join(row))
+        else:
+            print(','.join(row))
+
+        self._maybe_log(now_dt, sys_mem, proc, row, serial)
+        if self.logging_enabled.get():
+            try:
+                if snap.threads and self.thread_log.get():
+                    self.logger.write_threads(now_dt, proc['pid'], snap.threads, serial)
+                if snap.thermal and self.thermal_log.get():
+                    self.logger.write_thermal(now_dt, snap.thermal, serial)
+            except OSError as e:
+                self.status_text.set(f"寫入紀錄失敗: {e}")
+        if self._alerts is not None:
+            self._check_alerts(key, now_dt, metrics)
+        self._stats.record(snap.timings)
+        self.stage_text.set(self._stats.format(self._missed_slots()))
+        if serial is None:
+            status = f"最後更新: {now_dt.strftime('%H:%M:%S')}"
+            if self._adaptive is not None:
+                status += f"（間隔 {self._scheduler.interval_s * 1000.0:.0f}ms，{self._adaptive.reason}）"
+            self.status_text.set(status)
+
+    def _check_alerts(self, serial, now_dt, metrics):
+        events = self._alerts.evaluate(serial, now_dt.timestamp(), metrics)
+        if not events:
+            return
+        if self.logging_enabled.get():
+            try:
+                for event in events:
+                    self.logger.write_alert(event)
+            except OSError as e:
+                self.status_text.set(f"寫入紀錄失敗: {e}")
+        active = self._alerts.active()
+        if not active:
+            self.alert_text.set("無")
+            return
+        multi = self._multi is not None
+        self.alert_text.set("\n".join(
+            (f"[{key}] " if multi else "") + (f"{name} ({value:.1f})" if value is not None else name)
+            for key, name, value in active
+        ))
+
+    def _show_processes(self, snap):
+        self.proc_tree.delete(*self.proc_tree.get_children())
+
+        def fmt(value):
+            return f"{value:.1f}" if value is not None else "--"
+
+        rows = [(name, proc) for name, proc in snap.packages.items()]
+        rows += [(proc['name'], proc) for proc in snap.top]
+        for name, proc in rows:
+            self.proc_tree.insert("", "end", values=(
+                name,
+                proc['pid'] if proc['pid'] is not None else "--",
+                fmt(proc['cpu_percent']),
+                fmt(proc['res_mb']),
+                fmt(proc['mem_percent']) if not proc['error_message'] else proc['error_message'],
+            ))
+
+    def _missed_slots(self):
+        if self._multi is not None:
+            return sum(state.skipped for state in self._multi.devices.values())
+        missed = self._skipped
+        if self._scheduler is not None:
+            missed += self._scheduler.missed
+        return missed
+
+    def _maybe_log(self, now_dt, sys_mem, proc, row, serial=None):
+        if not self.logging_enabled.get():
+            return
+        try:
+            self.logger.write(now_dt, sys_mem, proc, row, serial)
+        except Exception as e:
+            self.status_text.set(f"寫入紀錄失敗: {e}")
+
+    def _reset_sinks(self):
+        self.logger.reset(
+            self.log_format.get(), self.stage_columns.get(), self.adaptive_mode.get() and not self.stream_mode.get(),
+        )
+
+    def _close_sinks(self):
+        self.logger.close()
+
+
+def run_gui(log_root=None, metrics_host=None, metrics_port=None, archiver=None, hours=LOG_RETENTION_HOURS,
+            flush=None):
+    exporter = None
+    if metrics_port is not None:
+        exporter = MetricsExporter(metrics_host or EXPORTER_HOST, metrics_port).start()
+        print(f"指標端點: http://{exporter.host}:{exporter.port}/metrics")
+    app = App(log_root=log_root, exporter=exporter, archiver=archiver, hours=hours, flush=flush)
+    try:
+        app.mainloop()
+    finally:
+        app._close_sinks()
+        if exporter is not None:
+            exporter.stop()
+        if archiver is not None:
+            archiver.close(ARCHIVE_CLOSE_TIMEOUT_S)
@@ -22,22 +22,33 @@ else
   fi
 fi
 
-# 檢查 tkinter 是否可用
+NEED_TK=1
+for arg in "$@"; do
+  if [[ "${arg}" == "--headless" || "${arg}" == "--export-csv" || "${arg}" == "-h" || "${arg}" == "--help" ]]; then
+    NEED_TK=0
+  fi
+done
+
+# 檢查 tkinter 是否可用（--headless 不需要）
+if [[ "${NEED_TK}" == "1" ]]; then
 "${PYTHON}" - <<'PY'
 import sys
 try:
     import tkinter  # noqa: F401
 except Exception as exc:
     print("[錯誤] Tkinter 無法使用: {}".format(exc), file=sys.stderr)
-    print("請依 README 的安裝步驟重新安裝 Python/Tk。", file=sys.stderr)
+    print("請依 README 的安裝步驟重新安裝 Python/Tk，或改用 ./run.sh --headless。", file=sys.stderr)
     sys.exit(1)
 PY
+fi
 
 # 檢查 adb 是否存在
 if ! command -v adb >/dev/null 2>&1; then
   echo "[警告] 找不到 adb 指令，請確認已安裝 Android Platform Tools 並設定 PATH。" >&2
 fi
 
-echo "使用 Python: ${PYTHON}"
-echo "啟動手機溫度/記憶體監控介面..."
+echo "使用 Python: ${PYTHON}" >&2
+if [[ "${NEED_TK}" == "1" ]]; then
+  echo "啟動手機溫度/記憶體監控介面..." >&2
+fi
 exec "${PYTHON}" "${APP_PATH}" "$@"
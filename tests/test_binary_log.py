@@ -0,0 +1,25 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import phone_temp_monitor as ptm
+
+
+def test_reader_close_with_blocks_held(tmp_path):
+    start = datetime.now().astimezone().replace(minute=0, second=0, microsecond=0)
+    logger = ptm.MetricsLogger(str(tmp_path), "binary", archiver=None)
+    for i in range(3):
+        now_dt = start + timedelta(seconds=i)
+        logger.update_target(now_dt)
+        logger.write(now_dt, {"total_kb": 8000.0, "used_kb": 4000.0 + i, "free_kb": 4000.0 - i}, None)
+    logger.close()
+    (path,) = [os.path.join(d, f) for d, _, files in os.walk(tmp_path) for f in files if f.endswith(ptm.BIN_EXT)]
+
+    reader = ptm.BinarySegmentReader(path)
+    blocks = list(reader.iter_blocks())
+    part = list(reader.iter_blocks(start.timestamp() + 1))
+    assert sum(len(b["ts"]) for b in blocks) == 3
+    assert list(part[0]["ts"]) == [start.timestamp() + 1, start.timestamp() + 2]
+    reader.close()
@@ -0,0 +1,38 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_query
+import phone_temp_monitor as ptm
+
+
+def _write_binary_log(root, start, count):
+    logger = ptm.MetricsLogger(str(root), "binary", archiver=None)
+    try:
+        for i in range(count):
+            now_dt = start + timedelta(seconds=i)
+            proc = ptm._new_proc_result()
+            proc.update(pid=1000, virt_mb=100.0, res_mb=200.0 + i, shr_mb=10.0, cpu_percent=float(i), mem_percent=1.0)
+            sys_mem = {"total_kb": 8000.0, "used_kb": 4000.0 + i, "free_kb": 4000.0 - i}
+            logger.update_target(now_dt)
+            logger.write(now_dt, sys_mem, proc)
+    finally:
+        logger.close()
+
+
+def test_binary_segment_round_trip(tmp_path):
+    start = datetime.now().astimezone().replace(minute=0, second=0, microsecond=0)
+    _write_binary_log(tmp_path, start, 10)
+    columns = ["adb_sys_used_kb", "adb_proc_res_mb", "adb_proc_pid"]
+
+    (summary,) = log_query.summarize(log_query.iter_chunks(str(tmp_path), columns), columns)
+    assert summary["rows"] == 10
+    assert summary["columns"]["adb_sys_used_kb"]["min"] == 4000.0
+    assert summary["columns"]["adb_proc_res_mb"]["max"] == 209.0
+    assert summary["columns"]["adb_proc_pid"]["mean"] == 1000.0
+
+    buckets = list(log_query.resample(log_query.iter_chunks(str(tmp_path), columns), "adb_sys_used_kb", 5, "max"))
+    assert [value for _, _, value in buckets] == [4004.0, 4009.0]
+